@@ -0,0 +1,104 @@
+""" Import time benchmark for the core billing path
+
+Loads and validates a TariffRegime in a fresh interpreter, reports the
+cumulative import time of each ts_tariffs module (from python -X importtime)
+and fails if any optional dependency was imported, or if the total time
+exceeds --max-ms.
+
+Usage:
+    python benchmarks/import_time.py [--max-ms 1500] [--repeat 5]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Optional dependencies which must not be imported by the core path
+# (pyarrow is not listed as pandas imports it itself when installed)
+FORBIDDEN_MODULES = ('matplotlib', 'boto3', 'botocore', 'scipy')
+
+CORE_PATH = """
+import json, sys
+FORBIDDEN = FORBIDDEN_MODULES
+from ts_tariffs.loading import TariffLoader
+regime = TariffLoader().regime({
+    'name': 'benchmark_regime',
+    'tariffs': [{
+        'name': 'retail_tou',
+        'charge_type': 'TouTariff',
+        'consumption_unit': 'kWh',
+        'sample_rate': {'multiplier': 30, 'base_freq': 'minutes'},
+        'rate_unit': 'dollars / kWh',
+        'adjustment_factor': 1.0,
+        'tou': {
+            'time_bins': [7, 21, 24],
+            'bin_rates': [0.06, 0.10, 0.06],
+            'bin_labels': ['off-peak', 'peak', 'off-peak'],
+        },
+    }],
+})
+print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in FORBIDDEN)))
+"""
+
+
+def run_core_path():
+    code = CORE_PATH.replace('FORBIDDEN_MODULES', repr(set(FORBIDDEN_MODULES)))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).resolve().parents[1],
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return elapsed_ms, json.loads(result.stdout), result.stderr
+
+
+def module_import_times(importtime_log: str) -> dict:
+    """ Cumulative import time (ms) of each top level package and each
+    ts_tariffs module
+    """
+    times = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # Nesting is shown by two spaces of indentation per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 0 or name.startswith('ts_tariffs'):
+            times[name] = int(cumulative_us) / 1000
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-ms', type=float, default=None, help='Fail if the best run exceeds this')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [run_core_path() for _ in range(args.repeat)]
+    best_ms = min(run[0] for run in runs)
+    forbidden = sorted({m for run in runs for m in run[1]})
+    times = module_import_times(runs[0][2])
+
+    for name, ms in sorted(times.items(), key=lambda x: -x[1])[:15]:
+        print(f'{ms:10.1f} ms  {name}')
+    print(f'Best of {args.repeat}: {best_ms:.1f} ms to load and validate a TariffRegime')
+
+    failed = False
+    if forbidden:
+        print(f'FAIL: optional dependencies imported by core path: {forbidden}')
+        failed = True
+    if args.max_ms is not None and best_ms > args.max_ms:
+        print(f'FAIL: {best_ms:.1f} ms exceeds budget of {args.max_ms:.1f} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
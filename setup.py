@@ -18,13 +18,31 @@ setup(
     ],
     packages=find_packages(exclude=('tests',)),
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['ts-tariffs=ts_tariffs.cli:main'],
+    },
     install_requires=[
-        'boto3 >= 1.18.44',
-        'matplotlib >= 3.4.3',
         'numpy >= 1.21.2',
         'pandas >= 1.3.3',
-        'scipy >= 1.7.1',
-        'pyarrow >= 5.0.0',
+        'python-dateutil >= 2.8.2',
         'pydantic >= 1.8.2',
-   ]
+    ],
+    # Heavy dependencies not needed by the core billing path are optional,
+    # keeping installs (e.g. for serverless functions) small
+    extras_require={
+        'arrow': ['pyarrow >= 5.0.0'],
+        'jit': ['numba >= 0.54.0'],
+        'examples': [
+            'boto3 >= 1.18.44',
+            'matplotlib >= 3.4.3',
+            'scipy >= 1.7.1',
+        ],
+        'all': [
+            'pyarrow >= 5.0.0',
+            'numba >= 0.54.0',
+            'boto3 >= 1.18.44',
+            'matplotlib >= 3.4.3',
+            'scipy >= 1.7.1',
+        ],
+    },
 )
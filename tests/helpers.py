@@ -0,0 +1,86 @@
+""" Meter data and tariffs shared by the test modules
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from ts_tariffs.meters import MeterData
+
+HALF_HOUR = timedelta(minutes=30)
+
+COMMON = dict(
+    consumption_unit='kWh',
+    rate_unit='dollars / kWh',
+    sample_rate=HALF_HOUR,
+    adjustment_factor=1.0,
+)
+
+
+def half_hourly_index(start='2021-01-01', end='2021-04-01', tz=None) -> pd.DatetimeIndex:
+    return pd.date_range(start, end, freq='30min', inclusive='left', tz=tz)
+
+
+def random_meter(
+        index: pd.DatetimeIndex = None,
+        seed: int = 0,
+        offset: float = 0.0,
+        name: str = 'energy',
+        **kwargs
+) -> MeterData:
+    """ Half hourly meter of uniform random values (shifted by offset, e.g.
+    negative for exports)
+    """
+    index = half_hourly_index() if index is None else index
+    values = np.random.default_rng(seed).random(len(index)) + offset
+    return MeterData(name, pd.Series(values, index=index), HALF_HOUR, 'kWh', **kwargs)
+
+
+def regime_tariffs(prices: MeterData = None) -> list:
+    """ One or more tariffs of each type, all in kWh. A spot price tariff is
+    included if prices are given
+    """
+    from ts_tariffs.tariffs import SingleRateTariff, TouTariff, DemandTariff, BlockTariff, ConnectionTariff, \
+        CapacityTariff, CriticalPeakDemandTariff, RatchetDemandTariff, RollingDemandTariff, TopNDemandTariff, \
+        NetMeteringTariff, SpotPriceTariff
+    from ts_tariffs.ts_utils import TimeWindow, DateWindow, DatetimeWindow
+    from ts_tariffs.utils import Block
+
+    tou = dict(time_bins=[7, 21, 24], bin_rates=[0.06, 0.1, 0.06], bin_labels=['off', 'peak', 'off'])
+    tariffs = [
+        SingleRateTariff(name='single', charge_type='SingleRateTariff', rate=0.2, **COMMON),
+        TouTariff(name='tou', charge_type='TouTariff', tou=tou, **COMMON),
+        DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='month',
+                     time_window=TimeWindow(15, 21), **COMMON),
+        DemandTariff(name='demand_pro_rata', charge_type='DemandTariff', rate=10, frequency_applied='month',
+                     pro_rata=True, **COMMON),
+        BlockTariff(name='block', charge_type='BlockTariff', frequency_applied='month',
+                    blocks=[Block(0, 300), Block(300, float('inf'))], bin_rates=[0.2, 0.3],
+                    bin_labels=['first', 'second'], **COMMON),
+        ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.0, frequency_applied='day',
+                         **COMMON),
+        ConnectionTariff(name='connection_pro_rata', charge_type='ConnectionTariff', rate=30.0,
+                         frequency_applied='month', pro_rata=True, **COMMON),
+        CapacityTariff(name='capacity', charge_type='CapacityTariff', capacity=5, rate=1.0,
+                       frequency_applied='month', **COMMON),
+        CriticalPeakDemandTariff(
+            name='critical', charge_type='CriticalPeakDemandTariff', rate=19, frequency_applied='month',
+            period_active=DateWindow((2021, 2, 1), (2021, 3, 31)),
+            critical_period=DateWindow((2021, 1, 1), (2021, 1, 31)),
+            critical_peak_windows=[DatetimeWindow((2021, 1, 5, 15), (2021, 1, 5, 19)),
+                                   DatetimeWindow((2021, 1, 20, 15), (2021, 1, 20, 19))],
+            **COMMON
+        ),
+        RatchetDemandTariff(name='ratchet', charge_type='RatchetDemandTariff', rate=5, frequency_applied='month',
+                            ratchet_fraction=0.8, lookback_periods=3, carried_peaks=[1.5], **COMMON),
+        RollingDemandTariff(name='rolling', charge_type='RollingDemandTariff', rate=3, frequency_applied='month',
+                            window=timedelta(hours=2), **COMMON),
+        TopNDemandTariff(name='top_n', charge_type='TopNDemandTariff', rate=3, frequency_applied='month',
+                         n_peaks=4, **COMMON),
+        NetMeteringTariff(name='net', charge_type='NetMeteringTariff', import_rate=0.2, export_tou=tou,
+                          netting_frequency='month', **COMMON),
+    ]
+    if prices is not None:
+        tariffs.append(SpotPriceTariff(name='spot', charge_type='SpotPriceTariff', prices=prices,
+                                       loss_factors=1.05, **COMMON))
+    return tariffs
@@ -0,0 +1,132 @@
+""" Billing cycle totals against pandas groupbys over cycle labels
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import MeterData, TimeGrid
+from ts_tariffs.optimisation import ScheduleEvaluator
+from ts_tariffs.tariffs import DemandTariff, BlockTariff, ConnectionTariff, CapacityTariff, RatchetDemandTariff, \
+    RollingDemandTariff, TopNDemandTariff, NetMeteringTariff
+from ts_tariffs.ts_utils import TimeWindow
+from ts_tariffs.utils import Block
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index
+
+# Irregular cycles, with data before the first and after the last boundary
+CYCLES = [pd.Timestamp(t).to_pydatetime() for t in ('2021-01-07', '2021-02-11 12:00', '2021-03-09', '2021-03-30')]
+
+TARIFFS = {
+    'demand': DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='cycle', **COMMON),
+    'demand_window': DemandTariff(name='demand_window', charge_type='DemandTariff', rate=10,
+                                  frequency_applied='cycle', time_window=TimeWindow(15, 21), **COMMON),
+    'block': BlockTariff(name='block', charge_type='BlockTariff', frequency_applied='cycle',
+                         blocks=[Block(0, 300), Block(300, float('inf'))], bin_rates=[0.2, 0.3],
+                         bin_labels=['first', 'second'], **COMMON),
+    'connection': ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=30.0,
+                                   frequency_applied='cycle', **COMMON),
+    'capacity': CapacityTariff(name='capacity', charge_type='CapacityTariff', capacity=5, rate=2.0,
+                               frequency_applied='cycle', **COMMON),
+    'ratchet': RatchetDemandTariff(name='ratchet', charge_type='RatchetDemandTariff', rate=10,
+                                   frequency_applied='cycle', ratchet_fraction=0.8, lookback_periods=2, **COMMON),
+    'rolling': RollingDemandTariff(name='rolling', charge_type='RollingDemandTariff', rate=3,
+                                   frequency_applied='cycle', window=timedelta(hours=2), **COMMON),
+    'top_n': TopNDemandTariff(name='top_n', charge_type='TopNDemandTariff', rate=3, frequency_applied='cycle',
+                              n_peaks=4, **COMMON),
+    'net': NetMeteringTariff(name='net', charge_type='NetMeteringTariff', import_rate=0.2, export_rate=0.05,
+                             netting_frequency='cycle', **COMMON),
+}
+
+
+@pytest.fixture
+def ts():
+    # Three days without data in the second cycle, and signed values for net metering
+    index = half_hourly_index('2021-01-01', '2021-04-10')
+    index = index[(index < '2021-02-15') | (index >= '2021-02-18')]
+    ts = pd.Series(np.random.default_rng(0).normal(0.2, 0.5, len(index)), index=index)
+    # A peak after the mid-day cycle boundary, whose day is split between cycles
+    ts['2021-02-11 15:00'] = 5.0
+    return ts
+
+
+@pytest.fixture
+def meter(ts):
+    return MeterData('energy', ts, HALF_HOUR, 'kWh', billing_cycles=CYCLES)
+
+
+def by_cycle(ts):
+    """ Data within the cycles, grouped by cycle
+    """
+    cycles = pd.cut(ts.index, pd.DatetimeIndex(CYCLES), right=False)
+    return ts[~pd.isna(cycles)].groupby(cycles[~pd.isna(cycles)], observed=True)
+
+
+def expected_total(name, ts):
+    if name == 'demand':
+        return by_cycle(ts).max().sum() * 10
+    if name == 'demand_window':
+        return by_cycle(ts[(ts.index.hour >= 15) & (ts.index.hour < 21)]).max().sum() * 10
+    if name == 'block':
+        totals = by_cycle(ts).sum()
+        return (totals.clip(0, 300) * 0.2 + (totals - 300).clip(0, None) * 0.3).sum()
+    if name == 'connection':
+        return by_cycle(ts).ngroups * 30.0
+    if name == 'capacity':
+        return by_cycle(ts).ngroups * 5 * 2.0
+    if name == 'ratchet':
+        peaks = by_cycle(ts).max().to_numpy()
+        ratchet = [0.8 * peaks[max(k - 2, 0):k].max() if k else 0.0 for k in range(len(peaks))]
+        return np.maximum(peaks, ratchet).sum() * 10
+    if name == 'rolling':
+        # Windows ending in a cycle may start before it
+        return by_cycle(ts.rolling(4).mean()).max().sum() * 3
+    if name == 'top_n':
+        daily = by_cycle(ts).apply(lambda cycle: cycle.groupby(cycle.index.date).max().nlargest(4).mean())
+        return daily.sum() * 3
+    if name == 'net':
+        net = by_cycle(ts).sum()
+        return (net.clip(0, None) * 0.2 - (-net).clip(0, None) * 0.05).sum()
+    raise KeyError(name)
+
+
+@pytest.mark.parametrize('name', list(TARIFFS))
+def test_cycle_totals(name, meter, ts):
+    tariff = TARIFFS[name]
+    assert float(np.squeeze(tariff.apply(meter).total)) == pytest.approx(expected_total(name, ts))
+    assert tariff.charge_table(meter).amount.sum() == pytest.approx(expected_total(name, ts))
+
+
+@pytest.mark.parametrize('name', list(TARIFFS))
+def test_cycle_batch_totals(name, meter, ts):
+    tariff = TARIFFS[name]
+    grid = TimeGrid(ts.index, HALF_HOUR, CYCLES)
+    rows = np.vstack([ts.to_numpy(), ts.to_numpy()[::-1]])
+    for row, total in zip(rows, tariff.batch_totals(rows, grid)):
+        assert total == pytest.approx(expected_total(name, pd.Series(row, index=ts.index)))
+
+
+@pytest.mark.parametrize('name', ['rolling', 'top_n', 'net'])
+def test_cycle_marginal_costs(name, ts):
+    # Marginal costs are only on intervals within the cycles
+    grid = TimeGrid(ts.index, HALF_HOUR, CYCLES)
+    costs = TARIFFS[name].marginal_costs(ts.to_numpy(), grid)
+    outside = (ts.index < CYCLES[0]) | (ts.index >= CYCLES[-1])
+    assert costs[~outside].any() and not costs[outside].any()
+    evaluator = ScheduleEvaluator(TariffRegime('regime', [TARIFFS[name]]), ts.to_numpy(), grid)
+    assert evaluator.total == pytest.approx(expected_total(name, ts))
+    positions = [int(np.argmax(costs)), 10, len(ts) - 10]
+    updated = ts.copy()
+    updated.iloc[positions] += 2.0
+    assert evaluator.update(positions, updated.iloc[positions]) == pytest.approx(expected_total(name, updated))
+
+
+def test_apply_batch_with_cycles(ts):
+    rows = np.vstack([ts.to_numpy(), ts.to_numpy()[::-1]])
+    rolling = TARIFFS['rolling'].apply_batch(rows, ts.index, HALF_HOUR, CYCLES)
+    top_n = TARIFFS['top_n'].apply_batch(rows, ts.index, CYCLES)
+    for k, row in enumerate(rows):
+        row = pd.Series(row, index=ts.index)
+        assert rolling[k].sum() == pytest.approx(expected_total('rolling', row))
+        assert top_n[k].sum() == pytest.approx(expected_total('top_n', row))
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import Bill, BillCompare, BillsTable
+from ts_tariffs.tariffs import AppliedCharge
+
+
+def bill(name, totals):
+    return Bill(name, [AppliedCharge(charge, pd.Series(dtype=float), '$', 'kWh', total) for charge, total in totals.items()])
+
+
+def test_wide_dataframe_matches_bill_series():
+    bills = [bill('a', {'x': 1.0, 'y': 2.0}), bill('b', {'y': 3.0, 'z': 4.0})]
+    expected = pd.concat([b.as_series for b in bills], axis=1)
+    pd.testing.assert_frame_equal(BillCompare(bills).as_dataframe, expected)
+
+
+def test_wide_dataframe_rejects_duplicate_pairs():
+    table = BillsTable(['a', 'a'], ['x', 'x'], [1.0, 2.0])
+    with pytest.raises(ValueError):
+        table.as_wide_dataframe
+
+
+def test_compare_rejects_duplicate_bill_names():
+    with pytest.raises(ValueError):
+        BillCompare([bill('a', {'x': 1.0}), bill('a', {'y': 2.0})]).as_dataframe
+
+
+def test_totals_and_filter():
+    table = BillsTable.from_bills([bill('a', {'x': 1.0, 'y': 2.0}), bill('b', {'x': 3.0})])
+    assert table.bill_totals().to_dict() == {'a': 3.0, 'b': 3.0}
+    assert table.charge_totals().to_dict() == {'x': 4.0, 'y': 2.0}
+    filtered = table.filter(charge_names=['x'], min_total=2.0)
+    assert list(filtered.bill_names) == ['b']
+    np.testing.assert_array_equal(filtered.totals, [3.0])
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.charge_table import ChargeTable, arrow_schema
+from ts_tariffs.meters import Meters
+from ts_tariffs.tariffs import Tariff, AppliedCharge
+from tests.helpers import COMMON, half_hourly_index, random_meter, regime_tariffs
+
+pytestmark = pytest.mark.filterwarnings('ignore:The critical period tariff')
+
+PRICES = random_meter(half_hourly_index('2020-12-01', '2021-05-01'), seed=1, name='prices')
+
+
+@dataclass
+class FlatTariff(Tariff):
+    """ Tariff without its own charge table
+    """
+    rate: float
+
+    def apply(self, consumption):
+        total = consumption.tseries.sum() * self.rate
+        return AppliedCharge(self.name, consumption.tseries * self.rate, self.rate_unit, self.consumption_unit, total)
+
+
+def meters():
+    index = half_hourly_index()
+    return {
+        'contiguous': random_meter(),
+        # Three days without data
+        'gapped': random_meter(index[(index < '2021-02-10') | (index >= '2021-02-13')], seed=2),
+        # Part months at either end
+        'part_months': random_meter(half_hourly_index('2021-01-17 08:00', '2021-03-09 13:00'), seed=3),
+    }
+
+
+def tariff_total(tariff, meter):
+    return float(np.squeeze(tariff.apply(meter).total))
+
+
+@pytest.mark.parametrize('meter_name', list(meters()))
+@pytest.mark.parametrize('tariff', regime_tariffs(PRICES), ids=lambda tariff: tariff.name)
+def test_amounts_sum_to_the_applied_total(tariff, meter_name):
+    meter = meters()[meter_name]
+    table = tariff.charge_table(meter)
+    assert len(table)
+    assert set(table.charge.categories) == {tariff.name}
+    np.testing.assert_allclose(table.amount, table.quantity * table.rate)
+    # Critical peak windows outside the data give NaN rows, which apply() and charge_totals() skip
+    assert np.nansum(table.amount) == pytest.approx(tariff_total(tariff, meter), rel=1e-9)
+    assert (table.period_start < table.period_end).all()
+
+
+def test_fallback_is_a_single_charge_over_the_consumption():
+    tariff = FlatTariff(name='flat', charge_type='FlatTariff', rate=0.3, **COMMON)
+    meter = random_meter()
+    table = tariff.charge_table(meter)
+    assert len(table) == 1 and list(table.component) == ['charge']
+    assert table.amount.sum() == pytest.approx(tariff_total(tariff, meter))
+    index = meter.tseries.index
+    assert table.period_start[0] == index[0]
+    assert table.period_end[0] == index[-1] + pd.Timedelta('30min')
+
+
+def test_fallback_of_no_consumption_is_empty():
+    tariff = FlatTariff(name='flat', charge_type='FlatTariff', rate=0.3, **COMMON)
+    assert len(tariff.charge_table(random_meter(half_hourly_index()[:0]))) == 0
+
+
+def test_regime_table_sums_to_the_bill():
+    tariffs = regime_tariffs(PRICES) + [FlatTariff(name='flat', charge_type='FlatTariff', rate=0.3, **COMMON)]
+    regime = TariffRegime('regime', tariffs)
+    meters = Meters({'energy': random_meter(seed=4)})
+    table = regime.charge_table('meter', meters)
+    bill = regime.calculate_bill('meter', meters)
+    assert set(table.bill.categories) == {'meter'}
+    totals = table.charge_totals().loc['meter']
+    assert list(totals.index) == bill.item_names
+    np.testing.assert_allclose(totals.to_numpy(), list(bill.itemised_as_dict.values()), rtol=1e-9)
+
+
+def test_concatenated_tables_convert_to_arrow():
+    meter = random_meter()
+    table = ChargeTable.concat(tariff.charge_table(meter).with_bill(f'bill_{k}')
+                               for k, tariff in enumerate(regime_tariffs(PRICES)))
+    arrow = table.to_arrow()
+    assert arrow.schema.equals(arrow_schema())
+    assert arrow.num_rows == len(table)
+    np.testing.assert_array_equal(arrow.column('amount').to_numpy(), table.amount)
@@ -0,0 +1,104 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.cli import ResultWriter, bill_meter_file, main
+from ts_tariffs.loading import TariffLoader
+
+SAMPLE_RATE = {'multiplier': 30, 'base_freq': 'minutes'}
+CHANNELS = {'energy': 'kWh'}
+
+
+@pytest.fixture
+def regime_path(tmp_path):
+    common = dict(rate_unit='$/kWh', sample_rate=SAMPLE_RATE, adjustment_factor=1.0)
+    regime = {'name': 'regime', 'tariffs': [
+        dict(name='single', charge_type='SingleRateTariff', rate=0.2, consumption_unit='kWh', **common),
+        dict(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='month',
+             consumption_unit='kWh', **common),
+    ]}
+    path = tmp_path / 'regime.json'
+    path.write_text(json.dumps(regime))
+    return str(path)
+
+
+@pytest.fixture
+def meter_paths(tmp_path):
+    index = pd.date_range('2021-01-01', '2021-03-01', freq='30min', inclusive='left')
+    rng = np.random.default_rng(0)
+    (tmp_path / 'meters').mkdir()
+    paths = []
+    for i in range(5):
+        df = pd.DataFrame({'datetime': index, 'energy': rng.random(len(index))})
+        path = tmp_path / 'meters' / f'meter_{i}.{"parquet" if i % 2 else "csv"}'
+        if i % 2:
+            df.to_parquet(path)
+        else:
+            df.to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+def read_output(path):
+    return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+
+
+def run(regime_path, meter_paths, output, checkpoint):
+    return main([regime_path, *meter_paths, '-o', output, '-c', 'energy=kWh',
+                 '--checkpoint', checkpoint, '-j', '1', '-q'])
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'parquet'])
+def test_bills_every_meter(tmp_path, regime_path, meter_paths, suffix):
+    output = str(tmp_path / f'bills.{suffix}')
+    assert run(regime_path, meter_paths, output, str(tmp_path / 'checkpoint')) == 0
+    rows = read_output(output)
+    assert sorted(rows['meter_file'].unique()) == sorted(meter_paths)
+    assert len(rows) == 2 * len(meter_paths)
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'parquet'])
+def test_resume_after_kill_keeps_every_meter_once(tmp_path, regime_path, meter_paths, suffix):
+    output = str(tmp_path / f'bills.{suffix}')
+    checkpoint = tmp_path / 'checkpoint'
+    regime = TariffLoader().load_regime(regime_path)
+    # A run killed before closing its writer: two meters checkpointed, a
+    # third written (and buffered or in the output) but not checkpointed
+    writer = ResultWriter(output, batch_size=2)
+    written = []
+    for path in meter_paths[:3]:
+        written += writer.write(path, bill_meter_file(path, CHANNELS, 'datetime', None, regime))
+    checkpoint.write_text(''.join(path + '\n' for path in written[:2]))
+    if suffix == 'csv':
+        assert len(read_output(output)) == 6
+
+    assert run(regime_path, meter_paths, output, str(checkpoint)) == 0
+    rows = read_output(output)
+    assert rows.groupby('meter_file').size().to_dict() == {path: 2 for path in meter_paths}
+
+
+def test_unmerged_parts_are_merged_on_resume(tmp_path, regime_path, meter_paths):
+    output = str(tmp_path / 'bills.parquet')
+    checkpoint = tmp_path / 'checkpoint'
+    regime = TariffLoader().load_regime(regime_path)
+    writer = ResultWriter(output, batch_size=1)
+    done = []
+    for path in meter_paths[:2]:
+        done += writer.write(path, bill_meter_file(path, CHANNELS, 'datetime', None, regime))
+    checkpoint.write_text(''.join(path + '\n' for path in done))
+
+    resumed = ResultWriter(output, set(done))
+    assert resumed.completed == set(meter_paths[:2])
+    resumed.close()
+    assert sorted(read_output(output)['meter_file'].unique()) == sorted(meter_paths[:2])
+
+
+def test_checkpoint_without_rows_is_rebilled(tmp_path, regime_path, meter_paths):
+    output = str(tmp_path / 'bills.parquet')
+    checkpoint = tmp_path / 'checkpoint'
+    # Checkpointed, but the rows never reached the output
+    checkpoint.write_text(meter_paths[0] + '\n')
+    assert run(regime_path, meter_paths, output, str(checkpoint)) == 0
+    assert sorted(read_output(output)['meter_file'].unique()) == sorted(meter_paths)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.meters import MeterData
+from ts_tariffs.tariffs import DemandTariff
+from ts_tariffs.ts_utils import TimeWindow
+
+COMMON = dict(consumption_unit='kWh', rate_unit='dollars / kWh', sample_rate=timedelta(minutes=30),
+              adjustment_factor=1.0)
+
+
+@pytest.fixture
+def ts():
+    index = pd.date_range('2021-01-01', '2021-04-01', freq='30min', inclusive='left')
+    return pd.Series(np.random.default_rng(0).random(len(index)), index=index)
+
+
+@pytest.mark.parametrize('time_window', [None, TimeWindow(15, 21)])
+def test_charge_ts_is_a_series_of_period_charges(ts, time_window):
+    tariff = DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='month',
+                          time_window=time_window, **COMMON)
+    applied = tariff.apply(MeterData('energy', ts, timedelta(minutes=30), 'kWh'))
+    if time_window is not None:
+        ts = ts[(ts.index.hour >= 15) & (ts.index.hour < 21)]
+    expected = ts.groupby([ts.index.year, ts.index.month]).max() * 10
+
+    assert isinstance(applied.charge_ts, pd.Series) and applied.charge_ts.name == 'charge'
+    assert applied.charge_ts.index.tolist() == [(2021, 1), (2021, 2), (2021, 3)]
+    np.testing.assert_allclose(applied.charge_ts.to_numpy(), expected.to_numpy())
+    assert np.ndim(applied.total) == 0 and applied.total == pytest.approx(expected.sum())
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.ensemble import bill_ensemble
+from ts_tariffs.meters import MeterData, TimeGrid
+from ts_tariffs.ts_utils import DateWindow, TimeWindow
+from tests.helpers import HALF_HOUR, half_hourly_index, regime_tariffs
+
+S, M = 3, 2
+
+
+@pytest.fixture(scope='module')
+def index():
+    # Starts part way through the first day, so that pro rata weights are partial
+    return half_hourly_index()[5:]
+
+
+@pytest.fixture(scope='module')
+def regime(index):
+    prices = MeterData('prices', pd.Series(np.random.default_rng(1).random(len(index)), index=index), HALF_HOUR,
+                       'dollars / kWh')
+    return TariffRegime('regime', regime_tariffs(prices))
+
+
+@pytest.fixture(scope='module')
+def traces(index):
+    return np.random.default_rng(0).normal(0.5, 0.4, (S, M, len(index)))
+
+
+def applied_totals(regime, traces, index):
+    return np.array([[[
+        float(np.squeeze(tariff.apply(MeterData('energy', pd.Series(traces[s, i], index=index), HALF_HOUR,
+                                                'kWh')).total))
+        for tariff in regime.tariffs] for i in range(M)] for s in range(S)])
+
+
+# The partial first day does not cover the critical period
+@pytest.mark.filterwarnings('ignore:The critical period tariff')
+def test_totals_match_applying_each_tariff(regime, traces, index):
+    bills = bill_ensemble(regime, traces, index, HALF_HOUR, units='kWh', chunk_size=2)
+    assert bills.totals.shape == (S, M, len(regime.tariffs))
+    np.testing.assert_allclose(bills.totals, applied_totals(regime, traces, index), rtol=1e-10)
+
+
+def test_chunk_size_and_memory_mapping_do_not_change_totals(tmp_path, regime, traces, index):
+    expected = bill_ensemble(regime, traces, index, HALF_HOUR, units='kWh', chunk_size=S).totals
+    path = tmp_path / 'traces.npy'
+    np.save(path, traces)
+    mapped = np.load(path, mmap_mode='r')
+    np.testing.assert_allclose(bill_ensemble(regime, mapped, index, HALF_HOUR, units='kWh', chunk_size=1).totals,
+                               expected, rtol=1e-12)
+
+
+def test_summary_and_totals_frames(regime, traces, index):
+    bills = bill_ensemble(regime, traces, index, HALF_HOUR, units='kWh', meter_names=['a', 'b'])
+    assert list(bills.bill_totals().columns) == ['a', 'b']
+    np.testing.assert_allclose(bills.bill_totals().to_numpy(), bills.totals.sum(axis=-1))
+    np.testing.assert_array_equal(bills.charge_totals('single').to_numpy(), bills.totals[..., 0])
+    summary = bills.summary(quantiles=(0.1, 0.9))
+    assert list(summary.columns) == ['mean', 'std', 'q0.1', 'q0.9']
+    assert summary.loc[('a', 'total'), 'mean'] == pytest.approx(bills.totals[:, 0].sum(axis=-1).mean())
+
+
+def test_rejects_mismatched_shapes(regime, traces, index):
+    with pytest.raises(ValueError, match='units'):
+        bill_ensemble(regime, traces, index, HALF_HOUR)
+    with pytest.raises(ValueError, match='intervals'):
+        bill_ensemble(regime, traces, index[1:], HALF_HOUR, units='kWh')
+    with pytest.raises(ValueError, match='shaped'):
+        bill_ensemble(regime, {'kWh': traces, 'kVA': traces[:1]}, index, HALF_HOUR)
+
+
+def test_grid_segments_match_meter_data(index):
+    grid = TimeGrid(index, HALF_HOUR)
+    positions = MeterData('positions', pd.Series(np.arange(len(index)), index=index), HALF_HOUR, 'position')
+    for kwargs in [dict(), dict(within_window=DateWindow((2021, 2, 1), (2021, 2, 28))),
+                   dict(within_times=TimeWindow(15, 21))]:
+        columns, starts, labels = grid.segments('month', **kwargs)
+        ts, expected_starts, expected_labels = positions.segments('month', **kwargs)
+        np.testing.assert_array_equal(np.arange(len(index))[columns], ts.to_numpy())
+        np.testing.assert_array_equal(starts, expected_starts)
+        assert labels.equals(expected_labels)
+    # Contiguous selections are slices (views), others position arrays
+    assert isinstance(grid.segments('month')[0], slice)
+    assert isinstance(grid.segments('month', within_times=TimeWindow(15, 21))[0], np.ndarray)
+
+
+def test_grid_memoises_and_weights_coverage(index):
+    grid = TimeGrid(index, HALF_HOUR)
+    assert grid.segments('day') is grid.segments('day')
+    weights = grid.period_weights('month')
+    # Only the first month is short of samples
+    assert weights.iloc[0] == pytest.approx(1 - 5 / (31 * 48))
+    np.testing.assert_array_equal(weights.iloc[1:], 1.0)
+    np.testing.assert_array_equal(grid.hours, index.hour)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs import kernels
+from ts_tariffs.meters import EventCalendar
+from ts_tariffs.tariffs import CriticalPeakDemandTariff
+from ts_tariffs.ts_utils import DateWindow, DatetimeWindow
+from tests.helpers import COMMON, half_hourly_index
+
+WINDOWS = [
+    DatetimeWindow((2021, 1, 5, 15), (2021, 1, 5, 19)),
+    DatetimeWindow((2021, 1, 12, 16), (2021, 1, 12, 20)),
+    # Overlapping the first window
+    DatetimeWindow((2021, 1, 5, 17), (2021, 1, 5, 22)),
+    # Ending on the last sample, and outside of the data
+    DatetimeWindow((2021, 3, 31, 20), (2021, 3, 31, 23, 30)),
+    DatetimeWindow((2021, 6, 1, 15), (2021, 6, 1, 19)),
+]
+
+
+@pytest.fixture
+def traces():
+    index = half_hourly_index()
+    return pd.DataFrame(np.random.default_rng(0).random((len(index), 3)), index=index)
+
+
+def expected_maxima(traces, windows):
+    # Window ends are inclusive
+    return np.array([[traces[column][window.start:window.end].max() for window in windows] for column in traces])
+
+
+def critical_peak_tariff(name, windows):
+    return CriticalPeakDemandTariff(
+        name=name, charge_type='CriticalPeakDemandTariff', rate=19, frequency_applied='month',
+        period_active=DateWindow((2021, 2, 1), (2021, 3, 31)), critical_period=DateWindow((2021, 1, 1), (2021, 1, 31)),
+        critical_peak_windows=windows, **COMMON
+    )
+
+
+def test_window_maxima_match_pandas(traces):
+    calendar = EventCalendar(WINDOWS + WINDOWS[:2])
+    assert len(calendar.windows) == len(WINDOWS)
+    values = traces.to_numpy().T
+    np.testing.assert_allclose(calendar.window_maxima(values, traces.index), expected_maxima(traces, WINDOWS))
+    np.testing.assert_allclose(calendar.window_maxima(values[0], traces.index), expected_maxima(traces, WINDOWS)[0])
+    subset = [WINDOWS[2], WINDOWS[0]]
+    np.testing.assert_allclose(calendar.window_maxima(values, traces.index, subset), expected_maxima(traces, subset))
+
+
+def test_missing_values_are_skipped(traces):
+    traces.loc['2021-01-05 18:00':'2021-01-05 19:00'] = np.nan
+    calendar = EventCalendar(WINDOWS)
+    np.testing.assert_allclose(calendar.window_maxima(traces.to_numpy().T, traces.index),
+                               expected_maxima(traces, WINDOWS))
+
+
+def test_positions_are_cached_per_grid(traces):
+    calendar = EventCalendar(WINDOWS)
+    starts, stops = calendar.positions(traces.index)
+    assert calendar.positions(traces.index.copy())[0] is starts
+    shorter = traces.index[:-48]
+    np.testing.assert_array_equal(calendar.positions(shorter)[1], shorter.searchsorted(calendar._ends, side='right'))
+
+
+def test_shared_calendar_tariffs_reduce_their_own_windows(traces, monkeypatch):
+    tariffs = [critical_peak_tariff('network_a', WINDOWS[:2]), critical_peak_tariff('network_b', WINDOWS[1:3])]
+    alone = [tariff.mean_of_peaks(traces.to_numpy().T, traces.index) for tariff in tariffs]
+    calendar = EventCalendar.shared_by(tariffs)
+    assert all(tariff.event_calendar is calendar for tariff in tariffs) and len(calendar.windows) == 3
+
+    reduced = []
+    window_max = kernels.window_max
+    monkeypatch.setattr(kernels, 'window_max', lambda values, starts, stops: reduced.append(len(starts)) or
+                        window_max(values, starts, stops))
+    for tariff, expected in zip(tariffs, alone):
+        np.testing.assert_allclose(tariff.mean_of_peaks(traces.to_numpy().T, traces.index), expected)
+        np.testing.assert_allclose(expected, expected_maxima(traces, tariff.critical_peak_windows).mean(axis=1))
+    assert reduced == [2, 2]
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from ts_tariffs.meters import IndexCache, period_segments, time_window_mask
+from ts_tariffs.ts_utils import TimeWindow
+from tests.helpers import half_hourly_index
+
+WINDOWS = [TimeWindow(15, 21), TimeWindow(22, 6)]
+
+
+def indexes():
+    # Sydney daylight saving ends on 2021-04-04 and starts on 2021-10-03
+    return [
+        half_hourly_index(),
+        half_hourly_index('2021-03-01', '2021-11-01', tz='Australia/Sydney'),
+        half_hourly_index('2021-03-01', '2021-11-01', tz='UTC'),
+    ]
+
+
+def assert_segments_equal(actual, expected):
+    np.testing.assert_array_equal(actual[0], expected[0])
+    assert actual[1].equals(expected[1])
+
+
+@pytest.mark.parametrize('index', indexes(), ids=['naive', 'sydney', 'utc'])
+def test_hits_match_cold_computation(index):
+    cache = IndexCache()
+    for frequency in ['day', 'week', 'month', 'quarter', 'year']:
+        cold = period_segments(index, frequency)
+        first = cache.period_segments(index, frequency)
+        # Copies of an index share its arrays
+        hit = cache.period_segments(index.copy(), frequency)
+        assert hit is first
+        assert_segments_equal(hit, cold)
+    for window in WINDOWS:
+        mask = cache.time_window_mask(index.copy(), window)
+        assert mask is cache.time_window_mask(index, window)
+        np.testing.assert_array_equal(mask, time_window_mask(index, window))
+        assert not mask.flags.writeable
+
+
+def test_same_wall_times_in_other_timezones_are_not_shared():
+    cache = IndexCache()
+    naive = half_hourly_index('2021-03-01', '2021-11-01')
+    sydney = naive.tz_localize('Australia/Sydney', nonexistent='shift_forward', ambiguous='NaT').dropna()
+    utc = sydney.tz_convert('UTC')
+    masks = [cache.time_window_mask(index, WINDOWS[0]) for index in (naive, sydney, utc)]
+    for index, mask in zip((naive, sydney, utc), masks):
+        np.testing.assert_array_equal(mask, time_window_mask(index, WINDOWS[0]))
+
+
+def test_indexes_with_the_same_ends_and_length_are_not_confused():
+    cache = IndexCache()
+    index = half_hourly_index()
+    # Same length, first and last timestamps, different positions
+    other = index.delete(100).insert(101, index[100] + (index[101] - index[100]) / 2)
+    assert (len(other), other[0], other[-1]) == (len(index), index[0], index[-1])
+    for candidate in (index, other, index):
+        np.testing.assert_array_equal(cache.time_window_mask(candidate, WINDOWS[0]),
+                                      time_window_mask(candidate, WINDOWS[0]))
+
+
+def test_evicts_oldest_grids():
+    cache = IndexCache()
+    cache.max_cached_grids = 2
+    grids = [half_hourly_index(f'2021-0{month}-01', f'2021-0{month + 1}-01') for month in (1, 2, 3)]
+    for index in grids:
+        cache.period_segments(index, 'day')
+    assert len(cache._grids) == 2
+    assert_segments_equal(cache.period_segments(grids[0], 'day'), period_segments(grids[0], 'day'))
+
+
+def test_concurrent_use_matches_cold_computation():
+    cache = IndexCache()
+    cache.max_cached_grids = 3
+    # More indexes than are cached, so that threads evict each other's grids
+    grids = [half_hourly_index('2021-01-01', f'2021-0{month}-01', tz=tz)
+             for month in (2, 3, 4) for tz in (None, 'Australia/Sydney')]
+
+    def check(job):
+        index = grids[job % len(grids)]
+        assert_segments_equal(cache.period_segments(index, 'week'), period_segments(index, 'week'))
+        window = WINDOWS[job % 2]
+        np.testing.assert_array_equal(cache.time_window_mask(index, window), time_window_mask(index, window))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(check, range(64)))
+    assert len(cache._grids) <= cache.max_cached_grids
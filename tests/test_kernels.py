@@ -0,0 +1,149 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs import kernels
+
+N = 50
+# Segment starts, including empty segments (a repeated start, and a start at the end)
+STARTS = [
+    np.array([0]),
+    np.array([0, 7, 20, 21, 49]),
+    np.array([0, 10, 10, 30, N]),
+    np.array([], dtype=np.intp),
+]
+SHAPES = [(N,), (3, N)]
+
+
+@pytest.fixture(params=[
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(not kernels.JIT_AVAILABLE, reason='numba is not installed')),
+], ids=['numpy', 'jit'])
+def use_jit(request):
+    enabled = kernels.jit_enabled()
+    kernels.set_jit(request.param)
+    yield request.param
+    kernels.set_jit(enabled)
+
+
+def random_values(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=shape)
+    values[rng.random(shape) < 0.2] = np.nan
+    # An all NaN segment
+    values[..., 10:20] = np.nan
+    return values
+
+
+def per_segment(reduce, values, starts, empty):
+    """ reduce applied to each segment separately, empty for empty segments
+    """
+    stops = np.append(starts[1:], values.shape[-1]).astype(int)
+    out = np.full(values.shape[:-1] + (len(starts),), empty)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for j, (start, stop) in enumerate(zip(starts, stops)):
+            if stop > start:
+                out[..., j] = reduce(values[..., start:stop], axis=-1)
+    return out
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('starts', STARTS)
+@pytest.mark.parametrize('kernel, numpy_kernel, reduce, empty', [
+    (kernels.segment_sum, kernels.segment_sum_numpy, np.nansum, 0.0),
+    (kernels.segment_max, kernels.segment_max_numpy, np.nanmax, np.nan),
+    (kernels.segment_min, kernels.segment_min_numpy, np.nanmin, np.nan),
+])
+def test_segment_reductions(use_jit, shape, starts, kernel, numpy_kernel, reduce, empty):
+    values = random_values(shape)
+    reference = per_segment(reduce, values, starts, empty)
+    np.testing.assert_allclose(numpy_kernel(values, starts), reference)
+    np.testing.assert_allclose(kernel(values, starts), reference)
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('starts', STARTS)
+def test_segment_count_mean_and_argmax(use_jit, shape, starts):
+    values = random_values(shape)
+    np.testing.assert_array_equal(
+        kernels.segment_count(values, starts),
+        per_segment(lambda v, axis: (~np.isnan(v)).sum(axis=axis), values, starts, 0.0)
+    )
+    np.testing.assert_allclose(kernels.segment_mean(values, starts), per_segment(np.nanmean, values, starts, np.nan))
+    argmax = kernels.segment_argmax(values, starts)
+    maxima = kernels.segment_max(values, starts)
+    found = argmax >= 0
+    np.testing.assert_array_equal(found, ~np.isnan(maxima))
+    np.testing.assert_array_equal(
+        np.take_along_axis(values, np.where(found, argmax, 0), axis=-1)[found], maxima[found]
+    )
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_window_max(use_jit, shape):
+    values = random_values(shape)
+    # Overlapping, empty, all NaN and full length windows
+    window_starts = np.array([0, 5, 12, 30, 30, 0])
+    window_stops = np.array([10, 25, 18, 30, N, N])
+    reference = np.full(values.shape[:-1] + (len(window_starts),), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for j, (start, stop) in enumerate(zip(window_starts, window_stops)):
+            if stop > start:
+                reference[..., j] = np.nanmax(values[..., start:stop], axis=-1)
+    np.testing.assert_array_equal(kernels.window_max_numpy(values, window_starts, window_stops), reference)
+    np.testing.assert_array_equal(kernels.window_max(values, window_starts, window_stops), reference)
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('starts', STARTS)
+def test_masked_segment_stats(use_jit, shape, starts):
+    values = random_values(shape)
+    mask = np.random.default_rng(1).random(N) < 0.5
+    stats = kernels.masked_segment_stats(values, mask, starts, ['sum', 'count', 'max', 'min', 'mean'])
+    masked = np.where(mask, values, np.nan)
+    for stat, reduce, empty in [
+        ('sum', np.nansum, 0.0),
+        ('count', lambda v, axis: (~np.isnan(v)).sum(axis=axis), 0.0),
+        ('max', np.nanmax, np.nan),
+        ('min', np.nanmin, np.nan),
+        ('mean', np.nanmean, np.nan),
+    ]:
+        np.testing.assert_allclose(stats[stat], per_segment(reduce, masked, starts, empty), err_msg=stat)
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_jit_matches_numpy(shape):
+    if not kernels.JIT_AVAILABLE:
+        pytest.skip('numba is not installed')
+    values = random_values(shape, seed=2)
+    mask = np.random.default_rng(3).random(N) < 0.5
+    enabled = kernels.jit_enabled()
+    try:
+        for starts in STARTS:
+            results = []
+            for use_jit in (False, True):
+                kernels.set_jit(use_jit)
+                results.append([
+                    kernels.segment_sum(values, starts),
+                    kernels.segment_max(values, starts),
+                    kernels.segment_min(values, starts),
+                    *kernels.masked_segment_stats(values, mask, starts, ['sum', 'count', 'max', 'min']).values(),
+                ])
+            for numpy_result, jit_result in zip(*results):
+                assert numpy_result.shape == jit_result.shape
+                np.testing.assert_allclose(jit_result, numpy_result)
+    finally:
+        kernels.set_jit(enabled)
+
+
+@pytest.mark.parametrize('window', [1, 4, 7])
+def test_rolling_kernels_match_pandas(window):
+    values = random_values((N,))
+    series = pd.Series(values)
+    np.testing.assert_allclose(kernels.rolling_mean(values, window), series.rolling(window).mean())
+    complete = np.random.default_rng(1).normal(size=N)
+    np.testing.assert_array_equal(kernels.rolling_max(complete, window), pd.Series(complete).rolling(window).max())
@@ -0,0 +1,110 @@
+""" Net metering totals against pandas resample and clip references
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.meters import MeterData, Meters
+from ts_tariffs.tariffs import NetMeteringTariff
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index
+
+IMPORT_TOU = dict(time_bins=[7, 21, 24], bin_rates=[0.06, 0.3, 0.06], bin_labels=['off', 'peak', 'off'])
+EXPORT_TOU = dict(time_bins=[10, 16, 24], bin_rates=[0.05, 0.02, 0.05], bin_labels=['other', 'solar', 'other'])
+
+
+@pytest.fixture
+def imports():
+    index = half_hourly_index()
+    return pd.Series(np.random.default_rng(0).random(len(index)), index=index)
+
+
+@pytest.fixture
+def exports(imports):
+    # Solar exports in the middle of the day, large enough to be net exports
+    # on most days, and none at all in March (import only)
+    index = imports.index
+    values = np.random.default_rng(1).random(len(index)) * 4 * ((index.hour >= 9) & (index.hour < 17))
+    return pd.Series(np.where(index.month == 3, 0.0, values), index=index)
+
+
+def net_metering(**kwargs):
+    return NetMeteringTariff(name='net', charge_type='NetMeteringTariff', **COMMON, **kwargs)
+
+
+def total(tariff, meter):
+    return float(np.squeeze(tariff.apply(meter).total))
+
+
+def period_sums(ts, frequency):
+    if frequency == 'week':
+        # Weeks are bounded by their month, as per period_cascades_map
+        index = ts.index
+        return ts.groupby([index.year, index.month, index.isocalendar().week.to_numpy()]).sum()
+    return ts.resample({'day': 'D', 'month': 'M'}[frequency]).sum()
+
+
+def expected(net, import_rates, export_rates):
+    return (net.clip(lower=0) * import_rates - (-net).clip(lower=0) * export_rates).sum()
+
+
+@pytest.mark.parametrize('frequency', ['day', 'week', 'month'])
+def test_flat_rates_net_per_period(imports, exports, frequency):
+    meter = MeterData.from_import_export('net', MeterData('import', imports, HALF_HOUR, 'kWh'),
+                                         MeterData('export', exports, HALF_HOUR, 'kWh'))
+    tariff = net_metering(import_rate=0.2, export_rate=0.05, netting_frequency=frequency)
+    net = period_sums(imports - exports, frequency)
+    assert (net < 0).any() and (net > 0).any()
+    assert total(tariff, meter) == pytest.approx(expected(net, 0.2, 0.05))
+    assert tariff.charge_table(meter).amount.sum() == pytest.approx(expected(net, 0.2, 0.05))
+
+
+def test_months_without_exports_are_only_charged(imports, exports):
+    meter = MeterData('net', imports - exports, HALF_HOUR, 'kWh')
+    charge_ts = net_metering(import_rate=0.2, export_rate=0.05, netting_frequency='month').apply(meter).charge_ts
+    march = charge_ts.loc[(2021, 3)]
+    assert march['export_credit'] == 0 and march['import_charge'] == pytest.approx(imports['2021-03'].sum() * 0.2)
+    # Net exporting months are credited
+    assert (charge_ts['charge'] < 0).any()
+
+
+def test_tou_rates_net_per_period_and_slot(imports, exports):
+    meter = MeterData('net', imports - exports, HALF_HOUR, 'kWh')
+    tariff = net_metering(import_tou=IMPORT_TOU, export_tou=EXPORT_TOU, netting_frequency='day')
+    # Slots bounded by the union of import and export bin edges
+    slot = np.digitize(meter.tseries.index.hour, [7, 10, 16, 21, 24])
+    net = meter.tseries.groupby([meter.tseries.index.date, slot]).sum()
+    slot_hours = np.array([0, 7, 10, 16, 21])[net.index.get_level_values(1)]
+    import_rates = np.array(IMPORT_TOU['bin_rates'])[np.digitize(slot_hours, IMPORT_TOU['time_bins'])]
+    export_rates = np.array(EXPORT_TOU['bin_rates'])[np.digitize(slot_hours, EXPORT_TOU['time_bins'])]
+    assert total(tariff, meter) == pytest.approx(expected(net, import_rates, export_rates))
+
+
+def test_without_netting_each_interval_is_priced(imports, exports):
+    tariff = net_metering(import_tou=IMPORT_TOU, export_rate=0.05)
+    meter = MeterData('net', imports - exports, HALF_HOUR, 'kWh')
+    import_rates = np.array(IMPORT_TOU['bin_rates'])[np.digitize(meter.tseries.index.hour, IMPORT_TOU['time_bins'])]
+    assert total(tariff, meter) == pytest.approx(expected(meter.tseries, import_rates, 0.05))
+    pair = tariff.apply_pair(MeterData('import', imports, HALF_HOUR, 'kWh'), MeterData('export', exports, HALF_HOUR, 'kWh'))
+    assert pair.total == pytest.approx(total(tariff, meter))
+
+
+def test_net_meter_of_a_channel_pair(imports, exports):
+    meters = Meters({'import': MeterData('import', imports, HALF_HOUR, 'kWh'),
+                     'export': MeterData('export', exports, HALF_HOUR, 'kWh')})
+    pd.testing.assert_series_equal(meters.net_meter('import', 'export').tseries, imports - exports)
+    with pytest.raises(ValueError, match='share units'):
+        MeterData.from_import_export('net', meters['import'], MeterData('export', exports, HALF_HOUR, 'kW'))
+
+
+def test_needs_import_and_export_rates():
+    with pytest.raises(ValueError, match='export_rate or export_tou'):
+        net_metering(import_rate=0.2)
+
+
+def test_missing_values_are_skipped(imports, exports):
+    net = imports - exports
+    net.iloc[[10, 2000]] = np.nan
+    tariff = net_metering(import_rate=0.2, export_rate=0.05, netting_frequency='month')
+    meter = MeterData('net', net, HALF_HOUR, 'kWh')
+    assert total(tariff, meter) == pytest.approx(expected(period_sums(net, 'month'), 0.2, 0.05))
+    assert total(tariff, meter) == pytest.approx(total(tariff, MeterData('net', net.dropna(), HALF_HOUR, 'kWh')))
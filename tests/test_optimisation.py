@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import MeterData, TimeGrid
+from ts_tariffs.optimisation import ScheduleEvaluator, _Component
+from ts_tariffs.tariffs import SingleRateTariff, TouTariff, DemandTariff
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index, random_meter, regime_tariffs
+
+
+@pytest.fixture(scope='module')
+def grid():
+    return TimeGrid(half_hourly_index(), HALF_HOUR)
+
+
+@pytest.fixture(scope='module')
+def regime(grid):
+    prices = random_meter(grid.index, seed=1, name='prices')
+    return TariffRegime('regime', regime_tariffs(prices))
+
+
+@pytest.fixture
+def schedule(grid):
+    return np.random.default_rng(0).normal(0.5, 0.4, len(grid))
+
+
+def test_charge_totals_match_apply(regime, grid, schedule):
+    evaluator = ScheduleEvaluator(regime, schedule, grid, units='kWh')
+    meter = MeterData('energy', pd.Series(schedule, index=grid.index), HALF_HOUR, 'kWh')
+    for tariff in regime.tariffs:
+        expected = float(np.squeeze(tariff.apply(meter).total))
+        assert evaluator.charge_totals[tariff.name] == pytest.approx(expected), tariff.name
+    assert evaluator.total == pytest.approx(evaluator.evaluate(schedule))
+
+
+def test_perturbations_match_full_evaluation(regime, grid, schedule):
+    evaluator = ScheduleEvaluator(regime, schedule, grid, units='kWh')
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        positions = rng.choice(len(grid), 5, replace=False)
+        new_values = rng.normal(1.0, 0.5, 5)
+        perturbed = evaluator.values.copy()
+        perturbed[positions] = new_values
+        before = evaluator.total
+        assert evaluator.perturbed_total(positions, new_values) == pytest.approx(evaluator.evaluate(perturbed))
+        assert evaluator.total == before
+        assert evaluator.update(positions, new_values) == pytest.approx(evaluator.evaluate(perturbed))
+        np.testing.assert_array_equal(evaluator.values, perturbed)
+    candidates = np.stack([schedule, schedule * 2])
+    np.testing.assert_allclose(evaluator.evaluate(candidates),
+                               [evaluator.evaluate(schedule), evaluator.evaluate(schedule * 2)])
+
+
+def test_marginal_costs_are_finite_differences(grid, schedule):
+    tou = dict(time_bins=[7, 21, 24], bin_rates=[0.06, 0.1, 0.06], bin_labels=['off', 'peak', 'off'])
+    regime = TariffRegime('regime', [
+        SingleRateTariff(name='single', charge_type='SingleRateTariff', rate=0.2, **COMMON),
+        TouTariff(name='tou', charge_type='TouTariff', tou=tou, **COMMON),
+        DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='month', **COMMON),
+    ])
+    evaluator = ScheduleEvaluator(regime, schedule, grid, units='kWh')
+    marginal_costs = evaluator.marginal_costs()
+    # Increases at the monthly peaks, and elsewhere
+    peaks = [int(np.argmax(np.where(grid.index.month == month, schedule, -np.inf))) for month in (1, 2, 3)]
+    for position in peaks + [10, 2000]:
+        increase = evaluator.perturbed_total([position], [schedule[position] + 1e-3]) - evaluator.total
+        assert increase / 1e-3 == pytest.approx(marginal_costs[position]), position
+    by_charge = evaluator.marginal_costs_by_charge()
+    assert list(by_charge.columns) == ['single', 'tou', 'demand']
+    np.testing.assert_allclose(by_charge.sum(axis=1), marginal_costs)
+
+
+def test_rejects_misshapen_schedules(regime, grid):
+    with pytest.raises(ValueError, match='shape'):
+        ScheduleEvaluator(regime, np.zeros(len(grid) - 1), grid)
+
+
+def test_component_of_empty_grid():
+    grid = TimeGrid(half_hourly_index()[:0], HALF_HOUR)
+    tariff = DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='month', **COMMON)
+    component = _Component(tariff, np.zeros(0), grid)
+    assert component.total == 0.0
+    assert len(component.part_starts) == len(component.part_stops) == 0
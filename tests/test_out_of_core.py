@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import MeterData, Meters
+from ts_tariffs.out_of_core import OutOfCoreBiller, bill_parquet, bill_record_batches
+from ts_tariffs.tariffs import RollingDemandTariff
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index, random_meter, regime_tariffs
+
+CHANNELS = {'energy': 'kWh'}
+N_METERS = 6
+
+pytestmark = pytest.mark.filterwarnings('ignore:The critical period tariff')
+
+
+@pytest.fixture(scope='module')
+def regime():
+    prices = random_meter(half_hourly_index(), seed=1, name='prices')
+    # Rolling demand needs contiguous data, so cannot be billed out of core
+    return TariffRegime('regime', [tariff for tariff in regime_tariffs(prices)
+                                   if not isinstance(tariff, RollingDemandTariff)])
+
+
+@pytest.fixture(scope='module')
+def meters():
+    index = half_hourly_index()
+    rng = np.random.default_rng(0)
+    meters = {}
+    for i in range(N_METERS):
+        meter_index = index[int(rng.integers(0, 500)):len(index) - int(rng.integers(0, 500))]
+        if i == 0:
+            # Days without data
+            meter_index = meter_index[(meter_index < '2021-02-10') | (meter_index >= '2021-02-13')]
+        meters[f'meter_{i}'] = pd.Series(rng.normal(0.5, 0.4, len(meter_index)), index=meter_index)
+    return meters
+
+
+@pytest.fixture(scope='module')
+def rows(meters):
+    frames = [pd.DataFrame({'meter_id': name, 'datetime': ts.index, 'energy': ts.to_numpy()})
+              for name, ts in meters.items()]
+    # Rows of all meters, in no particular order
+    return pd.concat(frames).sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def expected(regime, meters):
+    return {
+        name: regime.calculate_bill(name, Meters({'energy': MeterData('energy', ts, HALF_HOUR, 'kWh')}))
+        .itemised_as_dict
+        for name, ts in meters.items()
+    }
+
+
+def assert_bills_match(bills, expected):
+    bills = list(bills)
+    assert sorted(bill.name for bill in bills) == sorted(expected)
+    for bill in bills:
+        for charge, total in bill.itemised_as_dict.items():
+            assert total == pytest.approx(expected[bill.name][charge], rel=1e-9, nan_ok=True), (bill.name, charge)
+
+
+@pytest.mark.parametrize('max_meters', [2, 100])
+def test_parquet_bills_match_in_memory_bills(tmp_path, regime, rows, expected, max_meters):
+    source = tmp_path / 'rows.parquet'
+    rows.to_parquet(source, index=False, row_group_size=5000)
+    spill_dir = tmp_path / 'spill'
+    bills = bill_parquet(regime, str(source), CHANNELS, HALF_HOUR, batch_size=5000, max_meters=max_meters,
+                         spill_dir=spill_dir, n_buckets=3)
+    assert_bills_match(bills, expected)
+    # Only spilled when more than max_meters meters were held
+    assert spill_dir.exists() == (max_meters < N_METERS)
+
+
+def test_record_batches_spill_to_a_temporary_directory(regime, rows, expected):
+    biller = OutOfCoreBiller(regime, CHANNELS, HALF_HOUR, max_meters=1, n_buckets=2)
+    for start in range(0, len(rows), 7000):
+        biller.consume(rows.iloc[start:start + 7000])
+    spill_dir = biller.spill_dir
+    assert spill_dir is not None and any(spill_dir.iterdir())
+    assert_bills_match(biller.bills(), expected)
+    assert not spill_dir.exists()
+
+
+def test_batches_split_by_meter(regime, rows, expected):
+    batches = [rows[rows['meter_id'] == name] for name in sorted(expected)]
+    assert_bills_match(bill_record_batches(regime, batches, CHANNELS, HALF_HOUR), expected)
+
+
+def test_rolling_demand_cannot_be_billed_out_of_core():
+    regime = TariffRegime('regime', [
+        RollingDemandTariff(name='rolling', charge_type='RollingDemandTariff', rate=3, frequency_applied='month',
+                            window=timedelta(hours=2), **COMMON)
+    ])
+    with pytest.raises(NotImplementedError, match='rolling'):
+        OutOfCoreBiller(regime, CHANNELS, HALF_HOUR)
+
+
+def test_missing_values_are_skipped(regime, meters):
+    ts = meters['meter_1'].copy()
+    ts.iloc[[10, 2000]] = np.nan
+    rows = pd.DataFrame({'meter_id': 'meter_1', 'datetime': ts.index, 'energy': ts.to_numpy()})
+    bill, = bill_record_batches(regime, [rows], CHANNELS, HALF_HOUR)
+    in_memory = regime.calculate_bill('meter_1', Meters({'energy': MeterData('energy', ts, HALF_HOUR, 'kWh')}))
+    skipped = regime.calculate_bill('meter_1', Meters({'energy': MeterData('energy', ts.dropna(), HALF_HOUR, 'kWh')}))
+    for charge, total in bill.itemised_as_dict.items():
+        if np.isnan(in_memory.itemised_as_dict[charge]):
+            assert total == pytest.approx(skipped.itemised_as_dict[charge], rel=1e-9), charge
+        else:
+            assert total == pytest.approx(in_memory.itemised_as_dict[charge], rel=1e-9), charge
+    assert [charge for charge, total in in_memory.itemised_as_dict.items() if np.isnan(total)] == ['single', 'tou', 'spot']
@@ -0,0 +1,24 @@
+import subprocess
+import sys
+from datetime import date
+
+import ts_tariffs
+from ts_tariffs.ts_utils import DateWindow
+
+
+def test_root_exports_are_lazy():
+    code = 'import sys, ts_tariffs; print("pandas" in sys.modules, ts_tariffs.__version__)'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+    assert out == ['False', ts_tariffs.__version__]
+
+
+def test_lazy_exports_resolve():
+    from ts_tariffs.billing import TariffRegime
+    assert ts_tariffs.TariffRegime is TariffRegime
+    assert set(ts_tariffs._lazy_exports) <= set(dir(ts_tariffs))
+
+
+def test_shift_period_adds_months():
+    window = DateWindow((2021, 1, 31), (2021, 3, 15))
+    window.shift_period('month', 2)
+    assert (window.start, window.end) == (date(2021, 3, 31), date(2021, 5, 15))
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.meters import Meters, TimeGrid
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.out_of_core import bill_record_batches
+from ts_tariffs.tariffs import ConnectionTariff, DemandTariff, TopNDemandTariff
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index, random_meter
+
+SYDNEY = 'Australia/Sydney'
+
+
+@pytest.fixture
+def meter():
+    # Sydney daylight saving starts on 2021-10-03 (a 23 hour day). Half of
+    # 2021-10-12 has no data
+    index = half_hourly_index('2021-09-20', '2021-10-20', tz=SYDNEY)
+    gap = (index >= pd.Timestamp('2021-10-12 12:00', tz=SYDNEY)) & (index < pd.Timestamp('2021-10-13', tz=SYDNEY))
+    return random_meter(index[~gap])
+
+
+def test_days_are_bounded_by_local_midnights(meter):
+    weights = meter.period_weights('day')
+    assert weights[pd.Timestamp('2021-10-03').date()] == 1.0
+    assert weights[pd.Timestamp('2021-10-12').date()] == 0.5
+    assert (weights.drop(pd.Timestamp('2021-10-12').date()) == 1.0).all()
+    bounds = meter.period_bounds('day').loc[pd.Timestamp('2021-10-03').date()]
+    assert bounds['end'] - bounds['start'] == pd.Timedelta(hours=23)
+    assert bounds['end'] == pd.Timestamp('2021-10-04', tz=SYDNEY)
+
+
+def test_weeks_spanning_daylight_saving_are_fully_covered(meter):
+    weights = meter.period_weights('week')
+    # 2021-10-01 to 2021-10-03 (bounded by the month), and 2021-10-04 to 2021-10-10
+    assert weights[(2021, 10, 39)] == 1.0
+    assert weights[(2021, 10, 40)] == 1.0
+    assert weights[(2021, 10, 41)] == pytest.approx(6.5 / 7)
+
+
+def test_pro_rata_connection_charges(meter):
+    tariff = ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.0, frequency_applied='day',
+                              pro_rata=True, **COMMON)
+    # 30 days, one of them half covered
+    assert float(np.squeeze(tariff.apply(meter).total)) == pytest.approx(29.5)
+    table = tariff.charge_table(meter)
+    assert table.amount.sum() == pytest.approx(29.5)
+    grid = TimeGrid(meter.tseries.index, HALF_HOUR)
+    assert tariff.batch_totals(meter.to_numpy()[None, :], grid)[0] == pytest.approx(29.5)
+
+
+def test_out_of_core_periods_are_local(meter):
+    regime = TariffRegime('regime', [
+        ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.0, frequency_applied='week',
+                         pro_rata=True, **COMMON),
+        DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied='day', pro_rata=True,
+                     **COMMON),
+        TopNDemandTariff(name='top_n', charge_type='TopNDemandTariff', rate=3, frequency_applied='month',
+                         n_peaks=4, **COMMON),
+    ])
+    rows = pd.DataFrame({'meter_id': 'meter', 'datetime': meter.tseries.index, 'energy': meter.to_numpy()})
+    bill, = bill_record_batches(regime, [rows], {'energy': 'kWh'}, HALF_HOUR)
+    expected = regime.calculate_bill('meter', Meters({'energy': meter})).itemised_as_dict
+    assert bill.itemised_as_dict == pytest.approx(expected)
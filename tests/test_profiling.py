@@ -0,0 +1,61 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import Meters
+from ts_tariffs.profiling import Profiler, diff_profiles
+from tests.helpers import half_hourly_index, random_meter, regime_tariffs
+
+pytestmark = pytest.mark.filterwarnings('ignore:The critical period tariff')
+
+
+@pytest.fixture(scope='module')
+def regime():
+    return TariffRegime('regime', regime_tariffs(random_meter(half_hourly_index(), seed=1, name='prices')))
+
+
+@pytest.fixture
+def meters():
+    return Meters({'energy': random_meter()})
+
+
+def tariff_stacks(regime):
+    return [('bill', type(tariff).__name__, f'{tariff.name} (energy)') for tariff in regime.tariffs]
+
+
+def test_profiled_bill_matches_unprofiled_bill(regime, meters):
+    profiler = Profiler()
+    profiled = regime.calculate_bill('bill', meters, profiler=profiler)
+    bill = regime.calculate_bill('bill', meters)
+    assert profiled.item_names == bill.item_names
+    np.testing.assert_array_equal(list(profiled.itemised_as_dict.values()), list(bill.itemised_as_dict.values()))
+    assert not tracemalloc.is_tracing()
+
+
+def test_every_tariff_is_in_the_report(regime, meters, tmp_path):
+    profiler = Profiler(trace_memory=False)
+    regime.calculate_bill('bill', meters, profiler=profiler)
+    stacks = tariff_stacks(regime)
+    for stack in stacks:
+        assert profiler.stats[stack].calls == 1
+        assert profiler.stats[stack].seconds > 0
+    assert profiler.stats[('bill',)].seconds >= sum(profiler.stats[stack].seconds for stack in stacks)
+
+    summary = profiler.stage_summary()
+    assert {';'.join(stack[1:]) for stack in stacks} <= set(summary.index)
+
+    profiler.to_json(tmp_path / 'profile.json')
+    reported = {tuple(stage['stack']) for stage in json.loads((tmp_path / 'profile.json').read_text())['stages']}
+    assert set(stacks) <= reported
+
+    profiler.write_collapsed(tmp_path / 'profile.folded')
+    # Each tariff's time is on its own line or those of its nested stages
+    folded = (tmp_path / 'profile.folded').read_text().splitlines()
+    for stack in stacks:
+        assert any(line.startswith(';'.join(stack)) for line in folded)
+
+    diff = diff_profiles(tmp_path / 'profile.json', profiler.as_dict())
+    assert (diff['self_seconds_change'] == 0).all()
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.meters import MeterData
+from ts_tariffs.tariffs import RatchetDemandTariff
+from tests.helpers import COMMON
+
+
+def ratchet_tariff(**kwargs):
+    params = dict(
+        name='ratchet', charge_type='RatchetDemandTariff', rate=2.0,
+        frequency_applied='month', ratchet_fraction=0.8, **COMMON
+    )
+    params.update(kwargs)
+    return RatchetDemandTariff(**params)
+
+
+@pytest.fixture
+def meter():
+    index = pd.date_range('2020-01-01', '2021-12-31', freq='h')
+    values = np.ones(len(index))
+    values[index.month == 2] = 10.0
+    return MeterData('demand', pd.Series(values, index=index), timedelta(hours=1), 'kW')
+
+
+def test_ratchet_sets_billed_demand(meter):
+    charge_ts = ratchet_tariff().apply(meter).charge_ts
+    # February's peak of 10 ratchets the following 11 months to 8
+    np.testing.assert_allclose(charge_ts['billed_demand'].to_numpy()[:14], [1] + [10] + [8] * 11 + [10])
+
+
+def test_missing_peaks_do_not_end_the_ratchet(meter):
+    tariff = ratchet_tariff()
+    np.testing.assert_allclose(tariff.ratchet_demands(np.array([10, np.nan, 1, 1, 1])), [0, 8, 8, 8, 8])
+    np.testing.assert_allclose(ratchet_tariff(carried_peaks=[10, np.nan]).ratchet_demands(np.ones(3)), [8, 8, 8])
+    # A month without data
+    meter.tseries['2020-03'] = np.nan
+    charge_ts = tariff.apply(meter).charge_ts
+    np.testing.assert_allclose(charge_ts['billed_demand'].to_numpy()[:14], [1] + [10] + [8] * 11 + [10])
+
+
+def test_carry_forward_matches_single_run(meter):
+    tariff = ratchet_tariff()
+    first = MeterData('demand', meter.tseries[:'2020-12-31'], meter.sample_rate, 'kW')
+    second = MeterData('demand', meter.tseries['2021-01-01':], meter.sample_rate, 'kW')
+    applied = tariff.apply(first)
+    carried = tariff.carry_forward(applied).apply(second)
+    assert applied.total + carried.total == pytest.approx(tariff.apply(meter).total)
+
+
+@pytest.mark.parametrize('lookback_periods', [0, -1])
+def test_lookback_periods_must_be_positive(lookback_periods):
+    with pytest.raises(ValueError, match='lookback_periods'):
+        ratchet_tariff(lookback_periods=lookback_periods)
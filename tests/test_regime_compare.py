@@ -0,0 +1,84 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from ts_tariffs.billing import RegimeCompare, TariffRegime, tariff_structure_key
+from ts_tariffs.meters import Meters
+from ts_tariffs.tariffs import DemandTariff
+from tests.helpers import half_hourly_index, random_meter, regime_tariffs
+
+pytestmark = pytest.mark.filterwarnings('ignore:The critical period tariff')
+
+PRICES = random_meter(half_hourly_index(), seed=1, name='prices')
+
+
+@pytest.fixture
+def meters():
+    return Meters({'energy': random_meter()})
+
+
+def offer(name, **rates):
+    """ Regime of freshly built tariffs, named for the offer, with the given
+    tariffs' rates changed
+    """
+    return TariffRegime(name, [
+        replace(tariff, name=f'{name}_{tariff.name}', **({'rate': rates[tariff.name]} if tariff.name in rates else {}))
+        for tariff in regime_tariffs(PRICES)
+    ])
+
+
+def assert_bills_match(bill, expected):
+    assert bill.name == expected.name
+    assert bill.item_names == expected.item_names
+    np.testing.assert_allclose(list(bill.itemised_as_dict.values()), list(expected.itemised_as_dict.values()))
+
+
+def test_identical_tariffs_are_applied_once(meters, monkeypatch):
+    regimes = [offer('a'), offer('b')]
+    compare = RegimeCompare(regimes)
+    assert compare.n_tariffs == 2 * len(regimes[0].tariffs)
+    assert compare.n_unique_tariffs == len(regimes[0].tariffs)
+
+    calls = []
+    apply = DemandTariff.apply
+    monkeypatch.setattr(DemandTariff, 'apply', lambda self, meter: calls.append(self.name) or apply(self, meter))
+    bills = compare.calculate_bills(meters)
+    # Two demand tariffs in each regime
+    assert calls == ['a_demand', 'a_demand_pro_rata']
+    monkeypatch.undo()
+
+    for bill, regime in zip(bills, regimes):
+        assert_bills_match(bill, regime.calculate_bill(regime.name, meters))
+
+
+def test_changed_fields_change_the_key_and_bill(meters):
+    regimes = [offer('a'), offer('b', demand=12)]
+    keys = [[tariff_structure_key(tariff) for tariff in regime.tariffs] for regime in regimes]
+    changed = [j for j, (a, b) in enumerate(zip(*keys)) if a != b]
+    assert [regimes[0].tariffs[j].name for j in changed] == ['a_demand']
+    compare = RegimeCompare(regimes)
+    assert compare.n_unique_tariffs == len(regimes[0].tariffs) + 1
+
+    bills = compare.calculate_bills(meters)
+    for bill, regime in zip(bills, regimes):
+        assert_bills_match(bill, regime.calculate_bill(regime.name, meters))
+    assert bills[1].itemised_as_dict['b_demand'] == pytest.approx(1.2 * bills[0].itemised_as_dict['a_demand'])
+
+
+def test_meter_data_params_are_compared_by_identity():
+    spot = next(tariff for tariff in regime_tariffs(PRICES) if tariff.name == 'spot')
+    copied = replace(spot, prices=PRICES.copy())
+    assert tariff_structure_key(replace(spot, name='other')) == tariff_structure_key(spot)
+    assert tariff_structure_key(copied) != tariff_structure_key(spot)
+
+
+def test_rank(meters):
+    regimes = [offer('a'), offer('b', single=0.1), offer('c', single=0.3)]
+    fleet = {'customer_1': meters, 'customer_2': Meters({'energy': random_meter(seed=2)})}
+    ranked = RegimeCompare(regimes).rank(fleet)
+    assert list(ranked['cheapest']) == ['b', 'b']
+    for customer, meters_of_customer in fleet.items():
+        assert list(ranked.loc[customer, ['a', 'b', 'c']]) == pytest.approx(
+            [regime.calculate_bill(regime.name, meters_of_customer).total for regime in regimes]
+        )
@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs import kernels
+from ts_tariffs.tariffs import RollingDemandTariff, TopNDemandTariff
+from ts_tariffs.ts_utils import TimeWindow
+from tests.helpers import COMMON, HALF_HOUR, random_meter
+
+
+def rolling_tariff(**kwargs):
+    return RollingDemandTariff(
+        name='rolling', charge_type='RollingDemandTariff', rate=10.0,
+        frequency_applied='month', window=timedelta(hours=2), **{**COMMON, **kwargs}
+    )
+
+
+@pytest.mark.parametrize('window', [1, 4, 48])
+def test_rolling_mean_matches_pandas(window):
+    values = np.random.default_rng(1).random(500)
+    values[[10, 11, 200]] = np.nan
+    expected = pd.Series(values).rolling(window).mean().to_numpy()
+    np.testing.assert_allclose(kernels.rolling_mean(values, window), expected, equal_nan=True)
+
+
+def test_rolling_mean_nan_only_affects_its_windows():
+    values = np.ones((2, 20))
+    values[0, 5] = np.nan
+    rolled = kernels.rolling_mean(values, 3)
+    assert np.isnan(rolled[0, 5:8]).all()
+    np.testing.assert_allclose(rolled[0, 8:], 1.0)
+    np.testing.assert_allclose(rolled[1, 2:], 1.0)
+
+
+def test_rolling_demand_matches_pandas_rolling():
+    meter = random_meter()
+    meter.tseries.iloc[100:103] = np.nan
+    rolled = meter.tseries.rolling(4).mean()
+    expected = rolled.groupby([rolled.index.year, rolled.index.month]).max().sum() * 10.0
+    assert rolling_tariff().apply(meter).total == pytest.approx(expected)
+
+
+def test_apply_batch_uses_data_sample_rate():
+    # Tariff sample rate differs from the data's, the window is still 2 hours of data
+    tariff = rolling_tariff(sample_rate=timedelta(minutes=15), time_window=TimeWindow(15, 21))
+    meters = [random_meter(seed=seed) for seed in range(3)]
+    values = np.vstack([meter.to_numpy() for meter in meters])
+    batch = tariff.apply_batch(values, meters[0].tseries.index, HALF_HOUR)
+    np.testing.assert_allclose(batch.sum().to_numpy(), [tariff.apply(meter).total for meter in meters])
+
+
+def test_top_n_matches_pandas():
+    meter = random_meter()
+    tariff = TopNDemandTariff(
+        name='top', charge_type='TopNDemandTariff', rate=2.0, frequency_applied='month', n_peaks=3, **COMMON
+    )
+    daily = meter.tseries.resample('D').max()
+    expected = daily.groupby(daily.index.month).apply(lambda peaks: peaks.nlargest(3).mean()).sum() * 2.0
+    assert tariff.apply(meter).total == pytest.approx(expected)
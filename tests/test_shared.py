@@ -0,0 +1,130 @@
+import gc
+import json
+import os
+import subprocess
+import sys
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import Meters
+from ts_tariffs.shared import SharedTariffs, attach_regime, _attached
+from ts_tariffs.tariffs import SpotPriceTariff
+from tests.helpers import half_hourly_index, random_meter, regime_tariffs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bills every regime of a shared block in a separate process
+WORKER = '''
+import json, sys
+from ts_tariffs.meters import Meters
+from ts_tariffs.shared import SharedTariffs
+from tests.helpers import random_meter
+shared = SharedTariffs.attach(**json.loads(sys.argv[1]))
+meters = Meters({'energy': random_meter()})
+print(json.dumps({name: regime.calculate_bill('meter', meters).total for name, regime in shared.regimes.items()}))
+'''
+
+
+@pytest.fixture(scope='module')
+def prices():
+    return random_meter(half_hourly_index('2020-12-01', '2021-05-01'), seed=1, name='prices')
+
+
+@pytest.fixture(scope='module')
+def regimes(prices):
+    return [TariffRegime(f'regime_{k}', regime_tariffs(prices)) for k in range(3)]
+
+
+@pytest.fixture
+def attach():
+    """ SharedTariffs.attach, closing the attached blocks once the test's
+    references to their arrays are gone
+    """
+    attached = []
+    yield lambda **kwargs: attached.append(SharedTariffs.attach(**kwargs)) or attached[-1]
+    gc.collect()
+    for shared in attached:
+        shared.close()
+
+
+@pytest.fixture
+def published(regimes, prices):
+    shared = SharedTariffs.publish(regimes, data={'prices': prices}, name=f'ts_tariffs_test_{uuid.uuid4().hex[:12]}')
+    yield shared
+    shared.unlink()
+    gc.collect()
+    shared.close()
+
+
+def bill_totals(regimes):
+    meters = Meters({'energy': random_meter()})
+    return {name: regime.calculate_bill('meter', meters).total for name, regime in regimes.items()}
+
+
+def run_worker(**attach):
+    out = subprocess.run([sys.executable, '-c', WORKER, json.dumps(attach)], capture_output=True, text=True,
+                         cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT))
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout)
+
+
+def test_attached_regimes_bill_as_the_originals(attach, published, regimes):
+    expected = bill_totals({regime.name: regime for regime in regimes})
+    attached = attach(name=published.name)
+    assert bill_totals(attached.regimes) == pytest.approx(expected)
+    assert run_worker(name=published.name) == pytest.approx(expected)
+
+
+def test_arrays_are_shared_read_only_views(attach, published):
+    attached = attach(name=published.name)
+    prices = attached.data['prices']
+    assert not prices.tseries.to_numpy().flags.writeable
+    # Reference data is stored once, however many tariffs refer to it
+    spot_prices = [tariff.prices for regime in attached.regimes.values() for tariff in regime.tariffs
+                   if isinstance(tariff, SpotPriceTariff)]
+    assert len(spot_prices) == 3 and all(spot is prices for spot in spot_prices)
+
+
+def test_memory_mapped_file(attach, tmp_path, regimes, prices):
+    path = tmp_path / 'tariffs.shared'
+    aware = pd.Series(np.arange(5.0), index=pd.date_range('2021-04-04', periods=5, freq='h', tz='Australia/Sydney'))
+    shared = SharedTariffs.publish(regimes, data={'aware': aware}, path=path)
+    try:
+        # The index's freq is not kept
+        pd.testing.assert_series_equal(attach(path=path).data['aware'], aware, check_freq=False)
+        expected = bill_totals({regime.name: regime for regime in regimes})
+        assert run_worker(path=str(path)) == pytest.approx(expected)
+    finally:
+        shared.unlink()
+    assert not path.exists()
+
+
+def test_close_once_unreferenced(regimes):
+    shared = SharedTariffs.publish(regimes[:1], name=f'ts_tariffs_test_{uuid.uuid4().hex[:12]}')
+    try:
+        gc.collect()
+        shared.close()
+    finally:
+        shared.unlink()
+
+
+def test_attach_regime_needs_a_name_for_several_regimes(published):
+    with pytest.raises(ValueError, match='regime_name'):
+        attach_regime(published.name)
+    assert attach_regime(published.name, 'regime_1').name == 'regime_1'
+    # Blocks attached by attach_regime are otherwise kept for the life of the process
+    gc.collect()
+    _attached.pop().close()
+
+
+def test_rejects_other_files_and_ambiguous_arguments(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not tariffs' * 10)
+    with pytest.raises(ValueError, match='does not hold shared tariff data'):
+        SharedTariffs.attach(path=path)
+    with pytest.raises(ValueError, match='Exactly one'):
+        SharedTariffs.attach()
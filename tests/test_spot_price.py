@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ts_tariffs.meters import MeterData, TimeGrid
+from ts_tariffs.tariffs import SpotPriceTariff
+from tests.helpers import COMMON, HALF_HOUR, half_hourly_index, random_meter
+
+
+def prices_over(index, seed=1):
+    return MeterData('prices', pd.Series(np.random.default_rng(seed).random(len(index)), index=index),
+                     HALF_HOUR, 'dollars / kWh')
+
+
+def spot_tariff(prices, loss_factors=None):
+    return SpotPriceTariff(name='spot', charge_type='SpotPriceTariff', prices=prices, loss_factors=loss_factors, **COMMON)
+
+
+def test_total_is_consumption_times_price():
+    meter = random_meter()
+    prices = prices_over(half_hourly_index('2020-12-01', '2021-05-01'))
+    expected = (meter.tseries * prices.tseries.reindex(meter.tseries.index) * 1.05).sum()
+    tariff = spot_tariff(prices, loss_factors=1.05)
+    assert tariff.apply(meter).total == pytest.approx(expected)
+    grid = TimeGrid(meter.tseries.index, HALF_HOUR)
+    assert tariff.batch_totals(meter.to_numpy()[None, :], grid)[0] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('start, end', [('2021-01-02', '2021-04-01'), ('2020-12-01', '2021-03-15')])
+def test_prices_must_cover_consumption(start, end):
+    tariff = spot_tariff(prices_over(half_hourly_index(start, end)))
+    with pytest.raises(ValueError, match='prices cover'):
+        tariff.apply(random_meter())
+
+
+def test_loss_factors_must_cover_consumption():
+    meter = random_meter()
+    tariff = spot_tariff(
+        prices_over(meter.tseries.index),
+        loss_factors=prices_over(half_hourly_index('2021-02-01', '2021-04-01'))
+    )
+    with pytest.raises(ValueError, match='loss factors cover'):
+        tariff.apply(meter)
@@ -0,0 +1,120 @@
+""" Tariff totals against the original pandas implementations (resample and
+groupby over the period cascade), which the vectorised kernels replaced
+"""
+import numpy as np
+import pytest
+
+from ts_tariffs.meters import TimeGrid
+from ts_tariffs.tariffs import SingleRateTariff, TouTariff, DemandTariff, BlockTariff, ConnectionTariff, \
+    CapacityTariff, CriticalPeakDemandTariff
+from ts_tariffs.ts_utils import TimeWindow, DateWindow, DatetimeWindow
+from ts_tariffs.utils import Block
+from tests.helpers import COMMON, half_hourly_index, random_meter
+
+TOU = dict(time_bins=[7, 21, 24], bin_rates=[0.06, 0.1, 0.06], bin_labels=['off', 'peak', 'off'])
+
+
+@pytest.fixture
+def meter():
+    # Three days without data, and some missing values
+    index = half_hourly_index()
+    meter = random_meter(index[(index < '2021-02-10') | (index >= '2021-02-13')])
+    meter.tseries.iloc[100:110] = np.nan
+    return meter
+
+
+def cascade_groups(ts, frequency):
+    if frequency == 'day':
+        return [ts.index.date]
+    levels = {'month': ['year', 'month'], 'week': ['year', 'month', 'week'], 'quarter': ['year', 'quarter'],
+              'year': ['year']}[frequency]
+    return [ts.index.isocalendar().week.to_numpy() if level == 'week' else getattr(ts.index, level)
+            for level in levels]
+
+
+def tariff_total(tariff, meter):
+    return float(np.squeeze(tariff.apply(meter).total))
+
+
+def test_single_rate(meter):
+    tariff = SingleRateTariff(name='single', charge_type='SingleRateTariff', rate=0.2, **COMMON)
+    # Missing values propagate, as the original sum() did
+    assert tariff_total(tariff, meter) == pytest.approx(sum(meter.tseries * 0.2), nan_ok=True)
+    meter.tseries.fillna(0.0, inplace=True)
+    assert tariff_total(tariff, meter) == pytest.approx(sum(meter.tseries * 0.2))
+
+
+def test_tou(meter):
+    tariff = TouTariff(name='tou', charge_type='TouTariff', tou=TOU, **COMMON)
+    rates = np.array(TOU['bin_rates'])[np.digitize(meter.tseries.index.hour, TOU['time_bins'])]
+    assert tariff_total(tariff, meter) == pytest.approx(sum(rates * meter.to_numpy()), nan_ok=True)
+    meter.tseries.fillna(0.0, inplace=True)
+    assert tariff_total(tariff, meter) == pytest.approx(sum(rates * meter.to_numpy()))
+
+
+@pytest.mark.parametrize('frequency', ['day', 'week', 'month'])
+@pytest.mark.parametrize('time_window', [None, TimeWindow(15, 21)])
+def test_demand(meter, frequency, time_window):
+    tariff = DemandTariff(name='demand', charge_type='DemandTariff', rate=10, frequency_applied=frequency,
+                          time_window=time_window, **COMMON)
+    ts = meter.tseries
+    if time_window:
+        ts = ts.between_time(time_window.start, time_window.end, inclusive='left')
+    expected = ts.groupby(cascade_groups(ts, frequency)).max().sum() * 10
+    assert tariff_total(tariff, meter) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('frequency', ['day', 'month'])
+def test_block(meter, frequency):
+    blocks = [Block(0, 10), Block(10, float('inf'))]
+    tariff = BlockTariff(name='block', charge_type='BlockTariff', frequency_applied=frequency, blocks=blocks,
+                         bin_rates=[0.2, 0.3], bin_labels=['first', 'second'], **COMMON)
+    sums = meter.tseries.groupby(cascade_groups(meter.tseries, frequency)).sum()
+    expected = sum(rate * (np.clip(sums, block.min, block.max) - block.min).sum()
+                   for block, rate in zip(blocks, [0.2, 0.3]))
+    assert tariff_total(tariff, meter) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('frequency', ['hour', 'day', 'week', 'month', 'quarter', 'year'])
+@pytest.mark.parametrize('tz', [None, 'Australia/Sydney'])
+def test_connection_and_capacity_charge_every_resampled_period(meter, frequency, tz):
+    if tz:
+        meter.tseries.index = meter.tseries.index.tz_localize(tz)
+    periods = len(meter.tseries.resample({'hour': 'H', 'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q',
+                                          'year': 'A'}[frequency]).sum())
+    grid = TimeGrid(meter.tseries.index, meter.sample_rate)
+    for tariff, expected in [
+        (ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.5,
+                          frequency_applied=frequency, **COMMON), 1.5 * periods),
+        (CapacityTariff(name='capacity', charge_type='CapacityTariff', capacity=4, rate=1.5,
+                        frequency_applied=frequency, **COMMON), 4 * 1.5 * periods),
+    ]:
+        assert tariff_total(tariff, meter) == pytest.approx(expected)
+        assert tariff.batch_totals(meter.to_numpy()[None, :], grid)[0] == pytest.approx(expected)
+
+
+def test_connection_charges_periods_without_data(meter):
+    tariff = ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.0,
+                              frequency_applied='day', **COMMON)
+    assert tariff_total(tariff, meter) == 90.0
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(frequency_applied='hour', pro_rata=True),
+    dict(frequency_applied='fortnight'),
+])
+def test_connection_rejects_unsupported_frequencies(kwargs):
+    with pytest.raises(ValueError, match='frequency_applied'):
+        ConnectionTariff(name='connection', charge_type='ConnectionTariff', rate=1.0, **kwargs, **COMMON)
+
+
+def test_critical_peak(meter):
+    windows = [DatetimeWindow((2021, 1, 5, 15), (2021, 1, 5, 19)), DatetimeWindow((2021, 1, 20, 15), (2021, 1, 20, 19))]
+    tariff = CriticalPeakDemandTariff(
+        name='critical', charge_type='CriticalPeakDemandTariff', rate=19, frequency_applied='month',
+        period_active=DateWindow((2021, 2, 1), (2021, 3, 31)), critical_period=DateWindow((2021, 1, 1), (2021, 1, 31)),
+        critical_peak_windows=windows, **COMMON
+    )
+    mean_of_peaks = np.mean([meter.tseries[window.start:window.end].max() for window in windows])
+    # Two months active
+    assert tariff_total(tariff, meter) == pytest.approx(mean_of_peaks * 19 * 2)
@@ -0,0 +1,84 @@
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import EventCalendar, MemoMeterData, Meters, index_cache
+from ts_tariffs.tariffs import CriticalPeakDemandTariff
+from ts_tariffs.ts_utils import DateWindow, DatetimeWindow
+from tests.helpers import COMMON, half_hourly_index, random_meter, regime_tariffs
+
+
+@pytest.fixture(scope='module')
+def regime():
+    tariffs = regime_tariffs(random_meter(half_hourly_index(), seed=1, name='prices'))
+    tariffs.append(CriticalPeakDemandTariff(
+        name='critical_march', charge_type='CriticalPeakDemandTariff', rate=12, frequency_applied='month',
+        period_active=DateWindow((2021, 3, 1), (2021, 3, 31)), critical_period=DateWindow((2021, 1, 1), (2021, 1, 31)),
+        critical_peak_windows=[DatetimeWindow((2021, 1, 5, 15), (2021, 1, 5, 19)),
+                               DatetimeWindow((2021, 1, 12, 16), (2021, 1, 12, 20))],
+        **COMMON
+    ))
+    # Critical peak tariffs share one calendar, and so its cached positions
+    EventCalendar.shared_by([tariff for tariff in tariffs if isinstance(tariff, CriticalPeakDemandTariff)])
+    return TariffRegime('regime', tariffs)
+
+
+def meters_of(seed):
+    return Meters({'energy': random_meter(seed=seed)})
+
+
+def test_threaded_bill_matches_serial_bill(regime):
+    index_cache.clear()
+    serial = regime.calculate_bill('meter', meters_of(0))
+    index_cache.clear()
+    threaded = regime.calculate_bill('meter', meters_of(0), max_workers=4)
+    assert threaded.item_names == serial.item_names
+    np.testing.assert_array_equal(list(threaded.itemised_as_dict.values()), list(serial.itemised_as_dict.values()))
+
+
+def test_concurrent_bills_share_caches(regime):
+    serial = {seed: regime.calculate_bill(str(seed), meters_of(seed)).itemised_as_dict for seed in range(6)}
+    index_cache.clear()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        threaded = dict(zip(range(6), executor.map(
+            lambda seed: regime.calculate_bill(str(seed), meters_of(seed), max_workers=3).itemised_as_dict,
+            range(6)
+        )))
+    assert threaded == serial
+
+
+def test_memo_meter_data_computes_each_value_once():
+    meter = MemoMeterData.wrap(random_meter())
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.01)
+        return object()
+
+    barrier = threading.Barrier(8)
+
+    def memoised(_):
+        barrier.wait()
+        return meter._memoised(('value',), compute)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        values = list(executor.map(memoised, range(8)))
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
+
+
+def test_event_calendar_pickles_without_cached_positions(regime):
+    calendar = next(tariff.event_calendar for tariff in regime.tariffs if isinstance(tariff, CriticalPeakDemandTariff))
+    index = half_hourly_index()
+    starts, stops = calendar.positions(index)
+    restored = pickle.loads(pickle.dumps(calendar))
+    assert restored._grid_positions == {}
+    restored_starts, restored_stops = restored.positions(index)
+    np.testing.assert_array_equal(restored_starts, starts)
+    np.testing.assert_array_equal(restored_stops, stops)
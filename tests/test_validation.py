@@ -0,0 +1,122 @@
+import json
+import pickle
+from datetime import timedelta
+
+import pytest
+
+from ts_tariffs import loading
+from ts_tariffs.loading import TariffLoader, tariff_from_dict
+from ts_tariffs.tariffs import BlockTariff, DemandTariff, TouTariff
+from ts_tariffs.ts_utils import TimeWindow, TouBins
+from ts_tariffs.utils import Block
+from ts_tariffs.validation import TariffValidationError, validate_fields
+
+COMMON = dict(consumption_unit='kWh', rate_unit='$/kWh', sample_rate={'minutes': 30}, adjustment_factor=1.0)
+TOU = {'time_bins': [7, 21, 24], 'bin_rates': [0.06, 0.1, 0.06], 'bin_labels': ['off', 'peak', 'off']}
+
+
+def demand(**kwargs):
+    return {'name': 'demand', 'charge_type': 'DemandTariff', 'rate': 10, 'frequency_applied': 'month',
+            **COMMON, **kwargs}
+
+
+def block(**kwargs):
+    return {'name': 'block', 'charge_type': 'BlockTariff', 'frequency_applied': 'month',
+            'blocks': [[0, 300], {'min': 300, 'max': float('inf')}], 'bin_rates': [0.2, 0.3],
+            'bin_labels': ['first', 'second'], **COMMON, **kwargs}
+
+
+def errors_of(tariff_dict) -> list:
+    with pytest.raises(TariffValidationError) as e:
+        tariff_from_dict(tariff_dict)
+    return e.value.errors
+
+
+def test_coerces_nested_params():
+    kwargs = validate_fields(DemandTariff, demand(
+        rate=10, time_window={'start': 15, 'end': 21}, sample_rate={'multiplier': 30, 'base_freq': 'minutes'}
+    ))
+    assert kwargs['rate'] == 10.0 and isinstance(kwargs['rate'], float)
+    assert kwargs['time_window'] == TimeWindow(15, 21)
+    assert kwargs['sample_rate'] == timedelta(minutes=30)
+    assert validate_fields(BlockTariff, block())['blocks'] == [Block(0, 300), Block(300, float('inf'))]
+    tou = TouTariff.from_dict({'name': 'tou', 'charge_type': 'TouTariff', 'tou': TOU, **COMMON})
+    assert tou.tou == TouBins(**TOU) and tou.sample_rate == timedelta(minutes=30)
+
+
+def test_errors_name_their_fields():
+    errors = errors_of(demand(rate='ten', frequency_applied='fortnight', extra=1, name='peak demand'))
+    assert errors[0] == 'unexpected field "extra"'
+    assert any(error.startswith('rate: expected a number') for error in errors)
+    assert any(error.startswith("frequency_applied: 'fortnight' is not one of") for error in errors)
+    with pytest.raises(TariffValidationError, match='DemandTariff "peak demand"'):
+        tariff_from_dict(demand(rate='ten', name='peak demand'))
+    assert errors_of({k: v for k, v in demand().items() if k != 'rate'}) == ['missing required field "rate"']
+    assert 'charge_type must be one of' in errors_of(demand(charge_type='DemandCharge'))[0]
+
+
+def test_block_frequency_is_checked():
+    assert errors_of(block(frequency_applied='fortnight'))[0].startswith('frequency_applied:')
+
+
+def test_tou_bins_must_have_a_rate_and_label_per_bin():
+    tou = {'time_bins': [7, 21, 24], 'bin_rates': [0.06, 0.1], 'bin_labels': ['off']}
+    errors = errors_of({'name': 'tou', 'charge_type': 'TouTariff', 'tou': tou, **COMMON})
+    assert errors == ['tou: time_bins, bin_rates, bin_labels must have the same length, '
+                      'got time_bins=3, bin_rates=2, bin_labels=1']
+
+
+def test_blocks_are_checked():
+    assert errors_of(block(blocks=[[300, 0], [300, 400]])) == ['blocks: block min (300) is greater than its max (0)']
+    assert errors_of(block(bin_rates=[0.2])) == [
+        'blocks, bin_rates, bin_labels must have the same length, got blocks=2, bin_rates=1, bin_labels=2'
+    ]
+
+
+@pytest.fixture
+def regime_path(tmp_path):
+    path = tmp_path / 'regime.json'
+    path.write_text(json.dumps({'name': 'regime', 'tariffs': [demand(), block(), demand()]}))
+    return path
+
+
+def test_loader_interns_identical_tariffs(regime_path, tmp_path):
+    loader = TariffLoader()
+    regime = loader.load_regime(regime_path)
+    assert regime.tariffs[0] is regime.tariffs[2]
+    other_path = tmp_path / 'other.json'
+    other_path.write_text(json.dumps({'name': 'other', 'tariffs': [block(), demand(rate=11)]}))
+    other = loader.load_regime(other_path)
+    assert other.tariffs[0] is regime.tariffs[1]
+    assert other.tariffs[1] is not regime.tariffs[0] and other.tariffs[1].rate == 11
+    # Regimes are cached by file content
+    assert loader.load_regime(regime_path) is regime
+
+
+def test_disk_cache_hits_and_misses(regime_path, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    regime = TariffLoader(cache_dir).load_regime(regime_path)
+    cached, = cache_dir.glob('*.pickle')
+
+    def parse(*args):
+        raise AssertionError('parsed despite a cached regime')
+
+    # Another loader (e.g. another process) loads the pickle without parsing
+    with monkeypatch.context() as patch:
+        patch.setattr(loading.TariffLoader, 'regime', parse)
+        assert loading.load_regime(regime_path, cache_dir=cache_dir).tariffs == regime.tariffs
+    with open(cached, 'rb') as f:
+        assert pickle.load(f).tariffs == regime.tariffs
+
+    # Changed content misses the cache
+    regime_path.write_text(json.dumps({'name': 'regime', 'tariffs': [demand(rate=12)]}))
+    assert TariffLoader(cache_dir).load_regime(regime_path).tariffs[0].rate == 12
+    assert len(list(cache_dir.glob('*.pickle'))) == 2
+
+
+def test_loader_reports_invalid_tariffs(tmp_path):
+    path = tmp_path / 'regime.json'
+    path.write_text(json.dumps({'name': 'regime', 'tariffs': [demand(frequency_applied='fortnight')]}))
+    with pytest.raises(TariffValidationError, match='frequency_applied'):
+        TariffLoader(tmp_path / 'cache').load_regime(path)
+    assert not list((tmp_path / 'cache').glob('*.pickle'))
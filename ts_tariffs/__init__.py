@@ -1,2 +1,31 @@
 """Timeseries Tariff Calculation""" 
 __version__ = "3.2.1"
+
+import importlib
+
+# Commonly used objects are importable from the package root, but are only
+# imported on first access so that e.g. reading __version__ or using the CLI
+# does not pay for importing pandas and friends up front
+_lazy_exports = {
+    'TariffRegime': 'ts_tariffs.billing',
+    'Bill': 'ts_tariffs.billing',
+    'Bills': 'ts_tariffs.billing',
+    'BillCompare': 'ts_tariffs.billing',
+    'BillsTable': 'ts_tariffs.billing',
+    'ChargeTable': 'ts_tariffs.charge_table',
+    'MeterData': 'ts_tariffs.meters',
+    'Meters': 'ts_tariffs.meters',
+    'TariffLoader': 'ts_tariffs.loading',
+    'load_regime': 'ts_tariffs.loading',
+    'tariffs_map': 'ts_tariffs.tariffs',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_exports:
+        return getattr(importlib.import_module(_lazy_exports[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_exports))
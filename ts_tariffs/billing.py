@@ -1,9 +1,15 @@
-from dataclasses import dataclass, field
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, replace
 from types import MappingProxyType
-from typing import List, Union
+from typing import List, Union, Iterable, Sequence, Dict
+import numpy as np
 import pandas as pd
 
-from ts_tariffs.meters import Meters
+from ts_tariffs import profiling
+from ts_tariffs.charge_table import ChargeTable
+from ts_tariffs.meters import Meters, MeterData, MemoMeterData
 from ts_tariffs.ts_utils import FrequencyOption
 from ts_tariffs.utils import EnforcedDict
 from ts_tariffs.tariffs import (
@@ -21,6 +27,34 @@ from ts_tariffs.tariffs import (
 frequency_units = FrequencyOption.options_as_list()
 
 
+def tariff_meter(tariff: Tariff, meters: Meters) -> MeterData:
+    """ Meter a tariff applies to: the meter of its consumption units, or
+    any meter for tariffs charged per period (which only need the index)
+    """
+    if tariff.consumption_unit in frequency_units:
+        return list(meters.values())[0]
+    return meters.meters_by_unit[tariff.consumption_unit]
+
+
+def tariff_structure_key(tariff: Tariff) -> tuple:
+    """ Key identifying a tariff by its type and parameters, excluding its
+    name, so that structurally identical tariffs (e.g. the same network
+    charge in several retail offers) share a key. Meter data parameters
+    (e.g. spot prices) are compared by identity
+    """
+    params = []
+    for f in fields(tariff):
+        if f.name in ('name', 'event_calendar'):
+            continue
+        value = getattr(tariff, f.name)
+        if isinstance(value, (MeterData, pd.Series, pd.DataFrame, np.ndarray)):
+            value = ('id', id(value))
+        else:
+            value = repr(value)
+        params.append((f.name, value))
+    return (type(tariff).__name__, tuple(params))
+
+
 @dataclass
 class TariffRegime:
     name: str
@@ -45,21 +79,68 @@ class TariffRegime:
         )
 
     def delete_charge(self, charge_name: str):
-        del self.from_dict[charge_name]
+        self.tariffs = [x for x in self.tariffs if x.name != charge_name]
 
     def add_charge(self, charge: Tariff):
-        self.from_dict[charge.name] = charge
+        self.delete_charge(charge.name)
+        self.tariffs.append(charge)
+
+    def calculate_bill(
+            self,
+            name: str,
+            meters: Meters,
+            profiler: profiling.Profiler = None,
+            max_workers: int = None,
+    ):
+        """ Bill of all the regime's tariffs applied to meters. If a Profiler
+        is given, the time and memory of each tariff's stages are recorded to it
+
+        With max_workers, tariffs are applied concurrently by a pool of that
+        many threads, e.g. for a single large meter with many charges. The
+        meters are shared (see MemoMeterData), so index attributes and period
+        segments are computed once. Only the numba kernels and large NumPy
+        reductions release the GIL though: each tariff's apply also builds
+        its charge_ts with pandas (groupbys, resamples, DataFrame
+        construction), which holds it, so threads speed up bills dominated
+        by the kernels but not those dominated by pandas. For many meters,
+        bill in worker processes (see cli.py and SharedTariffs) or use the
+        tariffs' batch_totals array paths. Charges are in the regime's order
+        whatever order the threads finish in. Profiled runs are always
+        serial, as the profiler's stage stack is not thread safe
+        """
+        if profiler is not None:
+            with profiler.activate(), profiler.stage(name):
+                return Bill(name, self._apply_tariffs(meters, profiler))
+        if max_workers is not None and max_workers > 1 and len(self.tariffs) > 1:
+            return Bill(name, self._apply_tariffs_threaded(meters, max_workers))
+        return Bill(name, self._apply_tariffs(meters))
 
-    def calculate_bill(self, name: str, meters: Meters):
+    def charge_table(self, name: str, meters: Meters) -> ChargeTable:
+        """ Charges of all the regime's tariffs applied to meters in long
+        format (see ChargeTable), as the bill called name. Meters are shared
+        between tariffs (see MemoMeterData), so periods are segmented once
+        """
+        shared = Meters({key: MemoMeterData.wrap(meter) for key, meter in meters.items()})
+        return ChargeTable.concat(
+            tariff.charge_table(tariff_meter(tariff, shared)) for tariff in self.tariffs
+        ).with_bill(name)
+
+    def _apply_tariffs(self, meters: Meters, profiler: profiling.Profiler = None) -> List[AppliedCharge]:
         applied_charges = []
-        for tariff in self.from_dict.values():
-            if tariff.consumption_unit in frequency_units:
-                # Needs only index, so use any meter
-                meter = list(meters.values())[0]
+        for tariff in self.tariffs:
+            meter = tariff_meter(tariff, meters)
+            if profiler is None:
+                applied_charges.append(tariff.apply(meter))
             else:
-                meter = meters.meters_by_unit[tariff.consumption_unit]
-            applied_charges.append(tariff.apply(meter))
-        return Bill(name, applied_charges)
+                with profiler.stage(type(tariff).__name__), profiler.stage(f'{tariff.name} ({meter.name})'):
+                    applied_charges.append(tariff.apply(meter))
+        return applied_charges
+
+    def _apply_tariffs_threaded(self, meters: Meters, max_workers: int) -> List[AppliedCharge]:
+        shared = Meters({key: MemoMeterData.wrap(meter) for key, meter in meters.items()})
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.tariffs))) as executor:
+            # map yields results in submission order
+            return list(executor.map(lambda tariff: tariff.apply(tariff_meter(tariff, shared)), self.tariffs))
 
 
 @dataclass
@@ -84,16 +165,229 @@ class Bill:
         return pd.Series(self.itemised_as_dict).rename(self.name)
 
 
+@dataclass
+class BillsTable:
+    """ Columnar representation of many bills: one row per applied charge,
+    held as contiguous arrays of bill names, charge names and totals
+
+    Avoids building a pd.Series per Bill, so fleets of bills can be
+    converted to a DataFrame, written to Arrow/Parquet, filtered and
+    aggregated in single vectorised steps
+    """
+    bill_names: np.ndarray
+    charge_names: np.ndarray
+    totals: np.ndarray
+
+    def __post_init__(self):
+        self.bill_names = np.asarray(self.bill_names, dtype=object)
+        self.charge_names = np.asarray(self.charge_names, dtype=object)
+        self.totals = np.asarray(self.totals, dtype=float)
+        if not len(self.bill_names) == len(self.charge_names) == len(self.totals):
+            raise ValueError('bill_names, charge_names and totals must all be the same length')
+
+    def __len__(self):
+        return len(self.totals)
+
+    @classmethod
+    def from_bills(cls, bills: Iterable[Bill]):
+        bill_names = []
+        charge_names = []
+        totals = []
+        for bill in bills:
+            for charge in bill.charges:
+                bill_names.append(bill.name)
+                charge_names.append(charge.name)
+                totals.append(charge.total)
+        return cls(bill_names, charge_names, totals)
+
+    @property
+    def as_dataframe(self) -> pd.DataFrame:
+        """ Long format table with one row per bill and charge
+        """
+        return pd.DataFrame({
+            'bill': self.bill_names,
+            'charge': self.charge_names,
+            'total': self.totals,
+        })
+
+    @property
+    def as_wide_dataframe(self) -> pd.DataFrame:
+        """ Charges as rows and bills as columns (same layout as
+        BillCompare.as_dataframe), built with a single scatter into a 2D array.
+        Raises ValueError if any bill and charge pair occurs more than once
+        """
+        bill_codes, bill_labels = pd.factorize(self.bill_names)
+        charge_codes, charge_labels = pd.factorize(self.charge_names)
+        pairs = charge_codes.astype(np.int64) * len(bill_labels) + bill_codes
+        if len(np.unique(pairs)) < len(pairs):
+            raise ValueError(
+                'Bill and charge pairs must be unique for a wide table, '
+                'aggregate duplicates first (e.g. via as_dataframe)'
+            )
+        values = np.full((len(charge_labels), len(bill_labels)), np.nan)
+        values[charge_codes, bill_codes] = self.totals
+        return pd.DataFrame(values, index=charge_labels, columns=bill_labels)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table({
+            'bill': pa.array(self.bill_names, type=pa.string()),
+            'charge': pa.array(self.charge_names, type=pa.string()),
+            'total': pa.array(self.totals, type=pa.float64()),
+        })
+
+    def to_parquet(self, path: str, **kwargs):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path, **kwargs)
+
+    def filter(
+            self,
+            bill_names: Sequence[str] = None,
+            charge_names: Sequence[str] = None,
+            min_total: float = None,
+            max_total: float = None,
+    ) -> BillsTable:
+        """ Subset of rows matching all of the given criteria
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if bill_names is not None:
+            mask &= pd.Index(self.bill_names).isin(bill_names)
+        if charge_names is not None:
+            mask &= pd.Index(self.charge_names).isin(charge_names)
+        if min_total is not None:
+            mask &= self.totals >= min_total
+        if max_total is not None:
+            mask &= self.totals <= max_total
+        return BillsTable(
+            self.bill_names[mask],
+            self.charge_names[mask],
+            self.totals[mask],
+        )
+
+    def bill_totals(self) -> pd.Series:
+        codes, labels = pd.factorize(self.bill_names)
+        return pd.Series(
+            np.bincount(codes, weights=self.totals, minlength=len(labels)),
+            index=labels,
+            name='total'
+        )
+
+    def charge_totals(self) -> pd.Series:
+        codes, labels = pd.factorize(self.charge_names)
+        return pd.Series(
+            np.bincount(codes, weights=self.totals, minlength=len(labels)),
+            index=labels,
+            name='total'
+        )
+
+    def charge_distribution(
+            self,
+            quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95)
+    ) -> pd.DataFrame:
+        """ Distribution of each charge's totals across all bills
+        (e.g. the spread of demand charges over a fleet of customers)
+        """
+        codes, labels = pd.factorize(self.charge_names)
+        order = np.argsort(codes, kind='stable')
+        sorted_totals = self.totals[order]
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+        rows = []
+        for j in range(len(labels)):
+            group = sorted_totals[bounds[j]:bounds[j + 1]]
+            rows.append([
+                len(group),
+                group.mean(),
+                group.std(),
+                group.min(),
+                *np.quantile(group, quantiles),
+                group.max(),
+            ])
+        columns = ['count', 'mean', 'std', 'min', *[f'q{q:g}' for q in quantiles], 'max']
+        return pd.DataFrame(rows, index=labels, columns=columns)
+
+
 @dataclass
 class BillCompare:
     bills: List[Bill]
 
+    @property
+    def as_table(self) -> BillsTable:
+        return BillsTable.from_bills(self.bills)
+
     @property
     def as_dataframe(self) -> pd.DataFrame:
-        bills_series = []
-        for bill in self.bills:
-            bills_series.append(bill.as_series)
-        return pd.concat(bills_series, axis=1)
+        names = [bill.name for bill in self.bills]
+        if len(set(names)) < len(names):
+            raise ValueError('Bills compared must have unique names')
+        return self.as_table.as_wide_dataframe
+
+
+@dataclass
+class RegimeCompare:
+    """ Bills many regimes (e.g. competing retail offers) for the same
+    meters, applying each structurally identical tariff (see
+    tariff_structure_key) once per meter and sharing period segments and
+    groupby statistics between all tariffs, so the cost scales with the
+    number of unique charges rather than regimes x tariffs
+
+    Identical charges are shared (renamed) between the regimes' bills, so
+    their charge_ts should be treated as read only
+    """
+    regimes: List[TariffRegime]
+
+    def __post_init__(self):
+        self._components: Dict[tuple, Tariff] = {}
+        self._regime_keys: List[List[tuple]] = []
+        for regime in self.regimes:
+            keys = []
+            for tariff in regime.tariffs:
+                key = tariff_structure_key(tariff)
+                self._components.setdefault(key, tariff)
+                keys.append(key)
+            self._regime_keys.append(keys)
+
+    @property
+    def n_tariffs(self) -> int:
+        return sum(len(keys) for keys in self._regime_keys)
+
+    @property
+    def n_unique_tariffs(self) -> int:
+        return len(self._components)
+
+    def calculate_bills(self, meters: Meters) -> List[Bill]:
+        """ Bill of each regime (named by the regime) for meters
+        """
+        memo_meters = {}
+        applied = {}
+        for key, tariff in self._components.items():
+            meter = tariff_meter(tariff, meters)
+            if id(meter) not in memo_meters:
+                memo_meters[id(meter)] = MemoMeterData.wrap(meter)
+            applied[key] = tariff.apply(memo_meters[id(meter)])
+
+        bills = []
+        for regime, keys in zip(self.regimes, self._regime_keys):
+            charges = [
+                applied[key] if applied[key].name == tariff.name else replace(applied[key], name=tariff.name)
+                for tariff, key in zip(regime.tariffs, keys)
+            ]
+            bills.append(Bill(regime.name, charges))
+        return bills
+
+    def compare(self, meters: Meters) -> BillCompare:
+        return BillCompare(self.calculate_bills(meters))
+
+    def rank(self, fleet: Dict[str, Meters]) -> pd.DataFrame:
+        """ Bill total of each regime (columns) for each customer's meters
+        (rows), with the cheapest regime of each customer
+        """
+        totals = pd.DataFrame(
+            [[bill.total for bill in self.calculate_bills(meters)] for meters in fleet.values()],
+            index=pd.Index(list(fleet), name='customer'),
+            columns=[regime.name for regime in self.regimes]
+        )
+        totals['cheapest'] = totals.idxmin(axis=1)
+        return totals
 
 
 class Bills(EnforcedDict):
@@ -110,3 +404,7 @@ class Bills(EnforcedDict):
     def append(self, bill: Bill):
         self[bill.name] = bill
 
+    @property
+    def as_table(self) -> BillsTable:
+        return BillsTable.from_bills(self.values())
+
@@ -0,0 +1,201 @@
+""" Long format charge output with the same schema for every tariff type
+
+AppliedCharge.charge_ts is shaped differently by each tariff (a Series of
+charges, or a DataFrame with columns such as "rate (dollars / kWh)" or
+"block_2_charge"). A ChargeTable instead has one row per charge component
+per interval or period, with fixed columns:
+
+    bill, charge, component   categorical (dictionary encoded) names
+    period_start, period_end  datetime64[ns] (end exclusive, local time)
+    quantity, rate, amount    float64, with amount = quantity x rate
+
+Components name what is charged, e.g. "consumption" (or a time of use
+bin label), "demand", "block_2", "import", "export" or "connection".
+Tables are built directly from each tariff's arrays (see
+Tariff.charge_table), so concatenating the tables of many charges and
+bills is an array append and they convert to Arrow without copying.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterable, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from ts_tariffs.ts_utils import SampleRate
+
+CATEGORICAL_COLUMNS = ('bill', 'charge', 'component')
+COLUMNS = ('bill', 'charge', 'component', 'period_start', 'period_end', 'quantity', 'rate', 'amount')
+
+
+def arrow_schema():
+    """ Arrow schema of ChargeTable.to_arrow(), the same for every table
+    """
+    import pyarrow as pa
+    names = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('bill', names),
+        ('charge', names),
+        ('component', names),
+        ('period_start', pa.timestamp('ns')),
+        ('period_end', pa.timestamp('ns')),
+        ('quantity', pa.float64()),
+        ('rate', pa.float64()),
+        ('amount', pa.float64()),
+    ])
+
+
+def _wall_times(timestamps) -> np.ndarray:
+    timestamps = pd.DatetimeIndex(timestamps)
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_localize(None)
+    return timestamps.values.astype('M8[ns]', copy=False)
+
+
+@dataclass
+class ChargeTable:
+    """ Charge components in long format, with the same columns whatever
+    the tariff types, see the module docstring
+    """
+    bill: pd.Categorical
+    charge: pd.Categorical
+    component: pd.Categorical
+    period_start: np.ndarray
+    period_end: np.ndarray
+    quantity: np.ndarray
+    rate: np.ndarray
+    amount: np.ndarray
+
+    def __post_init__(self):
+        if not all(len(getattr(self, column)) == len(self.amount) for column in COLUMNS):
+            raise ValueError(f'{", ".join(COLUMNS)} must all be the same length')
+
+    def __len__(self):
+        return len(self.amount)
+
+    @classmethod
+    def of_charge(
+            cls,
+            charge: str,
+            components: Sequence[str],
+            component_codes: Union[int, np.ndarray],
+            period_start: np.ndarray,
+            period_end: np.ndarray,
+            quantity: np.ndarray,
+            rate: Union[float, np.ndarray],
+    ) -> ChargeTable:
+        """ Rows of one charge, from quantities shaped (periods,) or
+        (periods, components per period), with the component of each given
+        by its position (code) in components. Codes and rates are broadcast
+        to the quantities, and period bounds repeated for each of a period's rows
+        """
+        quantity = np.asarray(quantity, dtype=float)
+        codes = np.broadcast_to(np.asarray(component_codes, dtype=np.int32), quantity.shape).ravel()
+        rate = np.broadcast_to(np.asarray(rate, dtype=float), quantity.shape).ravel()
+        repeats = quantity.shape[1] if quantity.ndim == 2 else 1
+        quantity = quantity.ravel()
+        single = np.zeros(len(quantity), dtype=np.int32)
+        return cls(
+            bill=pd.Categorical.from_codes(single, ['']),
+            charge=pd.Categorical.from_codes(single, [charge]),
+            component=pd.Categorical.from_codes(codes, list(components)),
+            period_start=np.repeat(_wall_times(period_start), repeats),
+            period_end=np.repeat(_wall_times(period_end), repeats),
+            quantity=quantity,
+            rate=rate,
+            amount=quantity * rate,
+        )
+
+    @classmethod
+    def of_intervals(
+            cls,
+            charge: str,
+            components: Sequence[str],
+            component_codes: Union[int, np.ndarray],
+            index: pd.DatetimeIndex,
+            sample_rate: Union[timedelta, SampleRate],
+            quantity: np.ndarray,
+            rate: Union[float, np.ndarray],
+    ) -> ChargeTable:
+        """ of_charge with a period per interval of index
+        """
+        return cls.of_charge(
+            charge, components, component_codes, index, index + pd.Timedelta(sample_rate), quantity, rate
+        )
+
+    @classmethod
+    def of_periods(
+            cls,
+            charge: str,
+            components: Sequence[str],
+            component_codes: Union[int, np.ndarray],
+            bounds: pd.DataFrame,
+            quantity: np.ndarray,
+            rate: Union[float, np.ndarray],
+    ) -> ChargeTable:
+        """ of_charge with periods given by the start and end columns of
+        bounds (see MeterData.period_bounds)
+        """
+        return cls.of_charge(
+            charge, components, component_codes, bounds['start'], bounds['end'], quantity, rate
+        )
+
+    @classmethod
+    def empty(cls) -> ChargeTable:
+        nothing = np.zeros(0, dtype='M8[ns]')
+        return cls.of_charge('', [], 0, nothing, nothing, np.zeros(0), 0.0)
+
+    @classmethod
+    def concat(cls, tables: Iterable[ChargeTable]) -> ChargeTable:
+        """ Rows of all tables, in order. Categories are merged rather
+        than the names being re-encoded
+        """
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        columns = {
+            column: union_categoricals([getattr(table, column) for table in tables], ignore_order=True)
+            for column in CATEGORICAL_COLUMNS
+        }
+        for column in COLUMNS[3:]:
+            columns[column] = np.concatenate([getattr(table, column) for table in tables])
+        return cls(**columns)
+
+    def with_bill(self, bill: str) -> ChargeTable:
+        """ Copy with every row in the named bill (arrays are shared)
+        """
+        return ChargeTable(
+            pd.Categorical.from_codes(np.zeros(len(self), dtype=np.int32), [bill]),
+            *(getattr(self, column) for column in COLUMNS[1:])
+        )
+
+    @property
+    def as_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({column: getattr(self, column) for column in COLUMNS})
+
+    def charge_totals(self) -> pd.Series:
+        """ Total amount of each bill and charge (skipping NaN amounts)
+        """
+        return self.as_dataframe.groupby(['bill', 'charge'], sort=False, observed=True)['amount'].sum()
+
+    def to_arrow(self):
+        """ Arrow table with arrow_schema(). Numeric and timestamp columns
+        are not copied
+        """
+        import pyarrow as pa
+        arrays = [
+            pa.DictionaryArray.from_arrays(
+                pa.array(getattr(self, column).codes.astype(np.int32, copy=False)),
+                pa.array(np.asarray(getattr(self, column).categories, dtype=object), type=pa.string())
+            )
+            for column in CATEGORICAL_COLUMNS
+        ]
+        arrays += [pa.array(getattr(self, column)) for column in COLUMNS[3:]]
+        return pa.Table.from_arrays(arrays, schema=arrow_schema())
+
+    def to_parquet(self, path: str, **kwargs):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path, **kwargs)
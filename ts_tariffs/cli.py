@@ -0,0 +1,339 @@
+""" ts-tariffs command line batch billing runner
+
+Bills every meter file (CSV or Parquet, one customer per file) against a
+tariff regime JSON and writes a single long format result table
+(meter_file, bill, charge, total) incrementally as bills complete.
+
+Example:
+    ts-tariffs regime.json 'meters/*.parquet' -o bills.parquet \\
+        --channel energy=kWh --channel apparent_power=kVA \\
+        --workers 8 --checkpoint bills.checkpoint
+
+With --shared-memory the regime is loaded once and workers attach to it
+in shared memory (see ts_tariffs.shared) rather than each loading it
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+import pandas as pd
+
+from ts_tariffs import __version__
+from ts_tariffs.billing import BillsTable, TariffRegime
+from ts_tariffs.loading import TariffLoader
+from ts_tariffs.meters import MeterData, Meters
+
+METER_FILE_SUFFIXES = ('.csv', '.parquet', '.pq')
+RESULT_COLUMNS = ['meter_file', 'bill', 'charge', 'total']
+
+# Regime loaded once per worker process by _init_worker
+_worker_regime: Optional[TariffRegime] = None
+
+
+def iter_meter_files(sources: List[str]) -> Iterator[str]:
+    """ Meter file paths from a mix of files, directories and glob patterns
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(
+                str(p) for p in Path(source).iterdir()
+                if p.suffix.lower() in METER_FILE_SUFFIXES
+            )
+        elif glob.has_magic(source):
+            paths = sorted(glob.glob(source))
+        else:
+            paths = [source]
+        yield from paths
+
+
+def read_meters(
+        path: str,
+        channels: Dict[str, str],
+        datetime_column: str,
+        sample_rate: Optional[timedelta],
+) -> Meters:
+    if Path(path).suffix.lower() == '.csv':
+        df = pd.read_csv(path, usecols=[datetime_column, *channels])
+    else:
+        df = pd.read_parquet(path, columns=[datetime_column, *channels])
+    df[datetime_column] = pd.to_datetime(df[datetime_column])
+    df = df.set_index(datetime_column).sort_index()
+    if sample_rate is None:
+        sample_rate = (df.index[1] - df.index[0]).to_pytimedelta()
+    return Meters({
+        column: MeterData(column, df[column], sample_rate, units)
+        for column, units in channels.items()
+    })
+
+
+def bill_meter_file(
+        path: str,
+        channels: Dict[str, str],
+        datetime_column: str,
+        sample_rate: Optional[timedelta],
+        regime: TariffRegime = None,
+) -> pd.DataFrame:
+    regime = regime or _worker_regime
+    meters = read_meters(path, channels, datetime_column, sample_rate)
+    bill = regime.calculate_bill(Path(path).stem, meters)
+    rows = BillsTable.from_bills([bill]).as_dataframe
+    rows.insert(0, 'meter_file', path)
+    return rows
+
+
+def _init_worker(regime_path: str, cache_dir: Optional[str]):
+    global _worker_regime
+    _worker_regime = TariffLoader(cache_dir).load_regime(regime_path)
+
+
+def _attach_worker(shared_name: str):
+    global _worker_regime
+    from ts_tariffs.shared import attach_regime
+    _worker_regime = attach_regime(shared_name)
+
+
+class ResultWriter:
+    """ Writes result rows to a CSV or Parquet file as they arrive
+
+    Meter files may only be checkpointed once their rows are durable, so
+    write() and flush() return the meter files whose rows now are. CSV rows
+    are appended as they arrive. Parquet files cannot be appended to, so
+    Parquet rows are written in batches of batch_size meter files to part
+    files in {path}.parts (each renamed into place once complete), which
+    close() merges into the output
+
+    When resuming from the meter files completed by a checkpoint, rows of
+    other meter files (written but not checkpointed before an interruption)
+    are dropped, and completed is narrowed to the checkpointed meter files
+    whose rows are in the output or a part file (e.g. left by a killed run)
+    """
+    def __init__(self, path: str, completed: Set[str] = None, batch_size: int = 256):
+        self.path = path
+        self.is_parquet = Path(path).suffix.lower() in ('.parquet', '.pq')
+        self.batch_size = batch_size
+        self.parts_dir = f'{path}.parts'
+        # Part names sort by run, then by batch
+        self._run = f'{time.time_ns():020d}'
+        self._n_parts = 0
+        self._buffered = []
+        if completed:
+            self.completed = self._reconcile(set(completed))
+        else:
+            self.completed = set()
+            if os.path.exists(path):
+                os.remove(path)
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+        self._write_header = not os.path.exists(path)
+
+    def _part_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(self.parts_dir), 'part-*.parquet')))
+
+    def _read(self, path: str) -> pd.DataFrame:
+        if not self.is_parquet:
+            return pd.read_csv(path, dtype={'meter_file': str, 'bill': str, 'charge': str})
+        return pd.read_parquet(path)
+
+    def _replace(self, path: str, rows: pd.DataFrame):
+        """ Atomically replace path with rows
+        """
+        tmp_path = f'{path}.tmp'
+        if self.is_parquet:
+            rows[RESULT_COLUMNS].to_parquet(tmp_path, index=False)
+        else:
+            rows[RESULT_COLUMNS].to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def _reconcile(self, completed: Set[str]) -> Set[str]:
+        present = set()
+        for path in ([self.path] if os.path.exists(self.path) else []) + self._part_paths():
+            rows = self._read(path)
+            # Parts may repeat rows already merged into the output by an interrupted close()
+            keep = rows['meter_file'].isin(completed) & ~rows['meter_file'].isin(present)
+            if not keep.any() and path != self.path:
+                os.remove(path)
+            elif not keep.all():
+                self._replace(path, rows[keep])
+            present.update(rows.loc[keep, 'meter_file'])
+        return completed & present
+
+    def write(self, path: str, rows: pd.DataFrame) -> List[str]:
+        """ Rows of a meter file. Returns the meter files whose rows are now durable
+        """
+        if not self.is_parquet:
+            rows[RESULT_COLUMNS].to_csv(self.path, mode='a', header=self._write_header, index=False)
+            self._write_header = False
+            return [path]
+        self._buffered.append((path, rows))
+        if len(self._buffered) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[str]:
+        """ Write buffered Parquet rows to a part file. Returns their meter files
+        """
+        if not self._buffered:
+            return []
+        paths = [path for path, _ in self._buffered]
+        os.makedirs(self.parts_dir, exist_ok=True)
+        part = os.path.join(self.parts_dir, f'part-{self._run}-{self._n_parts:06d}.parquet')
+        self._replace(part, pd.concat([rows for _, rows in self._buffered], ignore_index=True))
+        self._n_parts += 1
+        self._buffered = []
+        return paths
+
+    def close(self):
+        """ Merge the output and its part files. Buffered rows not flushed are discarded
+        """
+        parts = self._part_paths() if self.is_parquet else []
+        if not parts:
+            return
+        existing = [self.path] if os.path.exists(self.path) else []
+        self._replace(self.path, pd.concat([self._read(path) for path in existing + parts], ignore_index=True))
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+
+def read_checkpoint(path: Optional[str]) -> Set[str]:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def parse_channel(value: str) -> tuple:
+    column, sep, units = value.partition('=')
+    if not sep or not column or not units:
+        raise argparse.ArgumentTypeError(f'channel must be COLUMN=UNITS, got {value!r}')
+    return column, units
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='ts-tariffs',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('regime', help='Tariff regime JSON file')
+    parser.add_argument('meters', nargs='+', help='Meter files, directories or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='Result file (.csv or .parquet)')
+    parser.add_argument(
+        '-c', '--channel', dest='channels', action='append', type=parse_channel, required=True,
+        metavar='COLUMN=UNITS', help='Meter column and its consumption units (repeatable)'
+    )
+    parser.add_argument('--datetime-column', default='datetime')
+    parser.add_argument(
+        '--sample-rate', type=pd.Timedelta, default=None,
+        help='Meter sample rate, e.g. 30min (inferred from each file if omitted)'
+    )
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        '--checkpoint', default=None,
+        help='File recording completed meter files; completed files are skipped when re-run'
+    )
+    parser.add_argument('--cache-dir', default=None, help='Parsed regime cache directory')
+    parser.add_argument(
+        '--shared-memory', action='store_true',
+        help='Load the regime once and share it with workers via shared memory'
+    )
+    parser.add_argument('-q', '--quiet', action='store_true', help='No progress output')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    channels = dict(args.channels)
+    sample_rate = args.sample_rate.to_pytimedelta() if args.sample_rate is not None else None
+    writer = ResultWriter(args.output, read_checkpoint(args.checkpoint))
+    pending = [path for path in iter_meter_files(args.meters) if path not in writer.completed]
+    total = len(pending)
+
+    checkpoint = open(args.checkpoint, 'a') if args.checkpoint else None
+    shared = None
+    failures = 0
+    done = 0
+    start = time.perf_counter()
+
+    def checkpoint_written(paths: List[str]):
+        if checkpoint and paths:
+            checkpoint.writelines(path + '\n' for path in paths)
+            checkpoint.flush()
+
+    def record(path: str, rows: pd.DataFrame = None, error: Exception = None):
+        nonlocal done, failures
+        done += 1
+        if error is not None:
+            failures += 1
+            print(f'ERROR {path}: {error!r}', file=sys.stderr)
+        else:
+            checkpoint_written(writer.write(path, rows))
+        if not args.quiet:
+            rate = done / (time.perf_counter() - start)
+            print(f'[{done}/{total}] {rate:.1f} meters/s {path}', file=sys.stderr)
+
+    try:
+        if args.workers <= 1:
+            regime = TariffLoader(args.cache_dir).load_regime(args.regime)
+            for path in pending:
+                try:
+                    record(path, bill_meter_file(path, channels, args.datetime_column, sample_rate, regime))
+                except Exception as e:
+                    record(path, error=e)
+        else:
+            if args.shared_memory:
+                from ts_tariffs.shared import SharedTariffs
+                shared = SharedTariffs.publish([TariffLoader(args.cache_dir).load_regime(args.regime)])
+                initializer, initargs = _attach_worker, (shared.name,)
+            else:
+                initializer, initargs = _init_worker, (args.regime, args.cache_dir)
+            with ProcessPoolExecutor(
+                    max_workers=args.workers,
+                    initializer=initializer,
+                    initargs=initargs,
+            ) as executor:
+                # Bound the number of in flight meters so that memory use
+                # does not grow with the size of the portfolio
+                queue = iter(pending)
+                in_flight = {}
+                while True:
+                    for path in queue:
+                        future = executor.submit(
+                            bill_meter_file, path, channels, args.datetime_column, sample_rate
+                        )
+                        in_flight[future] = path
+                        if len(in_flight) >= 2 * args.workers:
+                            break
+                    if not in_flight:
+                        break
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        path = in_flight.pop(future)
+                        try:
+                            record(path, future.result())
+                        except Exception as e:
+                            record(path, error=e)
+    finally:
+        checkpoint_written(writer.flush())
+        writer.close()
+        if checkpoint:
+            checkpoint.close()
+        if shared is not None:
+            shared.unlink()
+
+    if not args.quiet:
+        print(
+            f'Billed {done - failures} of {total} meters in {time.perf_counter() - start:.1f}s'
+            f' ({failures} failed)',
+            file=sys.stderr
+        )
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+""" Scenario (Monte Carlo) billing over ensembles of consumption profiles
+
+Bills scenarios x meters x intervals arrays of consumption on a shared time
+grid against a TariffRegime, e.g. 1,000 noisy load forecasts per customer.
+The grid's period segments, time of day masks and time of use rates are
+computed once (see meters.TimeGrid), each tariff is applied to all the
+meters of a chunk of scenarios at once (see Tariff.batch_totals) and only
+the bill totals are kept, so memory is bounded by the chunk size. Arrays
+may be memory mapped (e.g. np.load(path, mmap_mode='r')), in which case
+scenarios are read from disk a chunk at a time.
+
+Example:
+    bills = bill_ensemble(regime, traces, index, timedelta(minutes=30), units='kWh')
+    print(bills.summary(quantiles=(0.05, 0.5, 0.95)))
+"""
+from dataclasses import dataclass
+from datetime import timedelta, datetime
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from ts_tariffs.billing import TariffRegime, frequency_units
+from ts_tariffs.meters import MeterData, TimeGrid
+from ts_tariffs.tariffs import Tariff
+from ts_tariffs.ts_utils import SampleRate
+
+
+@dataclass
+class EnsembleBills:
+    """ Bill totals for each scenario, meter and charge, with totals shaped
+    scenarios x meters x charges
+    """
+    meter_names: List[str]
+    charge_names: List[str]
+    totals: np.ndarray
+
+    @property
+    def n_scenarios(self) -> int:
+        return self.totals.shape[0]
+
+    def bill_totals(self) -> pd.DataFrame:
+        """ Total bill of each scenario (rows) for each meter (columns)
+        """
+        return pd.DataFrame(self.totals.sum(axis=-1), columns=self.meter_names)
+
+    def charge_totals(self, charge_name: str) -> pd.DataFrame:
+        """ Total of one charge for each scenario (rows) and meter (columns)
+        """
+        return pd.DataFrame(
+            self.totals[..., self.charge_names.index(charge_name)],
+            columns=self.meter_names
+        )
+
+    def summary(self, quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> pd.DataFrame:
+        """ Mean, standard deviation and quantiles over scenarios of each
+        charge and of the bill 'total', indexed by meter and charge
+        """
+        totals = np.concatenate([self.totals, self.totals.sum(axis=-1, keepdims=True)], axis=-1)
+        index = pd.MultiIndex.from_product(
+            [self.meter_names, self.charge_names + ['total']],
+            names=['meter', 'charge']
+        )
+        stats = {
+            'mean': totals.mean(axis=0).ravel(),
+            'std': totals.std(axis=0).ravel(),
+        }
+        for q, values in zip(quantiles, np.quantile(totals, quantiles, axis=0)):
+            stats[f'q{q:g}'] = values.ravel()
+        return pd.DataFrame(stats, index=index)
+
+
+def _fallback_totals(
+        tariff: Tariff,
+        rows: np.ndarray,
+        grid: TimeGrid,
+        units: str
+) -> np.ndarray:
+    """ Totals from Tariff.apply for tariffs without a batch implementation
+    """
+    return np.array([
+        tariff.apply(MeterData(
+            tariff.name,
+            pd.Series(row, index=grid.index),
+            grid.sample_rate,
+            units,
+            grid.billing_cycles
+        )).total
+        for row in rows
+    ], dtype=float)
+
+
+def bill_ensemble(
+        regime: TariffRegime,
+        consumption: Union[np.ndarray, Dict[str, np.ndarray]],
+        index: pd.DatetimeIndex,
+        sample_rate: Union[timedelta, SampleRate],
+        units: str = None,
+        meter_names: List[str] = None,
+        chunk_size: int = 100,
+        billing_cycles: List[datetime] = None,
+) -> EnsembleBills:
+    """ Bill totals of every scenario and meter of an ensemble
+
+    consumption is a scenarios x meters x intervals array of the given
+    units, or a dict of such arrays keyed by units when the regime's
+    tariffs apply to several (e.g. kWh and kVA). Scenarios are billed
+    chunk_size at a time
+    """
+    if not isinstance(consumption, dict):
+        if units is None:
+            raise ValueError('units must be given when consumption is a single array')
+        consumption = {units: consumption}
+    n_scenarios, n_meters, n_intervals = next(iter(consumption.values())).shape
+    for unit, values in consumption.items():
+        if values.shape != (n_scenarios, n_meters, n_intervals):
+            raise ValueError(f'{unit} consumption is shaped {values.shape}, expected {(n_scenarios, n_meters, n_intervals)}')
+    if n_intervals != len(index):
+        raise ValueError(f'consumption has {n_intervals} intervals but index has {len(index)}')
+
+    grid = TimeGrid(index, sample_rate, billing_cycles)
+    totals = np.empty((n_scenarios, n_meters, len(regime.tariffs)))
+    for start in range(0, n_scenarios, chunk_size):
+        stop = min(start + chunk_size, n_scenarios)
+        rows_by_unit = {
+            unit: np.asarray(values[start:stop], dtype=float).reshape(-1, n_intervals)
+            for unit, values in consumption.items()
+        }
+        for j, tariff in enumerate(regime.tariffs):
+            if tariff.consumption_unit in frequency_units:
+                # Needs only the index, so use any consumption
+                unit = next(iter(rows_by_unit))
+            else:
+                unit = tariff.consumption_unit
+            rows = rows_by_unit[unit]
+            try:
+                chunk_totals = tariff.batch_totals(rows, grid)
+            except NotImplementedError:
+                chunk_totals = _fallback_totals(tariff, rows, grid, unit)
+            totals[start:stop, :, j] = chunk_totals.reshape(stop - start, n_meters)
+
+    return EnsembleBills(
+        meter_names=list(meter_names) if meter_names is not None else [f'meter_{i}' for i in range(n_meters)],
+        charge_names=[tariff.name for tariff in regime.tariffs],
+        totals=totals
+    )
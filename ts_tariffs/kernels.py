@@ -0,0 +1,411 @@
+""" Array-in/array-out kernels for the hot loops of tariff calculations
+
+All kernels operate along the last axis, so they accept a single meter
+(1D) or many meters sharing a time index (2D, meters x intervals).
+
+Segments are contiguous runs of a sorted time index (e.g. each month of
+a meter's data) identified by their start positions, as returned by
+segment_starts().
+
+If numba is installed, the segmented reductions are JIT compiled and used
+transparently. The pure NumPy implementations remain available (suffixed
+_numpy) and are used when numba is absent or set_jit(False) is called
+"""
+import importlib.util
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+# numba is only imported (and kernels compiled) on first use, so that it
+# does not add to import time
+JIT_AVAILABLE = importlib.util.find_spec('numba') is not None
+_use_jit = JIT_AVAILABLE
+
+
+def set_jit(enabled: bool):
+    """ Enable or disable the numba kernels (if numba is installed)
+    """
+    global _use_jit
+    _use_jit = enabled and JIT_AVAILABLE
+
+
+def jit_enabled() -> bool:
+    return _use_jit
+
+
+def segment_starts(keys: np.ndarray) -> np.ndarray:
+    """ Start position of each run of equal values in keys (1D array, or
+    2D array of key levels x positions, where a run ends when any level changes)
+    """
+    keys = np.atleast_2d(keys)
+    if keys.shape[-1] == 0:
+        return np.array([], dtype=np.intp)
+    changed = np.ones(keys.shape[-1], dtype=bool)
+    changed[1:] = (keys[:, 1:] != keys[:, :-1]).any(axis=0)
+    return np.flatnonzero(changed)
+
+
+def segment_lengths(starts: np.ndarray, n: int) -> np.ndarray:
+    return np.diff(np.append(starts, n))
+
+
+def segment_ids(starts: np.ndarray, n: int) -> np.ndarray:
+    """ Segment number of each of n positions
+    """
+    return np.repeat(np.arange(len(starts)), segment_lengths(starts, n))
+
+
+def tou_gather(hours: np.ndarray, time_bins, bin_rates) -> np.ndarray:
+    """ Rate applicable at each hour of day, given time of use bin edges
+    """
+    return np.asarray(bin_rates, dtype=float)[np.digitize(hours, bins=time_bins)]
+
+
+def weighted_total(values: np.ndarray, rates) -> np.ndarray:
+    """ Sum of values x rates along the last axis (rates may be a scalar)
+    """
+    if np.ndim(rates) == 0:
+        return np.sum(values, axis=-1) * rates
+    return np.dot(values, rates)
+
+
+def grouped_sum(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """ Sum of 1D values by integer group code (codes need not be contiguous)
+    """
+    return np.bincount(codes, weights=values, minlength=n_groups)
+
+
+# ---------------------------------------------------------------------------
+# Segmented reductions: NumPy implementations
+# ---------------------------------------------------------------------------
+
+def _empty_segments(values: np.ndarray) -> np.ndarray:
+    return np.zeros(values.shape[:-1] + (0,))
+
+
+def _reduceat(ufunc: np.ufunc, values: np.ndarray, starts: np.ndarray, empty: float) -> np.ndarray:
+    """ ufunc.reduceat of each segment, with empty segments (repeated starts,
+    or starts at the end) reduced to empty rather than reduceat's value at the start
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    n = values.shape[-1]
+    lengths = segment_lengths(starts, n)
+    if lengths.min() > 0:
+        return ufunc.reduceat(values, starts, axis=-1)
+    # Pad so that starts equal to the length are valid reduceat indices
+    padded = np.concatenate([values, np.full(values.shape[:-1] + (1,), empty)], axis=-1)
+    return np.where(lengths > 0, ufunc.reduceat(padded, starts, axis=-1), empty)
+
+
+def segment_sum_numpy(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """ NaN-skipping sum of each segment
+    """
+    if not len(starts):
+        return _empty_segments(values)
+    return _reduceat(np.add, np.where(np.isnan(values), 0.0, values), starts, 0.0)
+
+
+def segment_max_numpy(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """ NaN-skipping max of each segment (NaN if all values are NaN)
+    """
+    if not len(starts):
+        return _empty_segments(values)
+    return _reduceat(np.fmax, np.asarray(values, dtype=float), starts, np.nan)
+
+
+def segment_min_numpy(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if not len(starts):
+        return _empty_segments(values)
+    return _reduceat(np.fmin, np.asarray(values, dtype=float), starts, np.nan)
+
+
+def window_max_numpy(values: np.ndarray, window_starts: np.ndarray, window_stops: np.ndarray) -> np.ndarray:
+    """ NaN-skipping max of values over arbitrary (possibly overlapping)
+    [start, stop) position ranges. Empty windows are NaN
+    """
+    window_starts = np.asarray(window_starts, dtype=np.intp)
+    window_stops = np.asarray(window_stops, dtype=np.intp)
+    if not len(window_starts):
+        return _empty_segments(values)
+    # Pad so that stops equal to the length are valid reduceat indices
+    padded = np.concatenate([values, np.full(values.shape[:-1] + (1,), np.nan)], axis=-1)
+    indices = np.empty(2 * len(window_starts), dtype=np.intp)
+    indices[0::2] = window_starts
+    indices[1::2] = window_stops
+    maxima = np.fmax.reduceat(padded, indices, axis=-1)[..., 0::2]
+    return np.where(window_stops > window_starts, maxima, np.nan)
+
+
+# ---------------------------------------------------------------------------
+# Segmented reductions: loop implementations (2D, rows x positions),
+# JIT compiled with numba on first use
+# ---------------------------------------------------------------------------
+
+def _segment_sum_loops(values, starts):
+    n_rows, n = values.shape
+    out = np.zeros((n_rows, len(starts)))
+    for r in range(n_rows):
+        for j in range(len(starts)):
+            stop = starts[j + 1] if j + 1 < len(starts) else n
+            total = 0.0
+            for i in range(starts[j], stop):
+                v = values[r, i]
+                if not np.isnan(v):
+                    total += v
+            out[r, j] = total
+    return out
+
+
+def _window_max_loops(values, window_starts, window_stops):
+    n_rows = values.shape[0]
+    out = np.full((n_rows, len(window_starts)), np.nan)
+    for r in range(n_rows):
+        for j in range(len(window_starts)):
+            peak = np.nan
+            for i in range(window_starts[j], window_stops[j]):
+                v = values[r, i]
+                if not np.isnan(v) and (np.isnan(peak) or v > peak):
+                    peak = v
+            out[r, j] = peak
+    return out
+
+
+def _window_min_loops(values, window_starts, window_stops):
+    n_rows = values.shape[0]
+    out = np.full((n_rows, len(window_starts)), np.nan)
+    for r in range(n_rows):
+        for j in range(len(window_starts)):
+            low = np.nan
+            for i in range(window_starts[j], window_stops[j]):
+                v = values[r, i]
+                if not np.isnan(v) and (np.isnan(low) or v < low):
+                    low = v
+            out[r, j] = low
+    return out
+
+
+def _masked_segment_loops(values, mask, starts):
+    # sum, count, max and min of the masked, non-NaN values of each segment
+    n_rows, n = values.shape
+    out = np.full((4, n_rows, len(starts)), np.nan)
+    for r in range(n_rows):
+        for j in range(len(starts)):
+            stop = starts[j + 1] if j + 1 < len(starts) else n
+            total = 0.0
+            count = 0
+            peak = np.nan
+            low = np.nan
+            for i in range(starts[j], stop):
+                v = values[r, i]
+                if mask[i] and not np.isnan(v):
+                    total += v
+                    count += 1
+                    if np.isnan(peak) or v > peak:
+                        peak = v
+                    if np.isnan(low) or v < low:
+                        low = v
+            out[0, r, j] = total
+            out[1, r, j] = count
+            out[2, r, j] = peak
+            out[3, r, j] = low
+    return out
+
+
+@lru_cache(maxsize=None)
+def _jit(func):
+    import numba
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+def _as_rows(values: np.ndarray) -> Tuple[np.ndarray, tuple]:
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    return values.reshape(-1, values.shape[-1]), values.shape[:-1]
+
+
+def _segment_stops(starts: np.ndarray, n: int) -> np.ndarray:
+    return np.append(starts[1:], n).astype(np.intp)
+
+
+# ---------------------------------------------------------------------------
+# Dispatching kernels
+# ---------------------------------------------------------------------------
+
+def segment_sum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if _use_jit and len(starts):
+        rows, lead = _as_rows(values)
+        return _jit(_segment_sum_loops)(rows, np.asarray(starts, dtype=np.intp)).reshape(lead + (len(starts),))
+    return segment_sum_numpy(values, starts)
+
+
+def segment_max(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if _use_jit and len(starts):
+        starts = np.asarray(starts, dtype=np.intp)
+        return window_max(values, starts, _segment_stops(starts, np.shape(values)[-1]))
+    return segment_max_numpy(values, starts)
+
+
+def segment_min(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if _use_jit and len(starts):
+        rows, lead = _as_rows(values)
+        starts = np.asarray(starts, dtype=np.intp)
+        return _jit(_window_min_loops)(rows, starts, _segment_stops(starts, rows.shape[-1])).reshape(lead + (len(starts),))
+    return segment_min_numpy(values, starts)
+
+
+def segment_argmax(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """ Position (along the last axis) of the first NaN-skipping max of each
+    segment, or -1 if all of its values are NaN
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(starts):
+        return np.zeros(values.shape[:-1] + (0,), dtype=np.intp)
+    n = values.shape[-1]
+    maxima = segment_max(values, starts)
+    is_max = values == np.repeat(maxima, segment_lengths(starts, n), axis=-1)
+    positions = np.where(is_max, np.arange(n), n)
+    first = _reduceat(np.minimum, positions, starts, n)
+    return np.where(first == n, -1, first)
+
+
+def segment_count(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """ Number of non-NaN values in each segment
+    """
+    return segment_sum((~np.isnan(values)).astype(float), starts)
+
+
+def segment_mean(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return segment_sum(values, starts) / segment_count(values, starts)
+
+
+def window_max(values: np.ndarray, window_starts: np.ndarray, window_stops: np.ndarray) -> np.ndarray:
+    if _use_jit and len(window_starts):
+        rows, lead = _as_rows(values)
+        return _jit(_window_max_loops)(
+            rows,
+            np.asarray(window_starts, dtype=np.intp),
+            np.asarray(window_stops, dtype=np.intp)
+        ).reshape(lead + (len(window_starts),))
+    return window_max_numpy(values, window_starts, window_stops)
+
+
+# Segmented statistics usable in place of pandas groupby aggregations
+segment_reducers = {
+    'sum': segment_sum,
+    'max': segment_max,
+    'min': segment_min,
+    'count': segment_count,
+    'mean': segment_mean,
+}
+
+
+def masked_segment_stats(
+        values: np.ndarray,
+        mask: np.ndarray,
+        starts: np.ndarray,
+        stats: Sequence[str]
+) -> Dict[str, np.ndarray]:
+    """ segment_reducers statistics of each segment over only the positions
+    where mask (1D, along the last axis) is True, without copying the
+    selected values out. Segments with no selected values are NaN (0 for
+    sum and count)
+    """
+    if _use_jit and len(starts):
+        rows, lead = _as_rows(values)
+        out = _jit(_masked_segment_loops)(rows, np.asarray(mask, dtype=np.bool_), np.asarray(starts, dtype=np.intp))
+        sums, counts, maxima, minima = (reduced.reshape(lead + (len(starts),)) for reduced in out)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            computed = {'sum': sums, 'count': counts, 'max': maxima, 'min': minima, 'mean': sums / counts}
+        return {stat: computed[stat] for stat in stats}
+    masked = np.where(mask, values, np.nan)
+    return {stat: segment_reducers[stat](masked, starts) for stat in stats}
+
+
+# ---------------------------------------------------------------------------
+# Tariff specific kernels
+# ---------------------------------------------------------------------------
+
+def block_consumption(totals: np.ndarray, block_mins, block_maxs) -> np.ndarray:
+    """ Consumption falling within each block for each period total, shaped
+    (..., blocks, periods)
+    """
+    mins = np.asarray(block_mins, dtype=float)[:, None]
+    maxs = np.asarray(block_maxs, dtype=float)[:, None]
+    totals = np.asarray(totals, dtype=float)[..., None, :]
+    return np.clip(totals, mins, maxs) - mins
+
+
+def block_cost(totals: np.ndarray, block_mins, block_maxs, block_rates) -> np.ndarray:
+    """ Cost of each block for each period total, shaped (..., blocks, periods)
+    """
+    rates = np.asarray(block_rates, dtype=float)[:, None]
+    return block_consumption(totals, block_mins, block_maxs) * rates
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """ Trailing mean over a window of samples, computed in O(n) from
+    cumulative sums. Positions without a full window of history, or whose
+    window contains a NaN, are NaN (as pandas rolling(window).mean())
+    """
+    values = np.asarray(values, dtype=float)
+    if window < 1:
+        raise ValueError(f'window must be at least one sample, {window} was passed')
+    out = np.full(values.shape, np.nan)
+    if window > values.shape[-1]:
+        return out
+    missing = np.isnan(values)
+    # NaNs are summed as zero and counted, so they only affect their own windows
+    csum = np.cumsum(np.where(missing, 0.0, values), axis=-1)
+    ccount = np.cumsum(missing, axis=-1)
+    window_missing = np.empty(values.shape, dtype=ccount.dtype)
+    out[..., window - 1] = csum[..., window - 1]
+    out[..., window:] = csum[..., window:] - csum[..., :-window]
+    window_missing[..., :window - 1] = 0
+    window_missing[..., window - 1] = ccount[..., window - 1]
+    window_missing[..., window:] = ccount[..., window:] - ccount[..., :-window]
+    out[window_missing > 0] = np.nan
+    return out / window
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """ Trailing max over a window of samples in O(n), independent of the
+    window size (van Herk/Gil-Werman block prefix and suffix maxima).
+    Positions without a full window of history are NaN
+    """
+    values = np.asarray(values, dtype=float)
+    if window < 1:
+        raise ValueError(f'window must be at least one sample, {window} was passed')
+    n = values.shape[-1]
+    out = np.full(values.shape, np.nan)
+    if window > n:
+        return out
+    pad = (-n) % window
+    padded = np.concatenate([values, np.full(values.shape[:-1] + (pad,), -np.inf)], axis=-1)
+    blocks = padded.reshape(values.shape[:-1] + (-1, window))
+    prefix = np.maximum.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = np.maximum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    out[..., window - 1:] = np.maximum(suffix[..., :n - window + 1], prefix[..., window - 1:n])
+    return out
+
+
+def segment_top_n_mean(values: np.ndarray, starts: np.ndarray, n: int) -> np.ndarray:
+    """ Mean of the n largest values in each segment, using a partial sort
+    (np.partition) rather than a full sort of each segment. Segments with
+    fewer than n values average all of their values
+    """
+    values = np.asarray(values, dtype=float)
+    starts = np.asarray(starts)
+    if not len(starts):
+        return _empty_segments(values)
+    lengths = segment_lengths(starts, values.shape[-1])
+    width = lengths.max()
+    position = np.arange(values.shape[-1]) - np.repeat(starts, lengths)
+    padded = np.full(values.shape[:-1] + (len(starts), width), -np.inf)
+    padded[..., segment_ids(starts, values.shape[-1]), position] = np.where(np.isnan(values), -np.inf, values)
+    k = min(n, width)
+    top = np.partition(padded, width - k, axis=-1)[..., width - k:]
+    counts = np.count_nonzero(~np.isneginf(top), axis=-1)
+    top = np.where(np.isneginf(top), 0.0, top)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return top.sum(axis=-1) / counts
@@ -0,0 +1,89 @@
+""" Loading of tariff regime definitions from JSON files
+
+Tariffs are validated on load (see ts_tariffs.validation), identical tariff
+definitions are interned so they are parsed once and shared, and parsed
+regimes are cached by file content hash (optionally on disk) so repeat
+loads skip parsing entirely
+"""
+import hashlib
+import json
+import pickle
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
+
+from ts_tariffs import __version__
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.tariffs import Tariff, tariffs_map
+from ts_tariffs.validation import TariffValidationError
+
+
+def tariff_from_dict(tariff_dict: dict) -> Tariff:
+    """ Validated Tariff of the type named by the dict's charge_type
+    """
+    charge_type = tariff_dict.get('charge_type')
+    if charge_type not in tariffs_map:
+        raise TariffValidationError(
+            f'tariff "{tariff_dict.get("name")}"',
+            [f'charge_type must be one of {list(tariffs_map)}, got {charge_type!r}']
+        )
+    return tariffs_map[charge_type].from_dict(tariff_dict)
+
+
+class TariffLoader:
+    """ Loads TariffRegimes, interning repeated tariff definitions and
+    caching parsed regimes by file hash
+
+    Interned tariffs are shared between regimes, so should be treated as
+    read only. If cache_dir is given, parsed regimes are also pickled there
+    so that later processes can skip parsing and validation
+    """
+    def __init__(self, cache_dir: Union[str, Path] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._tariffs: Dict[str, Tariff] = {}
+        self._regimes: Dict[str, TariffRegime] = {}
+
+    @staticmethod
+    def _tariff_key(tariff_dict: dict) -> str:
+        return json.dumps(tariff_dict, sort_keys=True, default=str)
+
+    def tariff(self, tariff_dict: dict) -> Tariff:
+        key = self._tariff_key(tariff_dict)
+        if key not in self._tariffs:
+            self._tariffs[key] = tariff_from_dict(tariff_dict)
+        return self._tariffs[key]
+
+    def regime(self, regime_dict: dict) -> TariffRegime:
+        if 'name' not in regime_dict or 'tariffs' not in regime_dict:
+            raise ValueError('Tariff dict must contain a "name" and a "tariffs" key')
+        return TariffRegime(
+            name=regime_dict['name'],
+            tariffs=[self.tariff(tariff_dict) for tariff_dict in regime_dict['tariffs']]
+        )
+
+    def _cache_path(self, digest: str) -> Path:
+        return self.cache_dir / f'{digest}.pickle'
+
+    def load_regime(self, path: Union[str, Path]) -> TariffRegime:
+        content = Path(path).read_bytes()
+        digest = hashlib.sha256(content + __version__.encode()).hexdigest()
+        if digest in self._regimes:
+            return self._regimes[digest]
+        if self.cache_dir and self._cache_path(digest).exists():
+            with open(self._cache_path(digest), 'rb') as f:
+                regime = pickle.load(f)
+        else:
+            regime = self.regime(json.loads(content))
+            if self.cache_dir:
+                with open(self._cache_path(digest), 'wb') as f:
+                    pickle.dump(regime, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._regimes[digest] = regime
+        return regime
+
+    def load_regimes(self, paths: Iterable[Union[str, Path]]) -> List[TariffRegime]:
+        return [self.load_regime(path) for path in paths]
+
+
+def load_regime(path: Union[str, Path], cache_dir: Union[str, Path] = None) -> TariffRegime:
+    return TariffLoader(cache_dir).load_regime(path)
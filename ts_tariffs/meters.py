@@ -1,16 +1,589 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import timedelta, datetime, time
-from typing import Union, Optional, List
+from typing import Union, Optional, List, Tuple, Iterable, Dict
 from copy import deepcopy, copy
+import threading
 
+import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 
-from ts_tariffs.ts_utils import period_cascades_map, TimeWindow, FrequencyOption, SampleRate, DateWindow, DatetimeWindow
+from ts_tariffs import kernels, profiling
+from ts_tariffs.ts_utils import period_cascades_map, resample_schema, TimeWindow, FrequencyOption, SampleRate, \
+    DateWindow, DatetimeWindow
 from ts_tariffs.utils import EnforcedDict
 
+DAY_NANOSECONDS = 24 * 3600 * 10 ** 9
+
+
+def period_attribute(
+        index: pd.DatetimeIndex,
+        period: str
+) -> np.ndarray:
+    """ Values of a period cascade attribute (e.g. year, month, date) for each index position
+    """
+    if period == 'week':
+        return index.isocalendar().week.to_numpy(dtype=int)
+    return np.asarray(getattr(index, period))
+
+
+def cycle_segments(
+        index: pd.DatetimeIndex,
+        cycle_boundaries: List[datetime]
+) -> Tuple[np.ndarray, pd.MultiIndex]:
+    """ Start positions and (cycle_start, cycle_end) labels of each billing
+    cycle with data, for a sorted index within the first and last boundaries
+    """
+    if cycle_boundaries is None:
+        raise ValueError('Billing cycle boundaries are required for frequency "cycle"')
+    boundaries = pd.DatetimeIndex(cycle_boundaries)
+    if len(boundaries) < 2 or not boundaries.is_monotonic_increasing:
+        raise ValueError('Billing cycle boundaries must be at least two increasing datetimes')
+    positions = index.searchsorted(boundaries)
+    has_data = positions[1:] > positions[:-1]
+    labels = pd.MultiIndex.from_arrays(
+        [boundaries[:-1][has_data], boundaries[1:][has_data]],
+        names=period_cascades_map['cycle']
+    )
+    return positions[:-1][has_data], labels
+
+
+def cycle_columns(
+        index: pd.DatetimeIndex,
+        cycle_boundaries: List[datetime]
+) -> slice:
+    """ Positions of a sorted index within the billing cycles (from the
+    first boundary up to, but not including, the last)
+    """
+    if cycle_boundaries is None:
+        raise ValueError('Billing cycle boundaries are required for frequency "cycle"')
+    start, end = index.searchsorted(pd.DatetimeIndex([cycle_boundaries[0], cycle_boundaries[-1]]))
+    return slice(start, end)
+
+
+def period_segments(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption,
+        cycle_boundaries: List[datetime] = None
+) -> Tuple[np.ndarray, pd.Index]:
+    """ Start positions of each contiguous period in a sorted datetime index,
+    along with the period labels (named by the period cascade, as per groupby_freq_stats)
+
+    For frequency "cycle" the periods are given by cycle_boundaries, and the
+    index must lie within the first and last boundaries
+    """
+    if frequency == 'cycle':
+        return cycle_segments(index, cycle_boundaries)
+    period_cascade = period_cascades_map[frequency]
+    # Detect period changes on integer keys, only building labels for period starts
+    keys = [
+        index.normalize().asi8 if period == 'date' else period_attribute(index, period)
+        for period in period_cascade
+    ]
+    starts = kernels.segment_starts(np.vstack(keys)) if len(index) else np.array([], dtype=np.intp)
+    start_index = index[starts]
+    if len(period_cascade) == 1:
+        labels = pd.Index(period_attribute(start_index, period_cascade[0]), name=period_cascade[0])
+    else:
+        labels = pd.MultiIndex.from_arrays(
+            [period_attribute(start_index, period) for period in period_cascade],
+            names=period_cascade
+        )
+    return starts, labels
+
+
+def period_keys(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption
+) -> np.ndarray:
+    """ Integer key of the period (as per period_segments) of each index
+    position, which increases with the period start, so that the rows of a
+    period can be grouped without the index being sorted or contiguous
+    """
+    if frequency == 'cycle':
+        raise ValueError('Billing cycle periods are per meter, so have no calendar key')
+    keys = np.zeros(len(index), dtype=np.int64)
+    for period in period_cascades_map[frequency]:
+        if period == 'date':
+            attribute = index.normalize().asi8 // DAY_NANOSECONDS
+        elif period == 'week':
+            # Week of the month (ISO weeks start on Monday), which unlike the
+            # ISO week number increases through January
+            day = np.asarray(index.day)
+            first_weekday = (np.asarray(index.dayofweek) - (day - 1)) % 7
+            attribute = (day - 1 + first_weekday) // 7
+        else:
+            attribute = period_attribute(index, period)
+        # Lower cascade levels (months, weeks, quarters) are all below 1000
+        keys = keys * 1000 + attribute
+    return keys
+
+
+def calendar_period_bounds(
+        timestamps: pd.DatetimeIndex,
+        frequency: FrequencyOption
+) -> Tuple[pd.DatetimeIndex, pd.DatetimeIndex]:
+    """ period_bounds of each timestamp, as start and end indexes
+    """
+    bounds = [period_bounds(timestamp, frequency) for timestamp in timestamps]
+    return pd.DatetimeIndex([bound[0] for bound in bounds]), pd.DatetimeIndex([bound[1] for bound in bounds])
+
+
+def coverage_weights(
+        period_starts: pd.DatetimeIndex,
+        period_ends: pd.DatetimeIndex,
+        counts: np.ndarray,
+        sample_rate: Union[timedelta, SampleRate],
+        within_window: Union[DateWindow, DatetimeWindow] = None,
+) -> np.ndarray:
+    """ Fraction of each period covered by data, given the number of
+    (non-missing) samples in each, with periods bounded by within_window if given
+    """
+    if within_window:
+        window_start, window_end = window_bounds(within_window, sample_rate)
+        period_starts = period_starts.where(period_starts > window_start, window_start)
+        period_ends = period_ends.where(period_ends < window_end, window_end)
+    expected = (period_ends - period_starts) / pd.Timedelta(sample_rate)
+    return np.minimum(np.asarray(counts, dtype=float) / np.asarray(expected, dtype=float), 1.0)
+
+
+def period_bounds(
+        timestamp: pd.Timestamp,
+        frequency: FrequencyOption
+) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """ Start (inclusive) and end (exclusive) of the calendar period containing
+    timestamp. As per period_cascades_map, weeks are bounded by their month.
+    Bounds are local midnights, so days spanning a daylight saving change of
+    a timezone aware timestamp are 23 or 25 hours long
+    """
+    day = timestamp.normalize()
+    month_start = day.replace(day=1)
+    if frequency == 'day':
+        return day, day + pd.DateOffset(days=1)
+    if frequency == 'week':
+        week_start = day - pd.DateOffset(days=day.weekday())
+        return (
+            max(week_start, month_start),
+            min(week_start + pd.DateOffset(weeks=1), month_start + pd.DateOffset(months=1))
+        )
+    if frequency == 'month':
+        return month_start, month_start + pd.DateOffset(months=1)
+    if frequency == 'quarter':
+        quarter_start = month_start.replace(month=3 * ((month_start.month - 1) // 3) + 1)
+        return quarter_start, quarter_start + pd.DateOffset(months=3)
+    if frequency == 'year':
+        year_start = month_start.replace(month=1)
+        return year_start, year_start + pd.DateOffset(years=1)
+    raise ValueError(f'No calendar period bounds for frequency "{frequency}"')
+
+
+def calendar_periods(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption
+) -> pd.PeriodIndex:
+    """ Calendar period of each timestamp, as binned by
+    resample(resample_schema[frequency]) (weeks ending on Sunday)
+    """
+    if frequency not in resample_schema:
+        raise ValueError(
+            f'No calendar periods for frequency "{frequency}", expected one of {list(resample_schema)}'
+        )
+    if index.tz is not None:
+        # Sub-daily periods are elapsed time (as resampled), longer ones local dates
+        index = index.tz_convert(None) if frequency in ('second', 'minute', 'hour') else index.tz_localize(None)
+    return index.to_period(resample_schema[frequency])
+
+
+def spanned_periods(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption
+) -> pd.PeriodIndex:
+    """ Every calendar period (see calendar_periods) from the first to the
+    last timestamp of a sorted index, including periods without data, i.e.
+    the bins of resample
+    """
+    ends = calendar_periods(index[[0, -1]] if len(index) else index, frequency)
+    if not len(ends):
+        return ends
+    return pd.period_range(ends[0], ends[-1], freq=ends.freq)
+
+
+def spanned_period_bounds(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption
+) -> pd.DataFrame:
+    """ Start (inclusive) and end (exclusive) of each of the spanned_periods
+    of an index, in the index's timezone
+    """
+    periods = spanned_periods(index, frequency)
+    bounds = pd.DataFrame({'start': periods.start_time, 'end': (periods + 1).start_time}, index=periods)
+    if index.tz is not None:
+        for column in bounds:
+            if frequency in ('second', 'minute', 'hour'):
+                bounds[column] = bounds[column].dt.tz_localize('UTC').dt.tz_convert(index.tz)
+            else:
+                bounds[column] = bounds[column].dt.tz_localize(index.tz, nonexistent='shift_forward')
+    return bounds
+
+
+def window_bounds(
+        window: Union[DateWindow, DatetimeWindow],
+        sample_rate: Union[timedelta, SampleRate]
+) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """ Start (inclusive) and end (exclusive) of the data selected by a
+    window. DateWindows include the whole of their end date
+    """
+    if isinstance(window, DateWindow):
+        return pd.Timestamp(window.start), pd.Timestamp(window.end) + pd.Timedelta(days=1)
+    return pd.Timestamp(window.start), pd.Timestamp(window.end) + pd.Timedelta(sample_rate)
+
+
+def time_of_day(index: pd.DatetimeIndex) -> np.ndarray:
+    """ Nanoseconds since (local) midnight of each index position
+    """
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.asi8 % DAY_NANOSECONDS
+
+
+def _nanoseconds(t: time) -> int:
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 10 ** 9 + t.microsecond * 10 ** 3
+
+
+def time_window_mask(
+        index: pd.DatetimeIndex,
+        window: TimeWindow,
+        times_of_day: np.ndarray = None,
+) -> np.ndarray:
+    """ Boolean mask of index positions within a time of day window
+    (start inclusive, end exclusive). Windows starting after they end
+    cross midnight, e.g. 22:00 - 06:00, as per DatetimeIndex.between_time
+    """
+    if times_of_day is None:
+        times_of_day = time_of_day(index)
+    start, end = _nanoseconds(window.start), _nanoseconds(window.end)
+    if start <= end:
+        return (times_of_day >= start) & (times_of_day < end)
+    return (times_of_day >= start) | (times_of_day < end)
+
+
+class IndexCache:
+    """ Arrays derived from a datetime index (a meter grid), i.e. time of
+    day window masks and period segments, computed once per index and
+    shared, e.g. by the several demand tariffs (each with its own peak
+    window) of a regime applied to the same meter
+
+    The arrays of up to max_cached_grids indexes are held. Indexes are
+    matched by value, so copies of an index share its arrays. Returned
+    arrays are read only. The cache may be used from several threads:
+    lookups and evictions are locked, while arrays are computed outside
+    the lock (so a missing array may be computed by more than one thread,
+    but the first stored is returned to all)
+    """
+    max_cached_grids = 16
+
+    def __init__(self):
+        self._grids: Dict[tuple, Tuple[pd.DatetimeIndex, dict]] = {}
+        self._lock = threading.Lock()
+
+    def _arrays(self, index: pd.DatetimeIndex) -> dict:
+        # Called with the lock held
+        key = (len(index), index[0], index[-1], str(index.tz)) if len(index) else (0,)
+        cached = self._grids.get(key)
+        if cached is None or not (cached[0] is index or cached[0].equals(index)):
+            if key not in self._grids and len(self._grids) >= self.max_cached_grids:
+                self._grids.pop(next(iter(self._grids)))
+            cached = (index, {})
+            self._grids[key] = cached
+        return cached[1]
+
+    def _memo(self, index: pd.DatetimeIndex, key: tuple, func):
+        with self._lock:
+            arrays = self._arrays(index)
+            if key in arrays:
+                return arrays[key]
+        value = func()
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        with self._lock:
+            return self._arrays(index).setdefault(key, value)
+
+    def time_of_day(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return self._memo(index, ('time_of_day',), lambda: time_of_day(index))
+
+    def time_window_mask(self, index: pd.DatetimeIndex, window: TimeWindow) -> np.ndarray:
+        return self._memo(
+            index,
+            ('time_window_mask', _window_key(window)),
+            lambda: time_window_mask(index, window, self.time_of_day(index))
+        )
+
+    def period_segments(
+            self,
+            index: pd.DatetimeIndex,
+            frequency: FrequencyOption,
+            cycle_boundaries: List[datetime] = None
+    ) -> Tuple[np.ndarray, pd.Index]:
+        cycles_key = tuple(cycle_boundaries) if frequency == 'cycle' and cycle_boundaries is not None else None
+        return self._memo(
+            index,
+            ('period_segments', frequency, cycles_key),
+            lambda: period_segments(index, frequency, cycle_boundaries)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+
+
+# Shared by all meters, see MeterData.segments
+index_cache = IndexCache()
+
+
+def window_samples(
+        window: Union[timedelta, SampleRate],
+        sample_rate: Union[timedelta, SampleRate]
+) -> int:
+    samples = window / sample_rate
+    if samples < 1 or samples != int(samples):
+        raise ValueError(
+            f'Window of {window} must be a whole multiple of the sample rate ({sample_rate})'
+        )
+    return int(samples)
+
+
+def rolling_period_peaks_array(
+        values: np.ndarray,
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption,
+        window: int,
+        within_times: TimeWindow = None,
+        cycle_boundaries: List[datetime] = None
+) -> Tuple[np.ndarray, pd.MultiIndex]:
+    """ Peak trailing-window average per period along the last axis of
+    values (1D for a single meter or 2D for meters x intervals sharing index).
+    Windows are attributed to the period and time of their final sample
+    """
+    rolled = kernels.rolling_mean(values, window)
+    if within_times:
+        rolled[..., ~index_cache.time_window_mask(index, within_times)] = np.nan
+    if frequency == 'cycle':
+        # Windows ending in a cycle may start before it
+        columns = cycle_columns(index, cycle_boundaries)
+        rolled, index = rolled[..., columns], index[columns]
+    starts, labels = index_cache.period_segments(index, frequency, cycle_boundaries)
+    return kernels.segment_max(rolled, starts), labels
+
+
+def peak_period_segments(
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption,
+        peak_frequency: FrequencyOption,
+        cycle_boundaries: List[datetime] = None
+) -> Tuple[slice, np.ndarray, np.ndarray, pd.Index]:
+    """ Positions of index within the periods (all, unless billing cycles),
+    the start of each peak_frequency period within them, and the start
+    (among the peak periods) and label of each period. Peak periods belong
+    to the period of their first sample, or are split by cycle boundaries
+    """
+    if frequency == 'cycle':
+        columns = cycle_columns(index, cycle_boundaries)
+        index = index[columns]
+        peak_starts, _ = index_cache.period_segments(index, peak_frequency)
+        cycle_starts, labels = index_cache.period_segments(index, frequency, cycle_boundaries)
+        peak_starts = np.union1d(peak_starts, cycle_starts)
+        return columns, peak_starts, np.searchsorted(peak_starts, cycle_starts), labels
+    peak_starts, _ = index_cache.period_segments(index, peak_frequency)
+    starts, labels = period_segments(index[peak_starts], frequency)
+    return slice(0, len(index)), peak_starts, starts, labels
+
+
+def top_n_period_peaks_array(
+        values: np.ndarray,
+        index: pd.DatetimeIndex,
+        frequency: FrequencyOption,
+        n: int,
+        peak_frequency: FrequencyOption = 'day',
+        within_times: TimeWindow = None,
+        cycle_boundaries: List[datetime] = None
+) -> Tuple[np.ndarray, pd.MultiIndex]:
+    """ Mean of the n highest peak_frequency (e.g. daily) peaks in each
+    period along the last axis of values (1D or 2D meters x intervals)
+    """
+    values = np.array(values, dtype=float)
+    if within_times:
+        values[..., ~index_cache.time_window_mask(index, within_times)] = np.nan
+    columns, peak_starts, starts, labels = peak_period_segments(index, frequency, peak_frequency, cycle_boundaries)
+    peaks = kernels.segment_max(values[..., columns], peak_starts)
+    return kernels.segment_top_n_mean(peaks, starts, n), labels
+
+
+@dataclass
+class EventCalendar:
+    """ Event windows (e.g. critical peak events published by one or more
+    networks) converted once to integer sample position ranges per meter
+    time grid, so that the maxima of any of its windows for any number of
+    meters can be found in one batched reduction
+
+    Identical windows are stored once. Positions are cached per time grid,
+    so meters sharing an index (or the same index object) reuse them
+    """
+    windows: List[DatetimeWindow]
+    _window_ids: Dict[tuple, int] = field(init=False, repr=False, compare=False)
+    _grid_positions: Dict[tuple, tuple] = field(init=False, repr=False, compare=False)
+    max_cached_grids = 16
+
+    def __post_init__(self):
+        unique = {}
+        for window in self.windows:
+            unique.setdefault(window.as_tuple, window)
+        self.windows = list(unique.values())
+        self._window_ids = {key: j for j, key in enumerate(unique)}
+        self._grid_positions = {}
+        # Guards _grid_positions, as tariffs may be applied from several threads
+        self._lock = threading.Lock()
+        self._starts = pd.DatetimeIndex([window.start for window in self.windows])
+        self._ends = pd.DatetimeIndex([window.end for window in self.windows])
+
+    def __getstate__(self):
+        # Positions cached for grids are not pickled (e.g. with a regime), nor is the lock
+        state = {**self.__dict__, '_grid_positions': {}}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared_by(cls, tariffs: Iterable) -> EventCalendar:
+        """ Single calendar holding the windows of all the given critical
+        peak tariffs, which is also set as each tariff's event_calendar
+        """
+        tariffs = list(tariffs)
+        calendar = cls([window for tariff in tariffs for window in tariff.critical_peak_windows])
+        for tariff in tariffs:
+            tariff.event_calendar = calendar
+        return calendar
+
+    def window_ids(self, windows: Iterable[DatetimeWindow]) -> np.ndarray:
+        """ Calendar column of each window (windows must be in the calendar)
+        """
+        return np.array([self._window_ids[window.as_tuple] for window in windows], dtype=np.intp)
+
+    def positions(self, index: pd.DatetimeIndex) -> Tuple[np.ndarray, np.ndarray]:
+        """ Start and stop (exclusive) sample positions of each window
+        in index. Window ends are inclusive, as per MeterData.max_between
+        """
+        key = (len(index), index[0], index[-1]) if len(index) else (0,)
+        with self._lock:
+            cached = self._grid_positions.get(key)
+        if cached is not None and (cached[0] is index or cached[0].equals(index)):
+            return cached[1], cached[2]
+        starts = index.searchsorted(self._starts, side='left')
+        stops = index.searchsorted(self._ends, side='right')
+        with self._lock:
+            if key not in self._grid_positions and len(self._grid_positions) >= self.max_cached_grids:
+                self._grid_positions.pop(next(iter(self._grid_positions)))
+            self._grid_positions[key] = (index, starts, stops)
+        return starts, stops
+
+    def window_maxima(
+            self,
+            values: np.ndarray,
+            index: pd.DatetimeIndex,
+            windows: Iterable[DatetimeWindow] = None
+    ) -> np.ndarray:
+        """ Max of values within each of the given windows (default all of
+        the calendar's), shaped (..., windows) for values of a single meter
+        (1D) or meters x intervals (2D). Only the given windows are reduced,
+        so tariffs sharing a calendar each reduce their own windows
+        """
+        starts, stops = self.positions(index)
+        if windows is not None:
+            ids = self.window_ids(windows)
+            starts, stops = starts[ids], stops[ids]
+        return kernels.window_max(values, starts, stops)
+
+
+@dataclass
+class TimeGrid:
+    """ Calendar of a time index shared by many meters or scenarios (e.g.
+    synthetic consumption traces), so that period segments, time of day
+    masks and other index derived arrays are computed once and reused for
+    every row of a meters x intervals array
+
+    Segments are found via a MeterData of sample positions on the index,
+    so windows, times of day and billing cycles select intervals exactly as
+    they do for MeterData. Period weights (see MeterData.period_weights)
+    reflect the grid's coverage, i.e. the values on it are assumed complete
+    """
+    index: pd.DatetimeIndex
+    sample_rate: Union[timedelta, SampleRate]
+    billing_cycles: List[datetime] = None
+    _cache: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._cache = {}
+        self._positions = MeterData(
+            'grid',
+            pd.Series(np.arange(len(self.index)), index=self.index),
+            self.sample_rate,
+            'position',
+            self.billing_cycles
+        )
+
+    def __len__(self):
+        return len(self.index)
+
+    def memo(self, key: tuple, func):
+        """ Value of func() computed once per grid and (hashable) key
+        """
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def hours(self) -> np.ndarray:
+        return self.memo(('hours',), lambda: self.index.hour.values)
+
+    def segments(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+            within_times: TimeWindow = None,
+    ) -> Tuple[Union[slice, np.ndarray], np.ndarray, pd.Index]:
+        """ Columns (intervals) selected by the window and/or times of day,
+        with the start position (within the selection) and label of each period
+        """
+        def build():
+            ts, starts, labels = self._positions.segments(frequency, within_window, within_times)
+            columns = ts.to_numpy()
+            if len(columns) and columns[-1] - columns[0] == len(columns) - 1:
+                columns = slice(columns[0], columns[-1] + 1)
+            return columns, starts, labels
+        return self.memo(('segments', frequency, _window_key(within_window), _window_key(within_times)), build)
+
+    def time_window_mask(self, window: TimeWindow) -> np.ndarray:
+        return self.memo(('time_window_mask', _window_key(window)), lambda: index_cache.time_window_mask(self.index, window))
+
+    def period_weights(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+    ) -> pd.Series:
+        return self.memo(
+            ('period_weights', frequency, _window_key(within_window)),
+            lambda: self._positions.period_weights(frequency, within_window)
+        )
+
+
+def _window_key(window) -> Optional[tuple]:
+    return None if window is None else (type(window).__name__,) + window.as_tuple
+
 
 class Validator:
     @staticmethod
@@ -25,6 +598,7 @@ class MeterData:
     tseries: pd.Series
     sample_rate: Union[timedelta, SampleRate]
     units: str
+    billing_cycles: List[datetime] = None
 
     """ Representation of data from an interval metering device, i.e. a
     meter that records data at regular time intervals
@@ -32,6 +606,11 @@ class MeterData:
     Common examples:
         - electricity smart meter with consumption at 30 minute intervals
         - gas meter with daily consumption data
+
+    billing_cycles optionally holds the boundaries of the meter's billing
+    (meter read) cycles, e.g. [14 March, 12 April, 13 May], which are used
+    by tariffs applied at frequency "cycle". Each cycle runs from one
+    boundary up to (not including) the next
     """
 
     def first_datetime(self) -> datetime:
@@ -117,6 +696,15 @@ class MeterData:
                             f'The window param must be a DateWindow or DatetimeWindow')
         return window_covered
 
+    def cycles_slice(self, ts: pd.Series = None) -> pd.Series:
+        """ Data within the billing cycles (from the first boundary up to,
+        but not including, the last)
+        """
+        ts = self.tseries if ts is None else ts
+        if self.billing_cycles is None:
+            raise ValueError(f'MeterData {self.name} has no billing_cycles')
+        return ts.iloc[cycle_columns(ts.index, self.billing_cycles)]
+
     def window_slice(
             self,
             window: Union[DateWindow, DatetimeWindow]
@@ -146,6 +734,65 @@ class MeterData:
             new_meter.units = 'kW'
             return new_meter
 
+    def segments(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+            within_times: TimeWindow = None,
+    ) -> Tuple[pd.Series, np.ndarray, pd.Index]:
+        """ Data constrained to a window and/or times of day, along with the
+        start position and label of each period within it
+        """
+        if within_window:
+            ts = self.window_slice(within_window)
+        else:
+            ts = self.tseries
+        if within_times:
+            ts = ts[index_cache.time_window_mask(ts.index, within_times)]
+        if frequency == 'cycle':
+            ts = self.cycles_slice(ts)
+        starts, labels = index_cache.period_segments(ts.index, frequency, self.billing_cycles)
+        return ts, starts, labels
+
+    def period_weights(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+    ) -> pd.Series:
+        """ Fraction of each period covered by (non-missing) data, from the
+        sample count per period relative to the samples in the full period.
+        Periods are bounded by within_window if given (e.g. a tariff's active window)
+        """
+        ts, starts, labels = self.segments(frequency, within_window)
+        counts = kernels.segment_count(ts.to_numpy(dtype=float), starts)
+        if frequency == 'cycle':
+            period_starts = labels.get_level_values('cycle_start')
+            period_ends = labels.get_level_values('cycle_end')
+        else:
+            period_starts, period_ends = calendar_period_bounds(ts.index[starts], frequency)
+        weights = coverage_weights(period_starts, period_ends, counts, self.sample_rate, within_window)
+        return pd.Series(weights, index=labels, name='weight')
+
+    def period_bounds(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+    ) -> pd.DataFrame:
+        """ Start (inclusive) and end (exclusive) of each period with data,
+        bounded by within_window if given
+        """
+        ts, starts, labels = self.segments(frequency, within_window)
+        if frequency == 'cycle':
+            period_starts = pd.DatetimeIndex(labels.get_level_values('cycle_start'))
+            period_ends = pd.DatetimeIndex(labels.get_level_values('cycle_end'))
+        else:
+            period_starts, period_ends = calendar_period_bounds(ts.index[starts], frequency)
+        if within_window:
+            window_start, window_end = window_bounds(within_window, self.sample_rate)
+            period_starts = period_starts.where(period_starts > window_start, window_start)
+            period_ends = period_ends.where(period_ends < window_end, window_end)
+        return pd.DataFrame({'start': period_starts, 'end': period_ends}, index=labels)
+
     def groupby_freq_stats(
             self,
             frequency: FrequencyOption,
@@ -161,15 +808,38 @@ class MeterData:
         """
         if isinstance(stats, str):
             stats = [stats]
-        if within_window:
-            ts = self.window_slice(within_window)
-        else:
-            ts = self.tseries
-        if within_times:
-            ts = ts.between_time(within_times.start, within_times.end, inclusive='left')
-        period_cascade = period_cascades_map[frequency]
-        period_bins = list([getattr(ts.index, period) for period in period_cascade])
-        return ts.groupby(period_bins).agg(stats).rename_axis(period_cascade)
+        if within_times and all(stat in kernels.segment_reducers for stat in stats):
+            return self._masked_freq_stats(frequency, within_window, within_times, stats)
+        with profiling.stage('groupby_segments'):
+            ts, starts, labels = self.segments(frequency, within_window, within_times)
+        with profiling.stage('groupby_reduce'):
+            if not all(stat in kernels.segment_reducers for stat in stats):
+                return ts.groupby(kernels.segment_ids(starts, len(ts))).agg(stats).set_axis(labels)
+            values = ts.to_numpy(dtype=float)
+            reduced = {stat: kernels.segment_reducers[stat](values, starts) for stat in stats}
+        with profiling.stage('groupby_dataframe'):
+            return pd.DataFrame(reduced, index=labels)
+
+    def _masked_freq_stats(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow],
+            within_times: TimeWindow,
+            stats: List[str]
+    ) -> pd.DataFrame:
+        """ groupby_freq_stats within times of day, reducing the segments of
+        the unfiltered data under the (cached) time window mask rather than
+        segmenting a filtered copy. Periods without samples in the window
+        are dropped, as they are when filtering
+        """
+        with profiling.stage('groupby_segments'):
+            ts, starts, labels = self.segments(frequency, within_window)
+            mask = index_cache.time_window_mask(ts.index, within_times)
+        with profiling.stage('groupby_reduce'):
+            reduced = kernels.masked_segment_stats(ts.to_numpy(dtype=float), mask, starts, stats)
+            selected = np.add.reduceat(mask, starts) > 0 if len(starts) else np.zeros(0, dtype=bool)
+        with profiling.stage('groupby_dataframe'):
+            return pd.DataFrame({stat: values[selected] for stat, values in reduced.items()}, index=labels[selected])
 
     def year_peaks(self) -> pd.Series:
         return self.groupby_freq_stats(frequency='year', stats='max')
@@ -209,9 +879,100 @@ class MeterData:
             'sum'
         )
 
+    def rolling_period_peaks(
+            self,
+            frequency: FrequencyOption,
+            window: Union[timedelta, SampleRate],
+            within_times: TimeWindow = None
+    ) -> pd.Series:
+        """ Maximum rolling average over a window (e.g. 30 minutes)
+        for each period
+        """
+        peaks, labels = rolling_period_peaks_array(
+            self.to_numpy(),
+            self.tseries.index,
+            frequency,
+            window_samples(window, self.sample_rate),
+            within_times,
+            self.billing_cycles
+        )
+        return pd.Series(peaks, index=labels, name='max')
+
+    def top_n_period_peaks(
+            self,
+            frequency: FrequencyOption,
+            n: int,
+            peak_frequency: FrequencyOption = 'day',
+            within_times: TimeWindow = None
+    ) -> pd.Series:
+        """ Average of the n highest peak_frequency peaks for each period
+        (e.g. mean of the 4 highest daily peaks in each month)
+        """
+        peaks, labels = top_n_period_peaks_array(
+            self.to_numpy(),
+            self.tseries.index,
+            frequency,
+            n,
+            peak_frequency,
+            within_times,
+            self.billing_cycles
+        )
+        return pd.Series(peaks, index=labels, name='mean_top_peaks')
+
     def to_numpy(self):
         return self.tseries.to_numpy(dtype=float)
 
+    def hours(self) -> np.ndarray:
+        """ Hour of day of each sample
+        """
+        return self.tseries.index.hour.values
+
+    def aligned_to(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """ Values aligned to another index. Where index is a contiguous
+        run of this meter's index the values are returned as a view by
+        integer position (no copy), otherwise each position takes the last
+        value at or before it (merge-asof)
+        """
+        values = self.to_numpy()
+        own_index = self.tseries.index
+        if len(index) and len(own_index):
+            offset = own_index.searchsorted(index[0])
+            stop = offset + len(index)
+            if stop <= len(own_index) and own_index[offset:stop].equals(index):
+                return values[offset:stop]
+        merged = pd.merge_asof(
+            pd.DataFrame({'datetime': index}),
+            pd.DataFrame({'datetime': own_index, 'value': values}),
+            on='datetime',
+            direction='backward'
+        )
+        return merged['value'].to_numpy(dtype=float)
+
+    @classmethod
+    def from_import_export(
+            cls,
+            name: str,
+            import_meter: MeterData,
+            export_meter: MeterData,
+    ) -> MeterData:
+        """ Signed meter data from a pair of non-negative import and export
+        channels (import positive, export negative)
+        """
+        if import_meter.units != export_meter.units:
+            raise ValueError(
+                f'Import and export meters must share units, '
+                f'got {import_meter.units} and {export_meter.units}'
+            )
+        if import_meter.sample_rate != export_meter.sample_rate:
+            raise ValueError('Import and export meters must share a sample rate')
+        return cls(
+            name,
+            import_meter.tseries.sub(export_meter.tseries, fill_value=0.0),
+            import_meter.sample_rate,
+            import_meter.units,
+            import_meter.billing_cycles
+        )
+
     def copy(self, deep=True):
         if deep:
             return deepcopy(self)
@@ -219,6 +980,100 @@ class MeterData:
             return copy(self)
 
 
+@dataclass
+class MemoMeterData(MeterData):
+    """ MeterData whose period segments, groupby statistics and period
+    weights are computed once per set of arguments and then reused, e.g.
+    while many tariffs with the same frequency and windows are applied to it
+
+    The data must not be modified once wrapped. Memoised DataFrames and
+    Series are returned as copies, as tariffs add columns to them. Tariffs
+    may be applied from several threads at once, in which case each value
+    is still computed only once (other threads wait for it)
+    """
+    _memo: dict = field(default=None, init=False, repr=False, compare=False)
+    _locks: dict = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._memo = {}
+        self._locks = {}
+        # Guards _locks, which hold one lock per memoised key
+        self._lock = threading.Lock()
+
+    @classmethod
+    def wrap(cls, meter: MeterData) -> MemoMeterData:
+        if isinstance(meter, MemoMeterData):
+            return meter
+        return cls(meter.name, meter.tseries, meter.sample_rate, meter.units, meter.billing_cycles)
+
+    def _memoised(self, key: tuple, func):
+        if key not in self._memo:
+            with self._lock:
+                key_lock = self._locks.setdefault(key, threading.Lock())
+            # Values of other keys may be computed meanwhile
+            with key_lock:
+                if key not in self._memo:
+                    self._memo[key] = func()
+        return self._memo[key]
+
+    def hours(self) -> np.ndarray:
+        return self._memoised(('hours',), super().hours)
+
+    def copy(self, deep=True):
+        # A fresh memo (locks cannot be copied)
+        return type(self)(
+            self.name,
+            self.tseries.copy(deep=deep),
+            self.sample_rate,
+            self.units,
+            deepcopy(self.billing_cycles) if deep else self.billing_cycles
+        )
+
+    def segments(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+            within_times: TimeWindow = None,
+    ) -> Tuple[pd.Series, np.ndarray, pd.Index]:
+        return self._memoised(
+            ('segments', frequency, _window_key(within_window), _window_key(within_times)),
+            lambda: super(MemoMeterData, self).segments(frequency, within_window, within_times)
+        )
+
+    def period_weights(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+    ) -> pd.Series:
+        return self._memoised(
+            ('period_weights', frequency, _window_key(within_window)),
+            lambda: super(MemoMeterData, self).period_weights(frequency, within_window)
+        ).copy()
+
+    def period_bounds(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+    ) -> pd.DataFrame:
+        return self._memoised(
+            ('period_bounds', frequency, _window_key(within_window)),
+            lambda: super(MemoMeterData, self).period_bounds(frequency, within_window)
+        ).copy()
+
+    def groupby_freq_stats(
+            self,
+            frequency: FrequencyOption,
+            within_window: Union[DateWindow, DatetimeWindow] = None,
+            within_times: TimeWindow = None,
+            stats: Union[str, List[str]] = 'max'
+    ):
+        stats_key = (stats,) if isinstance(stats, str) else tuple(stats)
+        return self._memoised(
+            ('groupby_freq_stats', frequency, _window_key(within_window), _window_key(within_times), stats_key),
+            lambda: super(MemoMeterData, self).groupby_freq_stats(frequency, within_window, within_times, stats)
+        ).copy()
+
+
 @dataclass
 class Meters(EnforcedDict):
     def __init__(
@@ -236,4 +1091,25 @@ class Meters(EnforcedDict):
         return {meter.units: meter for meter in self.values()}
 
     def append(self, meter: MeterData):
-        self[meter.name] = meter
\ No newline at end of file
+        self[meter.name] = meter
+
+    def set_billing_cycles(self, cycle_boundaries: List[datetime]):
+        """ Set the same billing cycle boundaries on every meter
+        (i.e. all channels of one customer)
+        """
+        for meter in self.values():
+            meter.billing_cycles = cycle_boundaries
+
+    def net_meter(
+            self,
+            import_name: str,
+            export_name: str,
+            name: str = None
+    ) -> MeterData:
+        """ Signed meter data built from an import and export meter pair
+        """
+        return MeterData.from_import_export(
+            name or f'{import_name}_net_{export_name}',
+            self[import_name],
+            self[export_name]
+        )
\ No newline at end of file
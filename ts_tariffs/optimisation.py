@@ -0,0 +1,187 @@
+""" Bill evaluation helpers for schedule optimisation (e.g. battery dispatch
+or demand response)
+
+ScheduleEvaluator holds a single meter's consumption schedule on a TimeGrid
+and provides the marginal cost of consumption in each interval (from each
+tariff's analytic marginal_costs), plus fast re-evaluation of perturbed
+schedules. Perturbations only re-bill the periods they touch for tariffs
+whose charge is a sum of independent per period charges, and re-bill the
+whole schedule (without building DataFrames) for the others.
+
+Example:
+    evaluator = ScheduleEvaluator(regime, schedule, TimeGrid(index, timedelta(minutes=30)), units='kWh')
+    gradient = evaluator.marginal_costs()
+    candidate_total = evaluator.perturbed_total([100, 101], [0.0, 0.0])
+    evaluator.update([100, 101], [0.0, 0.0])
+"""
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from ts_tariffs.billing import TariffRegime
+from ts_tariffs.meters import TimeGrid
+from ts_tariffs.tariffs import (
+    Tariff,
+    SingleRateTariff,
+    TouTariff,
+    SpotPriceTariff,
+    NetMeteringTariff,
+    DemandTariff,
+    BlockTariff,
+    TopNDemandTariff,
+    ConnectionTariff,
+    CapacityTariff,
+)
+from ts_tariffs.ts_utils import FrequencyOption
+
+
+def separable_frequency(tariff: Tariff) -> Optional[FrequencyOption]:
+    """ Frequency of the periods that a tariff's total is a sum of
+    independent charges over, or None if periods interact (e.g. ratchets,
+    rolling windows spanning period boundaries or critical peak windows)
+    """
+    if isinstance(tariff, (SingleRateTariff, TouTariff, SpotPriceTariff)):
+        return 'day'
+    if isinstance(tariff, NetMeteringTariff):
+        return tariff.netting_frequency or 'day'
+    if isinstance(tariff, (DemandTariff, BlockTariff, TopNDemandTariff)):
+        return tariff.frequency_applied
+    return None
+
+
+class _Component:
+    """ A tariff's current total, and if separable, its per period totals
+    """
+    def __init__(self, tariff: Tariff, values: np.ndarray, grid: TimeGrid):
+        self.tariff = tariff
+        self.constant = isinstance(tariff, (ConnectionTariff, CapacityTariff))
+        self.frequency = None if self.constant else separable_frequency(tariff)
+        self._subgrids = {}
+        if self.frequency is None:
+            self.total = float(tariff.batch_totals(values, grid))
+            return
+        columns, starts, _ = grid.segments(self.frequency)
+        # A slice, or an array of positions if the selection is empty or not contiguous
+        columns = np.arange(len(grid))[columns]
+        if len(columns) and columns[-1] - columns[0] != len(columns) - 1:
+            raise ValueError(f'{tariff.name}: periods must cover contiguous intervals of the grid')
+        self.part_starts = columns[starts]
+        self.part_stops = np.append(self.part_starts[1:], columns[-1] + 1) if len(columns) else self.part_starts
+        self.grid = grid
+        self.part_totals = np.array([
+            self.part_total(k, values[a:b]) for k, (a, b) in enumerate(zip(self.part_starts, self.part_stops))
+        ])
+        self.total = float(np.nansum(self.part_totals))
+
+    def part_total(self, k: int, values: np.ndarray) -> float:
+        if k not in self._subgrids:
+            a, b = self.part_starts[k], self.part_stops[k]
+            self._subgrids[k] = TimeGrid(self.grid.index[a:b], self.grid.sample_rate, self.grid.billing_cycles)
+        return float(self.tariff.batch_totals(values, self._subgrids[k]))
+
+    def parts_of(self, positions: np.ndarray) -> np.ndarray:
+        parts = np.searchsorted(self.part_starts, positions, side='right') - 1
+        within = (parts >= 0) & (positions < self.part_stops[np.maximum(parts, 0)])
+        return np.unique(parts[within])
+
+
+class ScheduleEvaluator:
+    """ Bill total and marginal costs of one meter's consumption schedule
+    under a TariffRegime, with incremental re-evaluation of perturbations
+
+    All of the regime's tariffs are applied to the schedule (which is in
+    the given units), as for a single meter. Frequency based tariffs (e.g.
+    connection charges) do not depend on the schedule
+    """
+    def __init__(
+            self,
+            regime: TariffRegime,
+            values: np.ndarray,
+            grid: TimeGrid,
+            units: str = None,
+    ):
+        values = np.array(values, dtype=float)
+        if values.shape != (len(grid),):
+            raise ValueError(f'schedule has shape {values.shape}, expected ({len(grid)},)')
+        self.regime = regime
+        self.grid = grid
+        self.units = units
+        self.values = values
+        self._components = [_Component(tariff, values, grid) for tariff in regime.tariffs]
+
+    @property
+    def charge_names(self) -> List[str]:
+        return [component.tariff.name for component in self._components]
+
+    @property
+    def charge_totals(self) -> Dict[str, float]:
+        return {component.tariff.name: component.total for component in self._components}
+
+    @property
+    def total(self) -> float:
+        return sum(component.total for component in self._components)
+
+    def marginal_costs(self) -> np.ndarray:
+        """ Marginal bill cost of consumption in each interval of the current schedule
+        """
+        return sum(tariff.marginal_costs(self.values, self.grid) for tariff in self.regime.tariffs)
+
+    def marginal_costs_by_charge(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {tariff.name: tariff.marginal_costs(self.values, self.grid) for tariff in self.regime.tariffs},
+            index=self.grid.index
+        )
+
+    def evaluate(self, values: np.ndarray) -> Union[float, np.ndarray]:
+        """ Bill total of a complete schedule, or of each row of a candidates
+        x intervals array, leaving the current schedule unchanged
+        """
+        values = np.asarray(values, dtype=float)
+        totals = sum(tariff.batch_totals(values, self.grid) for tariff in self.regime.tariffs)
+        return float(totals) if values.ndim == 1 else totals
+
+    def _perturbed(self, positions: Sequence[int], new_values: Sequence[float]) -> list:
+        """ New total (and part totals, if separable) of each component
+        affected by setting the values at positions
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        new_values = np.broadcast_to(np.asarray(new_values, dtype=float), positions.shape)
+        changes = []
+        full = None
+        for component in self._components:
+            if component.constant:
+                continue
+            if component.frequency is None:
+                if full is None:
+                    full = self.values.copy()
+                    full[positions] = new_values
+                changes.append((component, float(component.tariff.batch_totals(full, self.grid)), None))
+                continue
+            parts = component.parts_of(positions)
+            part_totals = component.part_totals.copy()
+            for k in parts:
+                a, b = component.part_starts[k], component.part_stops[k]
+                segment = self.values[a:b].copy()
+                in_part = (positions >= a) & (positions < b)
+                segment[positions[in_part] - a] = new_values[in_part]
+                part_totals[k] = component.part_total(k, segment)
+            changes.append((component, float(np.nansum(part_totals)), part_totals))
+        return changes
+
+    def perturbed_total(self, positions: Sequence[int], new_values: Sequence[float]) -> float:
+        """ Bill total if the values at positions were set to new_values,
+        leaving the current schedule unchanged
+        """
+        changes = {id(component): total for component, total, _ in self._perturbed(positions, new_values)}
+        return sum(changes.get(id(component), component.total) for component in self._components)
+
+    def update(self, positions: Sequence[int], new_values: Sequence[float]) -> float:
+        """ Set the values at positions to new_values, returning the new bill total
+        """
+        for component, total, part_totals in self._perturbed(positions, new_values):
+            component.total = total
+            if part_totals is not None:
+                component.part_totals = part_totals
+        self.values[np.asarray(positions, dtype=np.intp)] = new_values
+        return self.total
@@ -0,0 +1,508 @@
+""" Out-of-core billing of interval data too large to hold in memory
+
+Interval rows of many meters (meter id, datetime and one column per
+consumption channel, in any order) are read as Arrow record batches and
+reduced to the mergeable aggregates that each tariff's charge depends on,
+e.g. time of use slot sums, period sums and period peaks. Aggregates are
+held per meter and period, not per interval, and when more than max_meters
+distinct meters are held they are spilled to Parquet files (bucketed by a
+hash of the meter id). Bills are then assembled one bucket at a time, so
+memory is bounded by the batch size and max_meters rather than the data.
+
+Example:
+    bills = bill_parquet(
+        regime, 'audit/meter_data/', channels={'energy': 'kWh'},
+        sample_rate=timedelta(minutes=30), max_meters=50_000, spill_dir='/scratch/spill'
+    )
+    table = BillsTable.from_bills(bills)
+
+RollingDemandTariffs need contiguous interval data, and billing cycles
+are per meter, so neither can be billed out of core.
+
+Missing (NaN) values are skipped by the aggregate sums and maxima, as they
+are by the in-memory period reductions of demand, block, net metering and
+other periodic tariffs. In memory, SingleRateTariff, TouTariff and
+SpotPriceTariff totals propagate NaN though, so where those charges are NaN,
+out of core charges are the totals of the non-missing intervals.
+"""
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from ts_tariffs import kernels
+from ts_tariffs.billing import Bill, TariffRegime, frequency_units
+from ts_tariffs.meters import period_keys, calendar_period_bounds, calendar_periods, coverage_weights, \
+    time_window_mask
+from ts_tariffs.tariffs import (
+    Tariff,
+    AppliedCharge,
+    SingleRateTariff,
+    TouTariff,
+    SpotPriceTariff,
+    NetMeteringTariff,
+    ConnectionTariff,
+    CapacityTariff,
+    DemandTariff,
+    RatchetDemandTariff,
+    TopNDemandTariff,
+    BlockTariff,
+    CriticalPeakDemandTariff,
+)
+from ts_tariffs.ts_utils import FrequencyOption, SampleRate
+
+REDUCERS = ('sum', 'max', 'min')
+
+# (aggregate name, reducer, row selection or None for all rows, keys, values)
+Partial = Tuple[str, str, Optional[np.ndarray], np.ndarray, np.ndarray]
+
+
+def _milliseconds(index: pd.DatetimeIndex) -> np.ndarray:
+    # Exactly representable as float64, unlike nanoseconds
+    return (index.asi8 // 10 ** 6).astype(float)
+
+
+def _coverage_partials(
+        index: pd.DatetimeIndex,
+        values: np.ndarray,
+        frequency: FrequencyOption,
+        selection: np.ndarray = None,
+) -> List[Partial]:
+    """ Rows, non-missing samples and first timestamp of each period
+    """
+    if selection is not None:
+        index, values = index[selection], values[selection]
+    keys = period_keys(index, frequency)
+    return [
+        ('rows', 'sum', selection, keys, np.ones(len(keys))),
+        ('count', 'sum', selection, keys, (~np.isnan(values)).astype(float)),
+        ('first', 'min', selection, keys, _milliseconds(index)),
+    ]
+
+
+class Aggregator:
+    """ Mergeable partial aggregates of a tariff's consumption, and the
+    tariff's charge from the final (fully merged) aggregates of one meter
+    """
+    def __init__(self, tariff: Tariff, sample_rate: Union[timedelta, SampleRate]):
+        self.tariff = tariff
+        self.sample_rate = sample_rate
+        # Timezone of the consumed rows' datetimes, set by OutOfCoreBiller.consume
+        self.tz = None
+
+    def partials(self, values: np.ndarray, index: pd.DatetimeIndex) -> List[Partial]:
+        raise NotImplementedError
+
+    def charges(self, aggregates: Dict[str, pd.Series]) -> pd.Series:
+        """ Charge per aggregate key (e.g. per period) given each aggregate
+        as a Series indexed by (sorted) key
+        """
+        raise NotImplementedError
+
+    def applied(self, aggregates: Dict[str, pd.Series]) -> AppliedCharge:
+        charges = self.charges(aggregates).rename('charge')
+        return AppliedCharge(
+            self.tariff.name,
+            charges,
+            self.tariff.rate_unit,
+            self.tariff.consumption_unit,
+            float(charges.sum())
+        )
+
+    def timestamps(self, milliseconds: np.ndarray) -> pd.DatetimeIndex:
+        """ Timestamps of aggregated _milliseconds values, in the timezone of the consumed rows
+        """
+        timestamps = pd.to_datetime(milliseconds, unit='ms', utc=True)
+        return timestamps.tz_localize(None) if self.tz is None else timestamps.tz_convert(self.tz)
+
+    def weights(
+            self,
+            aggregates: Dict[str, pd.Series],
+            frequency: FrequencyOption,
+            within_window=None
+    ) -> pd.Series:
+        """ Period coverage weights (see MeterData.period_weights) from coverage partials
+        """
+        firsts = self.timestamps(aggregates['first'].to_numpy())
+        period_starts, period_ends = calendar_period_bounds(firsts, frequency)
+        return pd.Series(
+            coverage_weights(period_starts, period_ends, aggregates['count'].to_numpy(),
+                             self.sample_rate, within_window),
+            index=aggregates['first'].index
+        )
+
+
+class SingleRateAggregator(Aggregator):
+    def partials(self, values, index):
+        return [('consumption', 'sum', None, np.zeros(len(values), dtype=np.int64), values)]
+
+    def charges(self, aggregates):
+        return aggregates['consumption'] * (self.tariff.adjustment_factor * self.tariff.rate)
+
+
+class TouAggregator(Aggregator):
+    def partials(self, values, index):
+        return [('slot_consumption', 'sum', None, self.tariff.tou.bin_index(index.hour.values), values)]
+
+    def charges(self, aggregates):
+        consumption = aggregates['slot_consumption']
+        rates = np.asarray(self.tariff.tou.bin_rates, dtype=float)[consumption.index.to_numpy()]
+        return consumption * rates
+
+
+class SpotPriceAggregator(Aggregator):
+    def partials(self, values, index):
+        order = np.argsort(index.asi8, kind='stable')
+        sorted_index = index[order]
+        prices = np.empty(len(values))
+        prices[order] = self.tariff.aligned_prices(sorted_index)
+        loss_factors = self.tariff.aligned_loss_factors(sorted_index)
+        if not np.isscalar(loss_factors):
+            sorted_factors = loss_factors
+            loss_factors = np.empty(len(values))
+            loss_factors[order] = sorted_factors
+        adjusted = values * (loss_factors * self.tariff.adjustment_factor)
+        return [('cost', 'sum', None, np.zeros(len(values), dtype=np.int64), adjusted * prices)]
+
+    def charges(self, aggregates):
+        return aggregates['cost']
+
+
+class NetMeteringAggregator(Aggregator):
+    def partials(self, values, index):
+        slots = np.digitize(index.hour.values, bins=self.tariff.slot_edges())
+        if self.tariff.netting_frequency:
+            keys = period_keys(index, self.tariff.netting_frequency) * 100 + slots
+            return [('net', 'sum', None, keys, values)]
+        return [
+            ('import', 'sum', None, slots, np.clip(values, 0.0, None)),
+            ('export', 'sum', None, slots, np.clip(-values, 0.0, None)),
+        ]
+
+    def charges(self, aggregates):
+        edges = self.tariff.slot_edges()
+        slot_hours = np.concatenate([[0], edges]).astype(int) % 24
+        if self.tariff.netting_frequency:
+            net = aggregates['net']
+            imports = np.clip(net, 0.0, None)
+            exports = np.clip(-net, 0.0, None)
+        else:
+            imports = aggregates['import']
+            exports = aggregates['export'].reindex(imports.index.union(aggregates['export'].index), fill_value=0.0)
+            imports = imports.reindex(exports.index, fill_value=0.0)
+        slots = imports.index.to_numpy() % 100
+        import_rates = self.tariff.import_rates(slot_hours)[slots]
+        export_rates = self.tariff.export_rates(slot_hours)[slots]
+        return (imports * import_rates - exports * export_rates) * self.tariff.adjustment_factor
+
+
+class ConnectionAggregator(Aggregator):
+    def partials(self, values, index):
+        if self.tariff.pro_rata:
+            return _coverage_partials(index, values, self.tariff.frequency_applied)
+        # Every calendar period between the meter's first and last is charged
+        ordinals = calendar_periods(index, self.tariff.frequency_applied).asi8.astype(float)
+        keys = np.zeros(len(index), dtype=np.int64)
+        return [('first_period', 'min', None, keys, ordinals), ('last_period', 'max', None, keys, ordinals)]
+
+    def charges(self, aggregates):
+        rate = self.tariff.rate * getattr(self.tariff, 'capacity', 1.0)
+        if self.tariff.pro_rata:
+            return self.weights(aggregates, self.tariff.frequency_applied) * rate
+        first, last = aggregates['first_period'].iloc[0], aggregates['last_period'].iloc[0]
+        return pd.Series(rate, index=pd.RangeIndex(int(first), int(last) + 1, name='period'))
+
+
+class DemandAggregator(Aggregator):
+    def selection(self, index: pd.DatetimeIndex) -> Optional[np.ndarray]:
+        if self.tariff.time_window:
+            return time_window_mask(index, self.tariff.time_window)
+        return None
+
+    def partials(self, values, index):
+        selection = self.selection(index)
+        selected_index = index if selection is None else index[selection]
+        selected = values if selection is None else values[selection]
+        partials = [('peak', 'max', selection, period_keys(selected_index, self.tariff.frequency_applied), selected)]
+        if getattr(self.tariff, 'pro_rata', False):
+            partials += _coverage_partials(index, values, self.tariff.frequency_applied)
+        return partials
+
+    def charges(self, aggregates):
+        charges = aggregates['peak'] * self.tariff.rate
+        if self.tariff.pro_rata:
+            charges *= self.weights(aggregates, self.tariff.frequency_applied).reindex(charges.index).to_numpy()
+        return charges
+
+
+class RatchetDemandAggregator(DemandAggregator):
+    def charges(self, aggregates):
+        peaks = aggregates['peak']
+        billed = np.fmax(peaks.to_numpy(), self.tariff.ratchet_demands(peaks.to_numpy()))
+        return pd.Series(billed * self.tariff.rate, index=peaks.index)
+
+
+class TopNDemandAggregator(DemandAggregator):
+    def partials(self, values, index):
+        selection = self.selection(index)
+        selected_index = index if selection is None else index[selection]
+        selected = values if selection is None else values[selection]
+        return [
+            ('peak', 'max', selection, period_keys(selected_index, self.tariff.peak_frequency), selected),
+            ('peak_first', 'min', None, period_keys(index, self.tariff.peak_frequency), _milliseconds(index)),
+        ]
+
+    def charges(self, aggregates):
+        firsts = aggregates['peak_first']
+        peaks = aggregates['peak'].reindex(firsts.index).to_numpy()
+        periods = period_keys(self.timestamps(firsts.to_numpy()), self.tariff.frequency_applied)
+        starts = kernels.segment_starts(periods)
+        top_n_means = kernels.segment_top_n_mean(peaks, starts, self.tariff.n_peaks)
+        return pd.Series(top_n_means * self.tariff.rate, index=periods[starts])
+
+
+class BlockAggregator(Aggregator):
+    def partials(self, values, index):
+        return [('consumption', 'sum', None, period_keys(index, self.tariff.frequency_applied), values)]
+
+    def charges(self, aggregates):
+        consumption = aggregates['consumption']
+        block_costs = kernels.block_cost(
+            consumption.to_numpy(),
+            [block.min for block in self.tariff.blocks],
+            [block.max for block in self.tariff.blocks],
+            self.tariff.bin_rates
+        ) * self.tariff.adjustment_factor
+        return pd.Series(block_costs.sum(axis=0), index=consumption.index)
+
+
+class CriticalPeakDemandAggregator(Aggregator):
+    def partials(self, values, index):
+        partials = []
+        for j, window in enumerate(self.tariff.critical_peak_windows):
+            selection = (index >= pd.Timestamp(window.start)) & (index <= pd.Timestamp(window.end))
+            partials.append(('window_peak', 'max', selection, np.full(selection.sum(), j), values[selection]))
+        active = self.tariff.period_active
+        selection = (index >= pd.Timestamp(active.start)) & (index <= pd.Timestamp(active.end))
+        return partials + _coverage_partials(index, values, self.tariff.frequency_applied, selection)
+
+    def charges(self, aggregates):
+        peaks = aggregates['window_peak'].reindex(range(len(self.tariff.critical_peak_windows)))
+        charge = peaks.mean(skipna=False) * self.tariff.rate
+        if self.tariff.pro_rata:
+            return charge * self.weights(
+                aggregates, self.tariff.frequency_applied, within_window=self.tariff.period_active
+            )
+        return pd.Series(charge, index=aggregates['rows'].index)
+
+
+# Aggregators by tariff type; subclasses of these tariffs use their parent's
+aggregators: Dict[Type[Tariff], Type[Aggregator]] = {
+    SingleRateTariff: SingleRateAggregator,
+    TouTariff: TouAggregator,
+    SpotPriceTariff: SpotPriceAggregator,
+    NetMeteringTariff: NetMeteringAggregator,
+    ConnectionTariff: ConnectionAggregator,
+    CapacityTariff: ConnectionAggregator,
+    DemandTariff: DemandAggregator,
+    RatchetDemandTariff: RatchetDemandAggregator,
+    TopNDemandTariff: TopNDemandAggregator,
+    BlockTariff: BlockAggregator,
+    CriticalPeakDemandTariff: CriticalPeakDemandAggregator,
+}
+
+
+def aggregator_for(tariff: Tariff, sample_rate: Union[timedelta, SampleRate]) -> Aggregator:
+    for tariff_type in type(tariff).__mro__:
+        if tariff_type in aggregators:
+            return aggregators[tariff_type](tariff, sample_rate)
+    raise NotImplementedError(f'{type(tariff).__name__} {tariff.name} cannot be billed out of core')
+
+
+class OutOfCoreBiller:
+    """ Bills a TariffRegime from record batches of interval rows of many
+    meters, holding only per meter aggregates and spilling them to disk
+    once more than max_meters distinct meters are held
+
+    channels maps each consumption column to its units, as in the
+    ts-tariffs CLI. Batches (pyarrow RecordBatches or Tables, or pandas
+    DataFrames) are added with consume(), then bills() yields the Bill of
+    each meter. Spill files are removed once all bills have been yielded
+    """
+    # Number of batches of partial aggregates held before they are merged
+    compact_every = 8
+
+    def __init__(
+            self,
+            regime: TariffRegime,
+            channels: Dict[str, str],
+            sample_rate: Union[timedelta, SampleRate],
+            meter_column: str = 'meter_id',
+            datetime_column: str = 'datetime',
+            max_meters: int = 10_000,
+            spill_dir: Union[str, Path] = None,
+            n_buckets: int = 16,
+    ):
+        self.regime = regime
+        self.aggregators = [aggregator_for(tariff, sample_rate) for tariff in regime.tariffs]
+        self.channels = dict(channels)
+        columns_by_unit = {units: column for column, units in self.channels.items()}
+        self._tariff_columns = [
+            next(iter(self.channels)) if tariff.consumption_unit in frequency_units
+            else columns_by_unit[tariff.consumption_unit]
+            for tariff in regime.tariffs
+        ]
+        self.meter_column = meter_column
+        self.datetime_column = datetime_column
+        self.max_meters = max_meters
+        self.n_buckets = n_buckets
+        self._own_spill_dir = spill_dir is None
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self._pending: Dict[str, List[pd.DataFrame]] = {reducer: [] for reducer in REDUCERS}
+        self._meters = set()
+        self._n_spills = 0
+        # Aggregates are keyed by integer id (cheaper to group than names)
+        self._aggregate_ids: Dict[Tuple[int, str], int] = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.meter_column, self.datetime_column, *self.channels]
+
+    def consume(self, batch):
+        """ Add the partial aggregates of a batch of rows
+        """
+        df = batch if isinstance(batch, pd.DataFrame) else batch.to_pandas()
+        meters = df[self.meter_column].to_numpy()
+        index = pd.DatetimeIndex(df[self.datetime_column])
+        partials = {reducer: [] for reducer in REDUCERS}
+        for aggregator in self.aggregators:
+            aggregator.tz = index.tz
+        for j, (aggregator, column) in enumerate(zip(self.aggregators, self._tariff_columns)):
+            values = df[column].to_numpy(dtype=float)
+            for name, reducer, selection, keys, aggregate_values in aggregator.partials(values, index):
+                partials[reducer].append(pd.DataFrame({
+                    'meter': meters if selection is None else meters[selection],
+                    'aggregate': self._aggregate_ids.setdefault((j, name), len(self._aggregate_ids)),
+                    'key': keys,
+                    'value': aggregate_values,
+                }))
+        for reducer, frames in partials.items():
+            if frames:
+                self._pending[reducer].append(self._reduce(pd.concat(frames, ignore_index=True), reducer))
+                if len(self._pending[reducer]) >= self.compact_every:
+                    pending = pd.concat(self._pending[reducer], ignore_index=True)
+                    self._pending[reducer] = [self._reduce(pending, reducer)]
+        self._meters.update(pd.unique(meters))
+        if len(self._meters) > self.max_meters:
+            self.spill()
+
+    @staticmethod
+    def _reduce(partials: pd.DataFrame, reducer: str) -> pd.DataFrame:
+        return partials.groupby(['meter', 'aggregate', 'key'], sort=False)['value'].agg(reducer).reset_index()
+
+    def _compacted(self) -> Dict[str, pd.DataFrame]:
+        return {
+            reducer: self._reduce(pd.concat(frames, ignore_index=True), reducer)
+            for reducer, frames in self._pending.items() if frames
+        }
+
+    def _bucket(self, meters: pd.Series) -> np.ndarray:
+        return (pd.util.hash_pandas_object(meters.astype(str), index=False).to_numpy() % self.n_buckets).astype(int)
+
+    def spill(self):
+        """ Write the held aggregates to Parquet files, one per hash bucket of meters
+        """
+        if self.spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix='ts_tariffs_spill_'))
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for reducer, table in self._compacted().items():
+            table['meter'] = table['meter'].astype(str)
+            for bucket, rows in table.groupby(self._bucket(table['meter'])):
+                rows.to_parquet(self.spill_dir / f'{reducer}-{bucket:04d}-{self._n_spills:06d}.parquet', index=False)
+        self._n_spills += 1
+        self._pending = {reducer: [] for reducer in REDUCERS}
+        self._meters = set()
+
+    def _bills(self, tables: Dict[str, pd.DataFrame]) -> Iterator[Bill]:
+        aggregates = pd.concat(tables.values(), ignore_index=True)
+        names = {aggregate_id: key for key, aggregate_id in self._aggregate_ids.items()}
+        for meter, rows in aggregates.sort_values(['meter', 'aggregate', 'key']).groupby('meter', sort=False):
+            by_tariff = [{} for _ in self.aggregators]
+            for aggregate, values in rows.groupby('aggregate', sort=False):
+                j, name = names[aggregate]
+                by_tariff[j][name] = pd.Series(values['value'].to_numpy(), index=values['key'].to_numpy())
+            charges = []
+            for aggregator, aggregates_of_tariff in zip(self.aggregators, by_tariff):
+                charges.append(aggregator.applied(_WithEmpty(aggregates_of_tariff)))
+            yield Bill(str(meter), charges)
+
+    def bills(self) -> Iterator[Bill]:
+        """ Bill of each meter, assembled from the merged aggregates
+        """
+        try:
+            if not self._n_spills:
+                tables = self._compacted()
+                if tables:
+                    yield from self._bills(tables)
+                return
+            if self._meters:
+                self.spill()
+            import pyarrow.parquet as pq
+            for bucket in range(self.n_buckets):
+                tables = {}
+                for reducer in REDUCERS:
+                    paths = sorted(self.spill_dir.glob(f'{reducer}-{bucket:04d}-*.parquet'))
+                    if paths:
+                        table = pd.concat([pq.read_table(path).to_pandas() for path in paths], ignore_index=True)
+                        tables[reducer] = self._reduce(table, reducer)
+                if tables:
+                    yield from self._bills(tables)
+        finally:
+            if self._own_spill_dir and self.spill_dir is not None:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+class _WithEmpty(dict):
+    """ Aggregates of a meter, where a meter without rows for an aggregate
+    (e.g. none within a time window) has an empty Series
+    """
+    def __missing__(self, key):
+        return pd.Series([], dtype=float)
+
+
+def bill_record_batches(
+        regime: TariffRegime,
+        batches: Iterable,
+        channels: Dict[str, str],
+        sample_rate: Union[timedelta, SampleRate],
+        **kwargs
+) -> Iterator[Bill]:
+    """ Bills of all meters in an iterable of record batches, see OutOfCoreBiller
+    """
+    biller = OutOfCoreBiller(regime, channels, sample_rate, **kwargs)
+    for batch in batches:
+        biller.consume(batch)
+    return biller.bills()
+
+
+def bill_parquet(
+        regime: TariffRegime,
+        source: Union[str, Path, List[str]],
+        channels: Dict[str, str],
+        sample_rate: Union[timedelta, SampleRate],
+        batch_size: int = 1_000_000,
+        **kwargs
+) -> Iterator[Bill]:
+    """ Bills of all meters in a Parquet file or dataset (directory), read
+    batch_size rows at a time, see OutOfCoreBiller
+    """
+    import pyarrow.dataset as ds
+    biller = OutOfCoreBiller(regime, channels, sample_rate, **kwargs)
+    dataset = ds.dataset(source, format='parquet')
+    for batch in dataset.to_batches(columns=biller.columns, batch_size=batch_size):
+        biller.consume(batch)
+    return biller.bills()
@@ -0,0 +1,232 @@
+""" Per-stage cost breakdown of tariff regime runs
+
+A Profiler records the wall time and memory allocated by each stage of a
+bill calculation, nested as bill > tariff type > tariff (meter) > stage,
+e.g. index attribute extraction, groupby reduction or DataFrame construction.
+Stages are marked in the billing code with profiling.stage(name), which does
+nothing unless a profiler is active.
+
+Reports are written as JSON (see diff_profiles for comparing two reports,
+e.g. across releases) or in the collapsed stack format read by flame graph
+tools (flamegraph.pl, speedscope, inferno).
+
+Example:
+    profiler = Profiler()
+    bill = regime.calculate_bill('customer_1', meters, profiler=profiler)
+    profiler.to_json('profile.json')
+    profiler.write_collapsed('profile.folded')
+"""
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from ts_tariffs import __version__
+
+STACK_SEPARATOR = ';'
+
+_active_profiler: ContextVar[Optional['Profiler']] = ContextVar('ts_tariffs_profiler', default=None)
+
+
+@dataclass
+class StageStats:
+    """ Totals over all calls of one stage stack. seconds, allocated_bytes and
+    net_blocks include nested stages; peak_bytes is the largest traced memory
+    above the stage's starting point seen in any call
+    """
+    calls: int = 0
+    seconds: float = 0.0
+    allocated_bytes: int = 0
+    peak_bytes: int = 0
+    net_blocks: int = 0
+
+
+class _Frame:
+    __slots__ = ('start', 'start_bytes', 'start_blocks', 'peak')
+
+    def __init__(self, start_bytes: int):
+        self.start_bytes = start_bytes
+        self.peak = start_bytes
+        self.start_blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+
+class Profiler:
+    """ Records time and (with trace_memory) tracemalloc allocations per stage
+    stack. Memory tracing is started on activation if it is not already
+    running and stopped again afterwards
+    """
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stats: Dict[Tuple[str, ...], StageStats] = {}
+        self._stack: List[str] = []
+        self._frames: List[_Frame] = []
+        self._started_tracing = False
+
+    def _traced(self) -> Tuple[int, int]:
+        if self.trace_memory:
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextmanager
+    def activate(self):
+        """ Make this the profiler used by profiling.stage in this context
+        """
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        token = _active_profiler.set(self)
+        try:
+            yield self
+        finally:
+            _active_profiler.reset(token)
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """ Record the enclosed block as a stage nested in the current stack
+        """
+        current, peak = self._traced()
+        if self._frames:
+            # tracemalloc has a single peak, so the enclosing stage's peak is
+            # kept on its frame and the tracker reset for this stage
+            self._frames[-1].peak = max(self._frames[-1].peak, peak)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._stack.append(name.replace(STACK_SEPARATOR, ','))
+        frame = _Frame(current)
+        self._frames.append(frame)
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - frame.start
+            net_blocks = sys.getallocatedblocks() - frame.start_blocks
+            current, peak = self._traced()
+            peak = max(frame.peak, peak)
+            self._frames.pop()
+            if self._frames:
+                self._frames[-1].peak = max(self._frames[-1].peak, peak)
+            stats = self.stats.setdefault(tuple(self._stack), StageStats())
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.allocated_bytes += current - frame.start_bytes
+            stats.peak_bytes = max(stats.peak_bytes, peak - frame.start_bytes)
+            stats.net_blocks += net_blocks
+            self._stack.pop()
+
+    def self_seconds(self) -> Dict[Tuple[str, ...], float]:
+        """ Time of each stack excluding its nested stages
+        """
+        child_seconds = {}
+        for stack, stats in self.stats.items():
+            if len(stack) > 1:
+                child_seconds[stack[:-1]] = child_seconds.get(stack[:-1], 0.0) + stats.seconds
+        return {
+            stack: max(stats.seconds - child_seconds.get(stack, 0.0), 0.0)
+            for stack, stats in self.stats.items()
+        }
+
+    def as_dataframe(self) -> pd.DataFrame:
+        self_seconds = self.self_seconds()
+        return pd.DataFrame([
+            {'stack': STACK_SEPARATOR.join(stack), **asdict(stats), 'self_seconds': self_seconds[stack]}
+            for stack, stats in self.stats.items()
+        ])
+
+    def stage_summary(self) -> pd.DataFrame:
+        """ Totals per stack with the leading bill (meter) frame dropped, i.e.
+        per tariff type, tariff and stage over all profiled bills
+        """
+        df = self.as_dataframe()
+        df = df[df['stack'].str.contains(STACK_SEPARATOR, regex=False)]
+        df['stack'] = df['stack'].str.split(STACK_SEPARATOR, n=1).str[1]
+        return df.groupby('stack').agg({
+            'calls': 'sum',
+            'seconds': 'sum',
+            'self_seconds': 'sum',
+            'allocated_bytes': 'sum',
+            'peak_bytes': 'max',
+            'net_blocks': 'sum',
+        }).sort_values('self_seconds', ascending=False)
+
+    def collapsed(self, metric: str = 'seconds') -> List[str]:
+        """ Collapsed stack lines ("frame;frame;frame value") of self time in
+        microseconds (metric='seconds') or of allocated bytes
+        (metric='allocated_bytes'), as read by flame graph tools
+        """
+        if metric == 'seconds':
+            values = {stack: int(seconds * 1e6) for stack, seconds in self.self_seconds().items()}
+        else:
+            child_values = {}
+            for stack, stats in self.stats.items():
+                if len(stack) > 1:
+                    child_values[stack[:-1]] = child_values.get(stack[:-1], 0) + getattr(stats, metric)
+            values = {
+                stack: max(getattr(stats, metric) - child_values.get(stack, 0), 0)
+                for stack, stats in self.stats.items()
+            }
+        return [f'{STACK_SEPARATOR.join(stack)} {value}' for stack, value in values.items() if value > 0]
+
+    def write_collapsed(self, path: Union[str, Path], metric: str = 'seconds'):
+        Path(path).write_text('\n'.join(self.collapsed(metric)) + '\n')
+
+    def as_dict(self) -> dict:
+        self_seconds = self.self_seconds()
+        return {
+            'ts_tariffs_version': __version__,
+            'trace_memory': self.trace_memory,
+            'stages': [
+                {'stack': list(stack), **asdict(stats), 'self_seconds': self_seconds[stack]}
+                for stack, stats in self.stats.items()
+            ],
+        }
+
+    def to_json(self, path: Union[str, Path]):
+        Path(path).write_text(json.dumps(self.as_dict(), indent=2))
+
+
+def stage(name: str):
+    """ Context manager marking a stage of the active profiler, if any
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def active_profiler() -> Optional[Profiler]:
+    return _active_profiler.get()
+
+
+def diff_profiles(
+        base: Union[str, Path, dict],
+        new: Union[str, Path, dict],
+        drop_bill: bool = True
+) -> pd.DataFrame:
+    """ Per stack change in self time, time and allocated bytes between two
+    JSON reports (paths or Profiler.as_dict() output). With drop_bill, stacks
+    are compared per tariff type, tariff and stage over all bills
+    """
+    frames = []
+    for label, report in (('base', base), ('new', new)):
+        if not isinstance(report, dict):
+            report = json.loads(Path(report).read_text())
+        df = pd.DataFrame(report['stages'])
+        start = 1 if drop_bill else 0
+        df = df[df['stack'].map(len) > start]
+        df['stack'] = df['stack'].map(lambda stack: STACK_SEPARATOR.join(stack[start:]))
+        df = df.groupby('stack')[['calls', 'seconds', 'self_seconds', 'allocated_bytes']].sum()
+        frames.append(df.add_prefix(f'{label}_'))
+    diff = pd.concat(frames, axis=1).fillna(0)
+    for column in ('seconds', 'self_seconds', 'allocated_bytes'):
+        diff[f'{column}_change'] = diff[f'new_{column}'] - diff[f'base_{column}']
+    return diff.sort_values('self_seconds_change', ascending=False)
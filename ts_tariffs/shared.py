@@ -0,0 +1,229 @@
+""" Tariff data shared between billing worker processes
+
+SharedTariffs.publish places parsed tariff regimes and any reference data
+(e.g. spot price and loss factor MeterData) once in a shared memory block
+(multiprocessing.shared_memory) or a memory mapped file. Worker processes
+attach to it, mapping the arrays (price series, event calendars, rate
+tables) read only instead of each loading and parsing their own copies.
+Attaching only unpickles the small object graph around the arrays, so it
+takes milliseconds however large the price series are, and all workers
+share one copy of the data.
+
+Example:
+    # Parent process
+    shared = SharedTariffs.publish(TariffLoader().load_regimes(paths), data={'spot': spot_prices})
+    ...start workers, passing them shared.name...
+    shared.unlink()   # once all workers have finished
+
+    # Worker process
+    shared = SharedTariffs.attach(name)
+    bill = shared.regimes['residential_tou'].calculate_bill(meter_id, meters)
+"""
+from __future__ import annotations
+
+import mmap
+import multiprocessing
+import os
+import pickle
+import struct
+from io import BytesIO
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ts_tariffs import __version__
+from ts_tariffs.billing import TariffRegime
+
+MAGIC = b'TSTARIFF'
+# Magic, payload offset, payload length, number of buffers
+_HEADER = struct.Struct('<8sQQQ')
+# Offset and length of each buffer
+_ENTRY = struct.Struct('<QQ')
+# Buffers are aligned for any NumPy dtype (and cache lines)
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _datetime_index(values: np.ndarray, unit: str, dtype, name) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(pd.arrays.DatetimeArray(values.view(f'M8[{unit}]'), dtype=dtype), name=name, copy=False)
+
+
+class _Pickler(pickle.Pickler):
+    """ Pickles DatetimeIndexes as int64 arrays, so that like other numeric
+    arrays they are written out of band (NumPy pickles datetime64 arrays in band)
+    """
+    def reducer_override(self, obj):
+        if isinstance(obj, pd.DatetimeIndex):
+            unit = np.datetime_data(obj.values.dtype)[0]
+            return _datetime_index, (obj.asi8, unit, obj.dtype, obj.name)
+        return NotImplemented
+
+
+def _dumps(obj) -> Tuple[bytes, List[pickle.PickleBuffer]]:
+    buffers = []
+    stream = BytesIO()
+    _Pickler(stream, protocol=5, buffer_callback=buffers.append).dump(obj)
+    return stream.getvalue(), buffers
+
+
+def _open_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        # Python 3.13+
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Before 3.13 attaching registers the block with the resource
+        # tracker, which unlinks it when this process exits, unless the
+        # tracker is the publisher's (inherited by multiprocessing children)
+        if os.name == 'posix' and multiprocessing.parent_process() is None:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedTariffs:
+    """ Tariff regimes and reference data held in shared memory (or a
+    memory mapped file) and attached read only by each process
+
+    Arrays are views of the shared block, so are read only, and the block
+    can only be closed once the regimes and data are no longer referenced.
+    The publishing process owns the block and should unlink() it once all
+    workers have finished (a file is left in place for later runs)
+    """
+    def __init__(
+            self,
+            name: str,
+            regimes: Dict[str, TariffRegime],
+            data: Dict[str, Any],
+            handle: Union[shared_memory.SharedMemory, mmap.mmap],
+            is_file: bool = False,
+    ):
+        self.name = name
+        self.regimes = regimes
+        self.data = data
+        self._handle = handle
+        self._is_file = is_file
+
+    @property
+    def nbytes(self) -> int:
+        return self._handle.size if not self._is_file else len(self._handle)
+
+    @classmethod
+    def publish(
+            cls,
+            regimes: Union[Iterable[TariffRegime], Dict[str, TariffRegime]],
+            data: Dict[str, Any] = None,
+            name: str = None,
+            path: Union[str, Path] = None,
+    ) -> SharedTariffs:
+        """ Place regimes (keyed by name, unless given as a dict) and data
+        in a new shared memory block (named name, or a generated name) or,
+        if path is given, a file to be memory mapped
+        """
+        if not isinstance(regimes, dict):
+            regimes = {regime.name: regime for regime in regimes}
+        payload, buffers = _dumps({
+            'ts_tariffs_version': __version__,
+            'regimes': regimes,
+            'data': data or {},
+        })
+        buffers = [buffer.raw() for buffer in buffers]
+        table_end = _HEADER.size + _ENTRY.size * len(buffers)
+        payload_offset = _aligned(table_end)
+        offsets = []
+        offset = payload_offset + len(payload)
+        for buffer in buffers:
+            offset = _aligned(offset)
+            offsets.append(offset)
+            offset += buffer.nbytes
+        size = max(offset, 1)
+
+        def write(block: memoryview):
+            _HEADER.pack_into(block, 0, MAGIC, payload_offset, len(payload), len(buffers))
+            for j, (buffer_offset, buffer) in enumerate(zip(offsets, buffers)):
+                _ENTRY.pack_into(block, _HEADER.size + j * _ENTRY.size, buffer_offset, buffer.nbytes)
+                block[buffer_offset:buffer_offset + buffer.nbytes] = buffer.cast('B')
+            block[payload_offset:payload_offset + len(payload)] = payload
+
+        if path is not None:
+            path = Path(path)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+            with open(path, 'r+b') as f, mmap.mmap(f.fileno(), size) as block:
+                with memoryview(block) as view:
+                    write(view)
+            return cls.attach(path=path)
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        write(shm.buf)
+        return cls._load(shm.name, shm.buf, shm)
+
+    @classmethod
+    def attach(cls, name: str = None, path: Union[str, Path] = None) -> SharedTariffs:
+        """ Attach to the shared memory block called name, or map the file at path
+        """
+        if (name is None) == (path is None):
+            raise ValueError('Exactly one of name and path must be given')
+        if path is not None:
+            with open(path, 'rb') as f:
+                block = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls._load(str(path), memoryview(block), block, is_file=True)
+        shm = _open_shared_memory(name)
+        return cls._load(shm.name, shm.buf, shm)
+
+    @classmethod
+    def _load(cls, name: str, block: memoryview, handle, is_file: bool = False) -> SharedTariffs:
+        block = block.toreadonly()
+        magic, payload_offset, payload_length, n_buffers = _HEADER.unpack_from(block, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{name} does not hold shared tariff data')
+        buffers = []
+        for j in range(n_buffers):
+            offset, length = _ENTRY.unpack_from(block, _HEADER.size + j * _ENTRY.size)
+            buffers.append(block[offset:offset + length])
+        contents = pickle.loads(block[payload_offset:payload_offset + payload_length], buffers=buffers)
+        if contents['ts_tariffs_version'] != __version__:
+            raise ValueError(
+                f'{name} was published by ts_tariffs {contents["ts_tariffs_version"]}, '
+                f'this is version {__version__}'
+            )
+        return cls(name, contents['regimes'], contents['data'], handle, is_file)
+
+    def close(self):
+        """ Detach from the block. Raises BufferError while any of its
+        regimes' or data's arrays are still referenced
+        """
+        self.regimes = None
+        self.data = None
+        self._handle.close()
+
+    def unlink(self):
+        """ Remove the shared memory block (or file) once all processes have closed it
+        """
+        if self._is_file:
+            Path(self.name).unlink(missing_ok=True)
+        else:
+            self._handle.unlink()
+
+
+# Blocks attached by attach_regime, kept open for the life of the process
+_attached: List[SharedTariffs] = []
+
+
+def attach_regime(name: str, regime_name: Optional[str] = None) -> TariffRegime:
+    """ A regime from a shared memory block (the only one if regime_name is
+    not given). The block stays attached for the life of the process
+    """
+    shared = SharedTariffs.attach(name)
+    if regime_name is None:
+        if len(shared.regimes) != 1:
+            raise ValueError(f'{name} holds {len(shared.regimes)} regimes, a regime_name is required')
+        regime_name = next(iter(shared.regimes))
+    _attached.append(shared)
+    return shared.regimes[regime_name]
@@ -1,21 +1,96 @@
+from __future__ import annotations
+
 import warnings
 from abc import ABC, abstractmethod
 from types import MappingProxyType
 
 import pandas as pd
 import numpy as np
-from datetime import timedelta
+from datetime import timedelta, datetime
 from typing import (
     List,
-    Union, Optional
+    Union, Optional, Tuple, ClassVar
 )
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 
-from ts_tariffs.meters import MeterData
-from ts_tariffs.ts_utils import FrequencyOption, resample_schema, TouBins, TimeWindow, SampleRate, DatetimeWindow, \
-    DateWindow
+from ts_tariffs import kernels, profiling
+from ts_tariffs.charge_table import ChargeTable
+from ts_tariffs.meters import MeterData, EventCalendar, TimeGrid, rolling_period_peaks_array, top_n_period_peaks_array, window_samples, \
+    peak_period_segments, spanned_periods, spanned_period_bounds
+from ts_tariffs.ts_utils import FrequencyOption, TouBins, TimeWindow, SampleRate, DatetimeWindow, \
+    DateWindow, period_cascades_map, resample_schema
 from ts_tariffs.units import ConsumptionUnitOption
 from ts_tariffs.utils import Block
+from ts_tariffs.validation import validate_fields
+
+
+def _index_of(consumption: Union[MeterData, TimeGrid, pd.DatetimeIndex]) -> pd.DatetimeIndex:
+    if isinstance(consumption, TimeGrid):
+        return consumption.index
+    if isinstance(consumption, MeterData):
+        return consumption.tseries.index
+    return consumption
+
+
+def _validate_periodic_frequency(name: str, frequency: FrequencyOption, pro_rata: bool):
+    """ Periodic (connection and capacity) charges are for every calendar
+    period spanned by the data, which resample supports down to seconds,
+    or for billing cycles. Pro rata weights need periods with bounds
+    """
+    if pro_rata and frequency not in period_cascades_map:
+        raise ValueError(
+            f'{name}: pro_rata charges need a frequency_applied of {list(period_cascades_map)}, not "{frequency}"'
+        )
+    if frequency not in resample_schema and frequency != 'cycle':
+        raise ValueError(
+            f'{name}: frequency_applied must be one of {list(resample_schema) + ["cycle"]}, not "{frequency}"'
+        )
+
+
+def _charged_periods(
+        consumption: MeterData,
+        frequency: FrequencyOption,
+        pro_rata: bool
+) -> pd.DataFrame:
+    """ Consumption in, and number of periods charged for, each period of a
+    periodic charge. Calendar periods are charged in full as per resample,
+    so periods without data between the first and last samples are charged
+    too. Billing cycles and pro rata periods are those with data, with pro
+    rata periods charged for their coverage
+    """
+    if not pro_rata and frequency != 'cycle':
+        charged = pd.DataFrame(consumption.tseries.resample(resample_schema[frequency]).sum())
+        charged['periods'] = 1.0
+        return charged
+    charged = consumption.period_sum(frequency)
+    charged['periods'] = consumption.period_weights(frequency) if pro_rata else 1.0
+    return charged
+
+
+def _charged_period_bounds(
+        consumption: MeterData,
+        frequency: FrequencyOption,
+        pro_rata: bool
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """ Bounds of, and number of periods charged for, the periods of _charged_periods
+    """
+    if not pro_rata and frequency != 'cycle':
+        bounds = spanned_period_bounds(consumption.tseries.index, frequency)
+        return bounds, np.ones(len(bounds))
+    bounds = consumption.period_bounds(frequency)
+    if pro_rata:
+        return bounds, consumption.period_weights(frequency).to_numpy()
+    return bounds, np.ones(len(bounds))
+
+
+def _grid_periods_charged(grid: TimeGrid, frequency: FrequencyOption, pro_rata: bool) -> float:
+    """ Total number of periods charged (see _charged_periods) for data on a grid
+    """
+    if pro_rata:
+        return grid.period_weights(frequency).sum()
+    if frequency == 'cycle':
+        return len(grid.segments(frequency)[1])
+    return len(grid.memo(('spanned_periods', frequency), lambda: spanned_periods(grid.index, frequency)))
 
 
 @dataclass(frozen=True)
@@ -49,9 +124,61 @@ class Tariff(ABC):
     ) -> AppliedCharge:
         pass
 
+    def charge_table(
+            self,
+            consumption: MeterData,
+    ) -> ChargeTable:
+        """ Charges in long format, with the same columns for every tariff
+        type (see ChargeTable), whose amounts sum to the apply() total.
+        Missing values give NaN amounts in the rows they fall in
+
+        Tariffs without their own implementation get a single "charge" row
+        spanning the consumption, at a rate of the apply() total
+        """
+        index = consumption.tseries.index
+        if not len(index):
+            return ChargeTable.empty()
+        return ChargeTable.of_charge(
+            self.name,
+            ['charge'],
+            0,
+            index[:1],
+            index[-1:] + pd.Timedelta(consumption.sample_rate),
+            np.ones(1),
+            float(np.squeeze(self.apply(consumption).total))
+        )
+
+    def batch_totals(
+            self,
+            values: np.ndarray,
+            grid: TimeGrid,
+    ) -> np.ndarray:
+        """ Total charge for each row of a rows (e.g. scenarios or meters)
+        x intervals array on a shared TimeGrid, without building per meter
+        DataFrames. Tariffs without a batch implementation raise NotImplementedError
+        """
+        raise NotImplementedError(f'{type(self).__name__} has no batch implementation')
+
+    def marginal_costs(
+            self,
+            values: np.ndarray,
+            grid: TimeGrid,
+    ) -> np.ndarray:
+        """ Marginal cost of consumption in each interval of a single meter's
+        values on grid, i.e. the (sub)gradient of the tariff's total charge
+        with respect to each value. Where the total is not differentiable
+        (e.g. tied peaks or a period total on a block threshold) the rate
+        that applies to an increase is used
+        """
+        raise NotImplementedError(f'{type(self).__name__} has no marginal cost implementation')
+
     @classmethod
     def from_dict(cls, tariff_dict: dict):
-        return cls(**tariff_dict)
+        """ Instantiate from a dict of params, validating each field and
+        converting nested params (e.g. sample_rate, tou, blocks and windows)
+        from their dict/list representations
+        """
+        return cls(**validate_fields(cls, tariff_dict))
 
 
 @dataclass
@@ -65,33 +192,51 @@ class SingleRateTariff(Tariff):
             consumption: MeterData,
     ) -> AppliedCharge:
 
-        charge_vector = consumption.tseries * self.adjustment_factor * self.rate
+        rate = self.adjustment_factor * self.rate
+        charge_vector = consumption.tseries * rate
 
         return AppliedCharge(
             self.name,
             charge_vector,
             self.rate_unit,
             consumption.units,
-            sum(charge_vector)
+            float(kernels.weighted_total(consumption.to_numpy(), rate))
         )
 
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        return ChargeTable.of_intervals(
+            self.name, ['consumption'], 0, consumption.tseries.index, consumption.sample_rate,
+            consumption.to_numpy(), self.adjustment_factor * self.rate
+        )
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return kernels.weighted_total(values, self.adjustment_factor * self.rate)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return np.full(np.shape(values), self.adjustment_factor * self.rate)
+
 
 @dataclass
 class ConnectionTariff(Tariff):
-    """ Charge applied for having service - applied periodically
+    """ Charge applied for having service - applied periodically, for every
+    period the consumption data spans (including periods without data)
+
+    With pro_rata, periods only partially covered by the consumption data
+    (e.g. the first and last months) are charged in proportion to their coverage
     """
     rate: float
     frequency_applied: FrequencyOption
+    pro_rata: bool = False
+
+    def __post_init__(self):
+        super().__post_init__()
+        _validate_periodic_frequency(self.name, self.frequency_applied, self.pro_rata)
 
     def apply(
             self,
             consumption: MeterData,
     ) -> AppliedCharge:
-        cost_ts = consumption.tseries.resample(
-            resample_schema[self.frequency_applied]
-        ).sum()
-        cost_ts = pd.DataFrame(cost_ts)
-        cost_ts['periods'] = 1.0
+        cost_ts = _charged_periods(consumption, self.frequency_applied, self.pro_rata)
         cost_ts['charge'] = self.rate * cost_ts['periods']
         cost_ts[f'rate ({self.rate_unit})'] = self.rate
         return AppliedCharge(
@@ -99,9 +244,20 @@ class ConnectionTariff(Tariff):
             cost_ts,
             self.rate_unit,
             consumption.units,
-            sum(cost_ts['charge'])
+            cost_ts['charge'].sum()
         )
 
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        bounds, periods = _charged_period_bounds(consumption, self.frequency_applied, self.pro_rata)
+        return ChargeTable.of_periods(self.name, ['connection'], 0, bounds, periods, self.rate)
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        periods = _grid_periods_charged(grid, self.frequency_applied, self.pro_rata)
+        return np.full(values.shape[:-1], self.rate * periods)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return np.zeros(np.shape(values))
+
 
 @dataclass
 class TouTariff(Tariff):
@@ -117,33 +273,332 @@ class TouTariff(Tariff):
             self,
             consumption: MeterData,
     ) -> AppliedCharge:
-        prices = np.array(self.tou.bin_rates)
-        bins = np.digitize(
-            consumption.tseries.index.hour.values,
-            bins=self.tou.time_bins,
+        with profiling.stage('index_attributes'):
+            hours = consumption.hours()
+        with profiling.stage('rates'):
+            rates = self.tou.rates_at(hours)
+        values = consumption.to_numpy()
+        with profiling.stage('dataframe'):
+            cost_ts = pd.DataFrame(consumption.tseries)
+            cost_ts['charge'] = rates * values
+            cost_ts[f'rate ({self.rate_unit})'] = rates
+        with profiling.stage('total'):
+            total = float(kernels.weighted_total(values, rates))
+
+        return AppliedCharge(
+            self.name,
+            cost_ts,
+            self.rate_unit,
+            consumption.units,
+            total
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per interval, with the time of use bin label as its component
+        """
+        hours = consumption.hours()
+        label_codes, labels = pd.factorize(pd.Index(self.tou.bin_labels))
+        return ChargeTable.of_intervals(
+            self.name, labels, label_codes[self.tou.bin_index(hours)], consumption.tseries.index,
+            consumption.sample_rate, consumption.to_numpy(), self.tou.rates_at(hours)
+        )
+
+    def grid_rates(self, grid: TimeGrid) -> np.ndarray:
+        return grid.memo(
+            ('tou_rates', tuple(self.tou.time_bins), tuple(self.tou.bin_rates)),
+            lambda: self.tou.rates_at(grid.hours)
         )
-        charge_vector = prices[bins] * consumption.to_numpy()
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return kernels.weighted_total(values, self.grid_rates(grid))
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return np.broadcast_to(self.grid_rates(grid), np.shape(values)).copy()
+
+
+@dataclass
+class SpotPriceTariff(Tariff):
+    """ Charge per unit of consumption at a price that varies each interval
+    (e.g. pass-through of 5 minute wholesale spot prices)
+
+    The prices MeterData is only read, so a single instance can be shared
+    between any number of tariffs and meters. Optional loss factors scale
+    consumption, either as a constant or per interval
+    """
+    prices: MeterData
+    loss_factors: Union[float, MeterData] = None
+
+    def aligned_series(self, series: MeterData, index: pd.DatetimeIndex, description: str) -> np.ndarray:
+        """ Values of series (prices or loss factors) aligned to index, which
+        the series must cover: an interval before its first point would have
+        no value, and one after its last interval would repeat its last value
+        """
+        own_index = series.tseries.index
+        if len(index) and (
+                not len(own_index)
+                or index[0] < own_index[0]
+                or index[-1] >= own_index[-1] + pd.Timedelta(series.sample_rate)
+        ):
+            covered = f'{own_index[0]} to {own_index[-1]}' if len(own_index) else 'no intervals'
+            raise ValueError(
+                f'{self.name}: {description} cover {covered}, '
+                f'which does not include the consumption from {index[0]} to {index[-1]}'
+            )
+        return series.aligned_to(index)
+
+    def aligned_prices(self, consumption: Union[MeterData, TimeGrid, pd.DatetimeIndex]) -> np.ndarray:
+        return self.aligned_series(self.prices, _index_of(consumption), 'prices')
+
+    def aligned_loss_factors(
+            self,
+            consumption: Union[MeterData, TimeGrid, pd.DatetimeIndex]
+    ) -> Union[float, np.ndarray]:
+        if self.loss_factors is None:
+            return 1.0
+        if isinstance(self.loss_factors, MeterData):
+            return self.aligned_series(self.loss_factors, _index_of(consumption), 'loss factors')
+        return self.loss_factors
+
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        prices = self.aligned_prices(consumption)
+        adjusted = consumption.to_numpy() * (self.aligned_loss_factors(consumption) * self.adjustment_factor)
         cost_ts = pd.DataFrame(consumption.tseries)
-        cost_ts['charge'] = charge_vector
-        cost_ts[f'rate ({self.rate_unit})'] = prices[bins]
+        cost_ts['charge'] = adjusted * prices
+        cost_ts[f'rate ({self.rate_unit})'] = prices
 
         return AppliedCharge(
             self.name,
             cost_ts,
             self.rate_unit,
             consumption.units,
-            sum(charge_vector)
+            float(kernels.weighted_total(adjusted, prices))
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per interval, with loss factor adjusted consumption charged at the spot price
+        """
+        adjusted = consumption.to_numpy() * (self.aligned_loss_factors(consumption) * self.adjustment_factor)
+        return ChargeTable.of_intervals(
+            self.name, ['consumption'], 0, consumption.tseries.index, consumption.sample_rate,
+            adjusted, self.aligned_prices(consumption)
+        )
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        adjusted = values * (self.aligned_loss_factors(grid) * self.adjustment_factor)
+        return kernels.weighted_total(adjusted, self.aligned_prices(grid))
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        costs = self.aligned_prices(grid) * (self.aligned_loss_factors(grid) * self.adjustment_factor)
+        return np.broadcast_to(costs, np.shape(values)).copy()
+
+
+@dataclass
+class NetMeteringTariff(Tariff):
+    """ Bidirectional (import/export) charge for signed consumption, where
+    positive values are imported and negative values exported (e.g. solar feed-in)
+
+    Imports are charged at import_rate (or import_tou) and exports credited at
+    export_rate (or export_tou). If netting_frequency is given, imports and
+    exports are netted within each period (and time of use slot) before pricing
+    """
+    import_rate: float = None
+    export_rate: float = None
+    import_tou: TouBins = None
+    export_tou: TouBins = None
+    netting_frequency: FrequencyOption = None
+
+    def __post_init__(self):
+        super().__post_init__()
+        if isinstance(self.import_tou, dict):
+            self.import_tou = TouBins(**self.import_tou)
+        if isinstance(self.export_tou, dict):
+            self.export_tou = TouBins(**self.export_tou)
+        if self.import_rate is None and self.import_tou is None:
+            raise ValueError(f'{self.name}: one of import_rate or import_tou must be given')
+        if self.export_rate is None and self.export_tou is None:
+            raise ValueError(f'{self.name}: one of export_rate or export_tou must be given')
+
+    def import_rates(self, hours: np.ndarray) -> np.ndarray:
+        if self.import_tou:
+            return self.import_tou.rates_at(hours)
+        return np.full(len(hours), self.import_rate, dtype=float)
+
+    def export_rates(self, hours: np.ndarray) -> np.ndarray:
+        if self.export_tou:
+            return self.export_tou.rates_at(hours)
+        return np.full(len(hours), self.export_rate, dtype=float)
+
+    def slot_edges(self) -> np.ndarray:
+        """ Union of import and export time of use bin edges, such that
+        each slot has a single import and a single export rate
+        """
+        edges = [tou.time_bins for tou in (self.import_tou, self.export_tou) if tou]
+        return np.union1d(*edges) if len(edges) == 2 else np.asarray(edges[0] if edges else [])
+
+    def slot_codes(self, hours: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """ Netting period x time of use slot group of each interval
+        """
+        edges = self.slot_edges()
+        return kernels.segment_ids(starts, len(hours)) * (len(edges) + 1) + np.digitize(hours, bins=edges)
+
+    def netted(
+            self,
+            values: np.ndarray,
+            hours: np.ndarray,
+            starts: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """ Net consumption per netting period and time of use slot, shaped
+        (..., periods, slots) for 1D or 2D (rows x intervals) values, along
+        with the hour of day at the start of each slot. Missing values are
+        skipped, as in the other tariffs' period sums
+        """
+        edges = self.slot_edges()
+        n_slots = len(edges) + 1
+        n_groups = len(starts) * n_slots
+        codes = self.slot_codes(hours, starts)
+        rows = np.where(np.isnan(values), 0.0, values).reshape(-1, len(hours))
+        # Offset each row's codes so that all rows are summed in one pass
+        net = kernels.grouped_sum(
+            (np.arange(len(rows))[:, None] * n_groups + codes).ravel(),
+            rows.ravel(),
+            len(rows) * n_groups
+        ).reshape(values.shape[:-1] + (len(starts), n_slots))
+        slot_hours = np.concatenate([[0], edges]).astype(int) % 24
+        return net, slot_hours
+
+    def netting_segments(self, consumption: MeterData) -> Tuple[np.ndarray, np.ndarray, np.ndarray, pd.Index]:
+        """ Values and hours of day of the netted intervals (those within the
+        billing cycles, for netting_frequency 'cycle'), with the start
+        position and label of each netting period
+        """
+        ts, starts, labels = consumption.segments(self.netting_frequency)
+        if self.netting_frequency == 'cycle':
+            return ts.to_numpy(dtype=float), ts.index.hour.values, starts, labels
+        return consumption.to_numpy(), consumption.hours(), starts, labels
+
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        values = consumption.to_numpy()
+        index = consumption.tseries.index
+        if self.netting_frequency:
+            values, hours, starts, labels = self.netting_segments(consumption)
+            net, slot_hours = self.netted(values, hours, starts)
+            imports = np.clip(net, 0.0, None)
+            exports = np.clip(-net, 0.0, None)
+            import_charge = (imports * self.import_rates(slot_hours)).sum(axis=1)
+            export_credit = (exports * self.export_rates(slot_hours)).sum(axis=1)
+            charge_ts = pd.DataFrame({
+                'import': imports.sum(axis=1),
+                'export': exports.sum(axis=1),
+            }, index=labels)
+        else:
+            hours = consumption.hours()
+            imports = np.clip(values, 0.0, None)
+            exports = np.clip(-values, 0.0, None)
+            import_rates = self.import_rates(hours)
+            export_rates = self.export_rates(hours)
+            import_charge = imports * import_rates
+            export_credit = exports * export_rates
+            charge_ts = pd.DataFrame({
+                'import': imports,
+                'export': exports,
+                f'import_rate ({self.rate_unit})': import_rates,
+                f'export_rate ({self.rate_unit})': export_rates,
+            }, index=index)
+        charge_ts['import_charge'] = import_charge * self.adjustment_factor
+        charge_ts['export_credit'] = export_credit * self.adjustment_factor
+        charge_ts['charge'] = charge_ts['import_charge'] - charge_ts['export_credit']
+
+        return AppliedCharge(
+            self.name,
+            charge_ts,
+            self.rate_unit,
+            consumption.units,
+            charge_ts['charge'].sum()
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ Import and export rows per interval or, with netting, per netting
+        period and time of use slot. Exports have negative rates (credits)
+        """
+        values = consumption.to_numpy()
+        if self.netting_frequency:
+            values, hours, starts, _ = self.netting_segments(consumption)
+            net, slot_hours = self.netted(values, hours, starts)
+            rates = np.concatenate([self.import_rates(slot_hours), -self.export_rates(slot_hours)])
+            return ChargeTable.of_periods(
+                self.name, ['import', 'export'], np.repeat([0, 1], len(slot_hours)),
+                consumption.period_bounds(self.netting_frequency),
+                np.hstack([np.clip(net, 0.0, None), np.clip(-net, 0.0, None)]),
+                rates * self.adjustment_factor
+            )
+        hours = consumption.hours()
+        rates = np.column_stack([self.import_rates(hours), -self.export_rates(hours)])
+        return ChargeTable.of_intervals(
+            self.name, ['import', 'export'], [0, 1], consumption.tseries.index, consumption.sample_rate,
+            np.column_stack([np.clip(values, 0.0, None), np.clip(-values, 0.0, None)]),
+            rates * self.adjustment_factor
+        )
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        if self.netting_frequency:
+            columns, starts, _ = grid.segments(self.netting_frequency)
+            net, hours = self.netted(values[..., columns], grid.hours[columns], starts)
+            axes = (-2, -1)
+        else:
+            net, hours = values, grid.hours
+            axes = -1
+        charge = (
+            np.clip(net, 0.0, None) * self.import_rates(hours) * self.adjustment_factor
+            - np.clip(-net, 0.0, None) * self.export_rates(hours) * self.adjustment_factor
         )
+        return np.nansum(charge, axis=axes)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        if self.netting_frequency:
+            columns, starts, _ = grid.segments(self.netting_frequency)
+            hours = grid.hours[columns]
+            net, slot_hours = self.netted(values[columns], hours, starts)
+            # Rates of the slot each interval is netted in, chosen by the sign of the slot's net
+            importing = (net >= 0).ravel()[self.slot_codes(hours, starts)]
+            slot = np.digitize(hours, bins=self.slot_edges())
+            costs = np.zeros(len(values))
+            costs[columns] = np.where(
+                importing, self.import_rates(slot_hours)[slot], self.export_rates(slot_hours)[slot]
+            ) * self.adjustment_factor
+            return costs
+        import_rates = self.import_rates(grid.hours)
+        export_rates = self.export_rates(grid.hours)
+        return np.where(values >= 0, import_rates, export_rates) * self.adjustment_factor
+
+    def apply_pair(
+            self,
+            import_consumption: MeterData,
+            export_consumption: MeterData,
+    ) -> AppliedCharge:
+        return self.apply(MeterData.from_import_export(
+            import_consumption.name,
+            import_consumption,
+            export_consumption
+        ))
 
 
 @dataclass
 class DemandTariff(Tariff):
     """ Charge applied to the peak consumption value for a given period
     May additionally be specific to times of day (e.g. peak in a month between 3pm and 6pm)
+
+    With pro_rata, the charge for partially covered periods is scaled by their coverage
     """
     rate: float
-    frequency_applied: str
+    frequency_applied: FrequencyOption
     time_window: TimeWindow = None
+    pro_rata: bool = False
 
     def apply(
             self,
@@ -152,8 +607,286 @@ class DemandTariff(Tariff):
         peaks = consumption.period_peaks(
             self.frequency_applied,
             within_times=self.time_window
+        )['max']
+        charge_vector = (peaks * self.rate).rename('charge')
+        if self.pro_rata:
+            weights = consumption.period_weights(self.frequency_applied)
+            charge_vector *= weights.reindex(charge_vector.index).to_numpy()
+        return AppliedCharge(
+            self.name,
+            charge_vector,
+            self.rate_unit,
+            consumption.units,
+            charge_vector.sum()
         )
-        charge_vector = peaks * self.rate
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per period, with the (pro rata weighted) peak as its quantity
+        """
+        peaks = consumption.period_peaks(self.frequency_applied, within_times=self.time_window)['max']
+        demand = peaks.to_numpy(dtype=float)
+        if self.pro_rata:
+            demand = demand * consumption.period_weights(self.frequency_applied).reindex(peaks.index).to_numpy()
+        bounds = consumption.period_bounds(self.frequency_applied).reindex(peaks.index)
+        return ChargeTable.of_periods(self.name, ['demand'], 0, bounds, demand, self.rate)
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        columns, starts, _ = grid.segments(self.frequency_applied, within_times=self.time_window)
+        charge = kernels.segment_max(values[..., columns], starts) * self.rate
+        if self.pro_rata:
+            charge *= self.grid_weights(grid)
+        return np.nansum(charge, axis=-1)
+
+    def grid_weights(self, grid: TimeGrid) -> np.ndarray:
+        """ Pro rata weight of each period with data within time_window
+        """
+        def weights():
+            _, _, labels = grid.segments(self.frequency_applied, within_times=self.time_window)
+            return grid.period_weights(self.frequency_applied).reindex(labels).to_numpy()
+        return grid.memo(
+            ('demand_weights', self.frequency_applied, self.time_window.as_tuple if self.time_window else None),
+            weights
+        )
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ The demand rate, on the peak interval of each period
+        """
+        columns, starts, _ = grid.segments(self.frequency_applied, within_times=self.time_window)
+        peak_positions = kernels.segment_argmax(values[columns], starts)
+        rates = np.full(len(starts), float(self.rate))
+        if self.pro_rata:
+            rates *= self.grid_weights(grid)
+        has_peak = peak_positions >= 0
+        costs = np.zeros(len(values))
+        costs[np.arange(len(values))[columns][peak_positions[has_peak]]] = rates[has_peak]
+        return costs
+
+
+@dataclass
+class RatchetDemandTariff(Tariff):
+    """ Demand charge applied to the greater of the period peak and a fraction
+    of the highest peak in the preceding lookback_periods
+    (e.g. greater of this month's peak and 80% of the highest peak in the previous 11 months)
+
+    Peaks from earlier billing runs can be carried forward (oldest first) via
+    carried_peaks, see carry_forward()
+    """
+    rate: float
+    frequency_applied: FrequencyOption
+    ratchet_fraction: float
+    lookback_periods: int = 11
+    time_window: TimeWindow = None
+    carried_peaks: List[float] = None
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.lookback_periods < 1:
+            raise ValueError(f'{self.name}: lookback_periods must be at least 1, {self.lookback_periods} was passed')
+
+    def ratchet_demands(self, peaks: np.ndarray) -> np.ndarray:
+        """ Ratchet demand for each period given its period peaks (along the
+        last axis), from a single trailing max over the carried and current
+        peaks. Missing (NaN) peaks are skipped, so a period without data does
+        not end the ratchet of earlier peaks
+        """
+        peaks = np.asarray(peaks, dtype=float)
+        if not peaks.shape[-1]:
+            return np.zeros(peaks.shape)
+        history = np.asarray(self.carried_peaks or [], dtype=float)[-self.lookback_periods:]
+        prefix = np.concatenate([np.full(self.lookback_periods - len(history), -np.inf), history])
+        padded = np.concatenate([
+            np.broadcast_to(prefix, peaks.shape[:-1] + prefix.shape),
+            peaks
+        ], axis=-1)
+        padded = np.where(np.isnan(padded), -np.inf, padded)
+        # Max of the lookback_periods preceding (not including) each period
+        trailing_max = kernels.rolling_max(padded[..., :-1], self.lookback_periods)
+        ratchet = self.ratchet_fraction * trailing_max[..., -peaks.shape[-1]:]
+        return np.where(np.isneginf(ratchet), 0.0, ratchet)
+
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        peaks = consumption.period_peaks(
+            self.frequency_applied,
+            within_times=self.time_window
+        )['max']
+        charge_ts = pd.DataFrame({'peak': peaks})
+        charge_ts['ratchet_demand'] = self.ratchet_demands(peaks.to_numpy(dtype=float))
+        charge_ts['billed_demand'] = np.fmax(charge_ts['peak'], charge_ts['ratchet_demand'])
+        charge_ts['charge'] = charge_ts['billed_demand'] * self.rate
+        charge_ts[f'rate ({self.rate_unit})'] = self.rate
+        return AppliedCharge(
+            self.name,
+            charge_ts,
+            self.rate_unit,
+            consumption.units,
+            charge_ts['charge'].sum()
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per period, with the billed (peak or ratchet) demand as its quantity
+        """
+        peaks = consumption.period_peaks(self.frequency_applied, within_times=self.time_window)['max']
+        demand = peaks.to_numpy(dtype=float)
+        bounds = consumption.period_bounds(self.frequency_applied).reindex(peaks.index)
+        return ChargeTable.of_periods(
+            self.name, ['demand'], 0, bounds, np.fmax(demand, self.ratchet_demands(demand)), self.rate
+        )
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        columns, starts, _ = grid.segments(self.frequency_applied, within_times=self.time_window)
+        peaks = kernels.segment_max(values[..., columns], starts)
+        billed = np.fmax(peaks, self.ratchet_demands(peaks))
+        return np.nansum(billed * self.rate, axis=-1)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ The demand rate on the peak interval of each period billed at its
+        own peak, plus ratchet_fraction x rate for each later period whose
+        ratchet demand is set by that peak
+        """
+        columns, starts, _ = grid.segments(self.frequency_applied, within_times=self.time_window)
+        peaks = kernels.segment_max(values[columns], starts)
+        peak_positions = np.arange(len(values))[columns][np.maximum(kernels.segment_argmax(values[columns], starts), 0)]
+        ratchets = self.ratchet_demands(peaks)
+        history = np.asarray(self.carried_peaks or [], dtype=float)[-self.lookback_periods:]
+        lookback = np.concatenate([np.full(self.lookback_periods - len(history), -np.inf), history, peaks])
+        costs = np.zeros(len(values))
+        for k, (peak, ratchet) in enumerate(zip(peaks, ratchets)):
+            if np.isnan(peak):
+                continue
+            if not ratchet > peak:
+                costs[peak_positions[k]] += self.rate
+            else:
+                # Lookback entries k to k + lookback_periods - 1 precede period k
+                source = k + int(np.nanargmax(lookback[k:k + self.lookback_periods])) - self.lookback_periods
+                if source >= 0:
+                    costs[peak_positions[source]] += self.ratchet_fraction * self.rate
+        return costs
+
+    def carry_forward(self, applied_charge: AppliedCharge) -> RatchetDemandTariff:
+        """ Copy of this tariff carrying forward the period peaks of an earlier
+        application, so that the next billing run only needs its own periods
+        """
+        peaks = np.concatenate([
+            np.asarray(self.carried_peaks or [], dtype=float),
+            applied_charge.charge_ts['peak'].to_numpy(dtype=float)
+        ])
+        return replace(
+            self,
+            carried_peaks=peaks[-self.lookback_periods:].tolist()
+        )
+
+
+@dataclass
+class RollingDemandTariff(Tariff):
+    """ Charge applied to the peak rolling average consumption for a given period
+    (e.g. highest 30 minute average demand in a month, measured from 1 minute data)
+    May additionally be specific to times of day
+    """
+    rate: float
+    frequency_applied: FrequencyOption
+    window: Union[SampleRate, timedelta]
+    time_window: TimeWindow = None
+
+    def __post_init__(self):
+        super().__post_init__()
+        if isinstance(self.window, dict):
+            self.window = SampleRate(**self.window)
+
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        peaks = consumption.rolling_period_peaks(
+            self.frequency_applied,
+            self.window,
+            within_times=self.time_window
+        )
+        charge_vector = (peaks * self.rate).rename('charge')
+        return AppliedCharge(
+            self.name,
+            charge_vector,
+            self.rate_unit,
+            consumption.units,
+            charge_vector.sum()
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        peaks = consumption.rolling_period_peaks(self.frequency_applied, self.window, within_times=self.time_window)
+        bounds = consumption.period_bounds(self.frequency_applied).reindex(peaks.index)
+        return ChargeTable.of_periods(self.name, ['demand'], 0, bounds, peaks.to_numpy(), self.rate)
+
+    def apply_batch(
+            self,
+            values: np.ndarray,
+            index: pd.DatetimeIndex,
+            sample_rate: Union[SampleRate, timedelta],
+            billing_cycles: List[datetime] = None,
+    ) -> pd.DataFrame:
+        """ Charges per period (rows) for many meters sharing an index (with
+        the given sample rate, and billing cycles for frequency 'cycle'),
+        with values given as a meters x intervals array
+        """
+        peaks, labels = rolling_period_peaks_array(
+            values,
+            index,
+            self.frequency_applied,
+            window_samples(self.window, sample_rate),
+            self.time_window,
+            billing_cycles
+        )
+        return pd.DataFrame(np.atleast_2d(peaks).T * self.rate, index=labels)
+
+    def grid_rolled(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ Rolling average of values on grid, NaN outside of time_window
+        """
+        rolled = kernels.rolling_mean(values, window_samples(self.window, grid.sample_rate))
+        if self.time_window:
+            rolled[..., ~grid.time_window_mask(self.time_window)] = np.nan
+        return rolled
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        columns, starts, _ = grid.segments(self.frequency_applied)
+        peaks = kernels.segment_max(self.grid_rolled(values, grid)[..., columns], starts)
+        return np.nansum(peaks * self.rate, axis=-1)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ rate / window samples on each interval of the peak window of each period
+        """
+        window = window_samples(self.window, grid.sample_rate)
+        columns, starts, _ = grid.segments(self.frequency_applied)
+        ends = kernels.segment_argmax(self.grid_rolled(values, grid)[columns], starts)
+        ends = np.arange(len(values))[columns][ends[ends >= 0]]
+        costs = np.zeros(len(values))
+        np.add.at(costs, (ends[:, None] - np.arange(window)).ravel(), self.rate / window)
+        return costs
+
+
+@dataclass
+class TopNDemandTariff(Tariff):
+    """ Charge applied to the average of the n highest daily (or other
+    peak_frequency) peaks within a given period
+    (e.g. mean of the 4 highest daily peaks in a month)
+    """
+    rate: float
+    frequency_applied: FrequencyOption
+    n_peaks: int
+    peak_frequency: FrequencyOption = 'day'
+    time_window: TimeWindow = None
+
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        peaks = consumption.top_n_period_peaks(
+            self.frequency_applied,
+            self.n_peaks,
+            peak_frequency=self.peak_frequency,
+            within_times=self.time_window
+        )
+        charge_vector = (peaks * self.rate).rename('charge')
         return AppliedCharge(
             self.name,
             charge_vector,
@@ -162,6 +895,73 @@ class DemandTariff(Tariff):
             charge_vector.sum()
         )
 
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        peaks = consumption.top_n_period_peaks(
+            self.frequency_applied,
+            self.n_peaks,
+            peak_frequency=self.peak_frequency,
+            within_times=self.time_window
+        )
+        bounds = consumption.period_bounds(self.frequency_applied).reindex(peaks.index)
+        return ChargeTable.of_periods(self.name, ['demand'], 0, bounds, peaks.to_numpy(), self.rate)
+
+    def apply_batch(
+            self,
+            values: np.ndarray,
+            index: pd.DatetimeIndex,
+            billing_cycles: List[datetime] = None,
+    ) -> pd.DataFrame:
+        """ Charges per period (rows) for many meters sharing an index (and
+        billing cycles, for frequency 'cycle'), with values given as a meters
+        x intervals array
+        """
+        peaks, labels = top_n_period_peaks_array(
+            values,
+            index,
+            self.frequency_applied,
+            self.n_peaks,
+            self.peak_frequency,
+            self.time_window,
+            billing_cycles
+        )
+        return pd.DataFrame(np.atleast_2d(peaks).T * self.rate, index=labels)
+
+    def grid_peaks(
+            self,
+            values: np.ndarray,
+            grid: TimeGrid
+    ) -> Tuple[np.ndarray, slice, np.ndarray, np.ndarray, np.ndarray]:
+        """ Values within the periods on grid (NaN outside of time_window),
+        their grid columns, peak_frequency peaks and the start of each peak
+        and each period of peaks (see peak_period_segments)
+        """
+        values = np.array(values, dtype=float)
+        if self.time_window:
+            values[..., ~grid.time_window_mask(self.time_window)] = np.nan
+        columns, peak_starts, starts, _ = grid.memo(
+            ('peak_periods', self.peak_frequency, self.frequency_applied),
+            lambda: peak_period_segments(grid.index, self.frequency_applied, self.peak_frequency, grid.billing_cycles)
+        )
+        values = values[..., columns]
+        return values, columns, kernels.segment_max(values, peak_starts), peak_starts, starts
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        _, _, peaks, _, starts = self.grid_peaks(values, grid)
+        return np.nansum(kernels.segment_top_n_mean(peaks, starts, self.n_peaks) * self.rate, axis=-1)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ rate / number of peaks averaged, on the peak interval of each of
+        the top n peaks of each period
+        """
+        period_values, columns, peaks, peak_starts, starts = self.grid_peaks(values, grid)
+        peak_positions = np.arange(len(values))[columns][kernels.segment_argmax(period_values, peak_starts)]
+        costs = np.zeros(len(values))
+        for period in np.split(np.arange(len(peaks)), starts[1:]):
+            valid = period[~np.isnan(peaks[period])]
+            top = valid[np.argsort(-peaks[valid], kind='stable')[:self.n_peaks]]
+            costs[peak_positions[top]] += self.rate / max(len(top), 1)
+        return costs
+
 
 @dataclass
 class BlockTariff(Tariff):
@@ -170,56 +970,106 @@ class BlockTariff(Tariff):
     (e.g. $0.10/kWh for the first 1000kWh per month, $0.20/kWh for the second 1000kWh in same month)
 
     """
-    frequency_applied: str
+    frequency_applied: FrequencyOption
     blocks: List[Block]
     bin_rates: List[float]
     bin_labels: List[str]
+    # A rate and label per block, checked by validate_fields
+    same_length_fields: ClassVar[Tuple[str, ...]] = ('blocks', 'bin_rates', 'bin_labels')
 
     def apply(
             self,
             consumption: MeterData,
     ) -> AppliedCharge:
-        period_sums = consumption.period_sum(self.frequency_applied)
-        charge_ts = pd.DataFrame(period_sums)
-        charge_ts['charge_total'] = 0.0
-        for j, block in enumerate(self.blocks):
-            rate = self.bin_rates[j]
-            consumption_in_block = np.clip(
-                period_sums,
-                block.min,
-                block.max
-            ) - block.min
-            charge_col_name = f'block_{j + 1}_charge'
-            charge_ts[charge_col_name] = rate * consumption_in_block * self.adjustment_factor
-            charge_ts[f'block_{j + 1}_rate ({self.rate_unit})'] = rate
-            charge_ts['charge_total'] += charge_ts[charge_col_name]
+        charge_ts = consumption.period_sum(self.frequency_applied)
+        with profiling.stage('block_cost'):
+            block_costs = kernels.block_cost(
+                charge_ts['sum'].to_numpy(),
+                [block.min for block in self.blocks],
+                [block.max for block in self.blocks],
+                self.bin_rates
+            ) * self.adjustment_factor
+        with profiling.stage('dataframe'):
+            charge_ts['charge_total'] = block_costs.sum(axis=0)
+            for j, rate in enumerate(self.bin_rates):
+                charge_ts[f'block_{j + 1}_charge'] = block_costs[j]
+                charge_ts[f'block_{j + 1}_rate ({self.rate_unit})'] = rate
+        with profiling.stage('total'):
+            total = charge_ts['charge_total'].sum()
 
         return AppliedCharge(
             self.name,
             charge_ts,
             self.rate_unit,
             consumption.units,
-            sum(charge_ts['charge_total'])
+            total
+        )
+
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per period and block, with the consumption falling within
+        the block as its quantity
+        """
+        totals = consumption.period_sum(self.frequency_applied)['sum'].to_numpy()
+        consumed = kernels.block_consumption(
+            totals,
+            [block.min for block in self.blocks],
+            [block.max for block in self.blocks]
+        )
+        return ChargeTable.of_periods(
+            self.name,
+            [f'block_{j + 1}' for j in range(len(self.blocks))],
+            np.arange(len(self.blocks)),
+            consumption.period_bounds(self.frequency_applied),
+            consumed.T,
+            np.asarray(self.bin_rates, dtype=float) * self.adjustment_factor
         )
 
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        columns, starts, _ = grid.segments(self.frequency_applied)
+        block_costs = kernels.block_cost(
+            kernels.segment_sum(values[..., columns], starts),
+            [block.min for block in self.blocks],
+            [block.max for block in self.blocks],
+            self.bin_rates
+        ) * self.adjustment_factor
+        return block_costs.sum(axis=(-2, -1))
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ Rate of the block that each period's total falls in, on every
+        interval of the period
+        """
+        columns, starts, _ = grid.segments(self.frequency_applied)
+        totals = kernels.segment_sum(values[columns], starts)
+        mins = np.array([block.min for block in self.blocks], dtype=float)
+        maxs = np.array([block.max for block in self.blocks], dtype=float)
+        in_block = (totals[:, None] >= mins) & (totals[:, None] < maxs)
+        rates = (in_block * np.asarray(self.bin_rates, dtype=float)).sum(axis=1) * self.adjustment_factor
+        costs = np.zeros(len(values))
+        costs[columns] = np.repeat(rates, kernels.segment_lengths(starts, len(costs[columns])))
+        return costs
+
 
 @dataclass
 class CapacityTariff(Tariff):
     """ Essentially a connection tariff that is multiplied by a specific capacity
+
+    With pro_rata, partially covered periods are charged in proportion to their coverage
     """
     capacity: float
     rate: float
     frequency_applied: FrequencyOption
+    pro_rata: bool = False
+
+    def __post_init__(self):
+        super().__post_init__()
+        _validate_periodic_frequency(self.name, self.frequency_applied, self.pro_rata)
 
     def apply(
             self,
             consumption: MeterData,
     ) -> AppliedCharge:
-        cost_ts = consumption.tseries.resample(
-            resample_schema[self.frequency_applied]
-        ).sum()
-        cost_ts = pd.DataFrame(cost_ts)
-        cost_ts['periods'] = self.capacity
+        cost_ts = _charged_periods(consumption, self.frequency_applied, self.pro_rata)
+        cost_ts['periods'] *= self.capacity
         cost_ts['charge'] = self.rate * cost_ts['periods']
         cost_ts[f'rate ({self.rate_unit})'] = self.rate
         return AppliedCharge(
@@ -227,27 +1077,55 @@ class CapacityTariff(Tariff):
             cost_ts,
             self.rate_unit,
             consumption.units,
-            sum(cost_ts['charge'])
+            cost_ts['charge'].sum()
         )
 
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        bounds, periods = _charged_period_bounds(consumption, self.frequency_applied, self.pro_rata)
+        return ChargeTable.of_periods(self.name, ['capacity'], 0, bounds, self.capacity * periods, self.rate)
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        periods = _grid_periods_charged(grid, self.frequency_applied, self.pro_rata)
+        return np.full(values.shape[:-1], self.rate * self.capacity * periods)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        return np.zeros(np.shape(values))
+
 
 @dataclass
 class CriticalPeakDemandTariff(Tariff):
     """ Charge calculated by multiplying the tariff rate by the
     average of peak demands during the critical time window on each
     nominated critical demand days
+
+    With pro_rata, periods of period_active only partially covered by the
+    consumption data are charged in proportion to their coverage
+
+    Window positions are looked up via an EventCalendar, which can be shared
+    between many critical peak tariffs (see EventCalendar.shared_by)
     """
     rate: float
     frequency_applied: FrequencyOption
     period_active: DateWindow
     critical_period: DateWindow
     critical_peak_windows: List[DatetimeWindow]
+    pro_rata: bool = False
+    event_calendar: EventCalendar = None
 
-    def apply(
-            self,
-            consumption: MeterData,
-    ) -> AppliedCharge:
+    def __post_init__(self):
+        super().__post_init__()
+        if self.event_calendar is None:
+            self.event_calendar = EventCalendar(list(self.critical_peak_windows))
+
+    def mean_of_peaks(self, values: np.ndarray, index: pd.DatetimeIndex) -> np.ndarray:
+        """ Mean of the critical peak window maxima for one meter (1D values)
+        or many meters sharing index (2D meters x intervals)
+        """
+        return self.event_calendar.window_maxima(values, index, self.critical_peak_windows).mean(axis=-1)
 
+    def warn_coverage(self, consumption: MeterData):
+        """ Warn if consumption does not cover the critical period or period_active
+        """
         if not consumption.window_covered(self.critical_period):
             warnings.warn(
                 f'The critical period tariff, {self.name}, was not applied '
@@ -263,31 +1141,73 @@ class CriticalPeakDemandTariff(Tariff):
             warnings.warn(
                 f'The critical period tariff, {self.name}, was not applied to the full period_active window'
                 f' because the consumption MeterData did not cover the full window'
+                + (' (partially covered periods are pro-rated)' if self.pro_rata else '')
             )
 
-        # Check critical peak windows are in critical period
-        mean_of_peaks = np.mean([
-            consumption.max_between(*window.as_tuple)
-            for window in self.critical_peak_windows
-        ])
-        charge = mean_of_peaks * self.rate
+    def apply(
+            self,
+            consumption: MeterData,
+    ) -> AppliedCharge:
+        self.warn_coverage(consumption)
+
+        charge = self.mean_of_peaks(consumption.to_numpy(), consumption.tseries.index) * self.rate
 
         # Get index grouped by frequency_applied period
-        charge_df = pd.DataFrame(index=consumption.groupby_freq_stats(
-            frequency=self.frequency_applied,
+        _, _, labels = consumption.segments(
+            self.frequency_applied,
             within_window=self.period_active
-            ).index
         )
+        charge_df = pd.DataFrame(index=labels)
         charge_df['charge'] = charge
+        if self.pro_rata:
+            charge_df['charge'] *= consumption.period_weights(
+                self.frequency_applied,
+                within_window=self.period_active
+            )
 
         return AppliedCharge(
             self.name,
             charge_df['charge'],
             self.rate_unit,
             consumption.units,
-            sum(charge_df['charge'])
+            charge_df['charge'].sum()
         )
 
+    def charge_table(self, consumption: MeterData) -> ChargeTable:
+        """ A row per period of period_active, with the (pro rata weighted)
+        mean of the critical peaks as its quantity
+        """
+        self.warn_coverage(consumption)
+        bounds = consumption.period_bounds(self.frequency_applied, within_window=self.period_active)
+        demand = np.full(len(bounds), self.mean_of_peaks(consumption.to_numpy(), consumption.tseries.index))
+        if self.pro_rata:
+            demand *= consumption.period_weights(self.frequency_applied, within_window=self.period_active).to_numpy()
+        return ChargeTable.of_periods(self.name, ['demand'], 0, bounds, demand, self.rate)
+
+    def batch_totals(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        charge = self.mean_of_peaks(values, grid.index) * self.rate
+        if self.pro_rata:
+            periods = grid.period_weights(self.frequency_applied, within_window=self.period_active).to_numpy()
+        else:
+            periods = np.ones(len(grid.segments(self.frequency_applied, within_window=self.period_active)[2]))
+        return np.nansum(charge[..., None] * periods, axis=-1)
+
+    def marginal_costs(self, values: np.ndarray, grid: TimeGrid) -> np.ndarray:
+        """ rate x periods charged / number of windows, on the peak interval
+        of each critical peak window
+        """
+        if self.pro_rata:
+            periods = grid.period_weights(self.frequency_applied, within_window=self.period_active).sum()
+        else:
+            periods = len(grid.segments(self.frequency_applied, within_window=self.period_active)[2])
+        starts, stops = self.event_calendar.positions(grid.index)
+        window_ids = self.event_calendar.window_ids(self.critical_peak_windows)
+        costs = np.zeros(len(values))
+        for start, stop in zip(starts[window_ids], stops[window_ids]):
+            if stop > start and not np.isnan(values[start:stop]).all():
+                costs[start + int(np.nanargmax(values[start:stop]))] += self.rate * periods / len(window_ids)
+        return costs
+
 
 # All tariffs should be added here - map facilitates
 # multi tarif instantiation via dicts etc
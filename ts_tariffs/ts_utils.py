@@ -3,9 +3,13 @@ from dataclasses import dataclass, field
 from datetime import time, timedelta, datetime, date
 from enum import Enum
 from types import MappingProxyType
-from typing import Union, List, Tuple, Dict, Callable
+from typing import Union, List, Tuple, Dict, Callable, ClassVar
 from dateutil.relativedelta import relativedelta
 
+import numpy as np
+
+from ts_tariffs import kernels
+
 
 # Immutable dict for helping pd groupby operations which need to report aggs
 # for nested times
@@ -14,7 +18,9 @@ period_cascades_map = MappingProxyType({
     'month': ['year', 'month'],
     'week': ['year', 'month', 'week', ],
     'day': ['date'],
-    'quarter': ['year', 'quarter']
+    'quarter': ['year', 'quarter'],
+    # Billing cycles are arbitrary per meter, see MeterData.billing_cycles
+    'cycle': ['cycle_start', 'cycle_end'],
 })
 
 # Immutable dict for mapping frequency strings with resample codes
@@ -39,6 +45,7 @@ class FrequencyOption(str, Enum):
     month = 'month'
     year = 'year'
     quarter = 'quarter'
+    cycle = 'cycle'
 
     @staticmethod
     def options_as_list():
@@ -284,4 +291,13 @@ class TouBins:
     time_bins: List[int]
     bin_rates: List[float]
     bin_labels: List[str]
+    # A rate and label per bin, checked by validate_fields
+    same_length_fields: ClassVar[Tuple[str, ...]] = ('time_bins', 'bin_rates', 'bin_labels')
+
+    def bin_index(self, hours: np.ndarray) -> np.ndarray:
+        return np.digitize(hours, bins=self.time_bins)
 
+    def rates_at(self, hours: np.ndarray) -> np.ndarray:
+        """ Rate applicable at each hour of day
+        """
+        return kernels.tou_gather(hours, self.time_bins, self.bin_rates)
@@ -0,0 +1,219 @@
+""" Validation and coercion of tariff definitions (e.g. parsed from JSON)
+into the objects expected by Tariff dataclasses
+
+A validator is compiled once per class from its type hints, so repeatedly
+loading tariffs of the same type only pays for the checks themselves
+"""
+import dataclasses
+from datetime import timedelta
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Union, get_args, get_origin, get_type_hints
+
+from ts_tariffs.meters import MeterData
+from ts_tariffs.ts_utils import SampleRate, TemporalWindow
+from ts_tariffs.utils import Block
+
+
+class TariffValidationError(ValueError):
+    """ Raised when a tariff definition does not match its tariff type
+    """
+    def __init__(self, name: str, errors: List[str]):
+        self.name = name
+        self.errors = errors
+        super().__init__(
+            f'Invalid definition for {name}:\n' + '\n'.join(f'  - {e}' for e in errors)
+        )
+
+
+def _coerce_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f'expected a number, got {type(value).__name__}')
+    return float(value)
+
+
+def _coerce_int(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f'expected an integer, got {type(value).__name__}')
+    return value
+
+
+def _coerce_timedelta(value):
+    if isinstance(value, timedelta):
+        return value
+    if isinstance(value, dict):
+        if 'base_freq' in value:
+            return SampleRate(**value)
+        return timedelta(**value)
+    raise TypeError(f'expected a timedelta or dict, got {type(value).__name__}')
+
+
+def _coerce_block(value):
+    if isinstance(value, dict):
+        value = (value['min'], value['max'])
+    if not isinstance(value, (tuple, list)) or len(value) != 2:
+        raise TypeError(f'expected a (min, max) pair, got {value!r}')
+    block = Block(_coerce_float(value[0]), _coerce_float(value[1]))
+    if block.min > block.max:
+        raise ValueError(f'block min ({block.min:g}) is greater than its max ({block.max:g})')
+    return block
+
+
+def _window_coercer(window_type):
+    def coerce(value):
+        if isinstance(value, window_type):
+            return value
+        if isinstance(value, dict):
+            return window_type(value['start'], value['end'])
+        if isinstance(value, (tuple, list)) and len(value) == 2:
+            return window_type(*value)
+        raise TypeError(f'expected a {window_type.__name__}, dict or (start, end) pair, got {value!r}')
+    return coerce
+
+
+def _enum_coercer(enum_type):
+    options = [e.value for e in enum_type]
+
+    def coerce(value):
+        if value not in options:
+            raise ValueError(f'{value!r} is not one of {options}')
+        return enum_type(value).value
+    return coerce
+
+
+def _instance_coercer(cls):
+    def coerce(value):
+        if not isinstance(value, cls):
+            raise TypeError(f'expected {cls.__name__}, got {type(value).__name__}')
+        return value
+    return coerce
+
+
+def _list_coercer(item_coercer):
+    def coerce(value):
+        if not isinstance(value, (list, tuple)):
+            raise TypeError(f'expected a list, got {type(value).__name__}')
+        return [item_coercer(item) for item in value]
+    return coerce
+
+
+def _union_coercer(coercers):
+    def coerce(value):
+        errors = []
+        for coercer in coercers:
+            try:
+                return coercer(value)
+            except (TypeError, ValueError, KeyError) as e:
+                errors.append(str(e))
+        raise TypeError(' or '.join(errors))
+    return coerce
+
+
+def _nested_dataclass_coercer(cls):
+    def coerce(value):
+        if isinstance(value, cls):
+            return value
+        if not isinstance(value, dict):
+            raise TypeError(f'expected {cls.__name__} or dict, got {type(value).__name__}')
+        try:
+            return cls(**validate_fields(cls, value))
+        except TariffValidationError as e:
+            # Reported under the field holding the nested definition
+            raise ValueError('; '.join(e.errors)) from None
+    return coerce
+
+
+def coercer_for(tp) -> Callable[[Any], Any]:
+    """ Function that validates a value against a type hint, converting
+    JSON-like values (dicts, lists, numbers) into the hinted type
+    """
+    origin = get_origin(tp)
+    if origin is Union:
+        return _union_coercer([coercer_for(arg) for arg in get_args(tp) if arg is not type(None)])
+    if origin in (list, List):
+        args = get_args(tp)
+        return _list_coercer(coercer_for(args[0]) if args else (lambda v: v))
+    if tp is Any:
+        return lambda v: v
+    if tp is float:
+        return _coerce_float
+    if tp is int:
+        return _coerce_int
+    if tp is Block:
+        return _coerce_block
+    if isinstance(tp, type):
+        if issubclass(tp, timedelta):
+            return _coerce_timedelta
+        if issubclass(tp, TemporalWindow):
+            return _window_coercer(tp)
+        if issubclass(tp, Enum):
+            return _enum_coercer(tp)
+        if issubclass(tp, MeterData):
+            return _instance_coercer(tp)
+        if dataclasses.is_dataclass(tp):
+            return _nested_dataclass_coercer(tp)
+        return _instance_coercer(tp)
+    return lambda v: v
+
+
+@lru_cache(maxsize=None)
+def compiled_validator(cls) -> Dict[str, tuple]:
+    """ Per-field (coercer, required, allows_none) for a dataclass, built
+    once per class
+    """
+    hints = get_type_hints(cls)
+    validator = {}
+    for f in dataclasses.fields(cls):
+        if not f.init:
+            continue
+        has_default = f.default is not dataclasses.MISSING or f.default_factory is not dataclasses.MISSING
+        hint = hints.get(f.name, Any)
+        allows_none = (has_default and f.default is None) or type(None) in get_args(hint)
+        validator[f.name] = (coercer_for(hint), not has_default, allows_none)
+    return validator
+
+
+def _length_errors(cls, kwargs: dict) -> List[str]:
+    """ Errors for the class's same_length_fields (e.g. one rate per time of
+    use bin) whose (valid) lists differ in length
+    """
+    lengths = {
+        field_name: len(kwargs[field_name])
+        for field_name in getattr(cls, 'same_length_fields', ())
+        if isinstance(kwargs.get(field_name), list)
+    }
+    if len(set(lengths.values())) > 1:
+        return [
+            ', '.join(lengths) + ' must have the same length, got '
+            + ', '.join(f'{field_name}={length}' for field_name, length in lengths.items())
+        ]
+    return []
+
+
+def validate_fields(cls, data: dict) -> dict:
+    """ Validate and coerce a dict of dataclass init params. All problems
+    are collected and raised together as a TariffValidationError
+    """
+    validator = compiled_validator(cls)
+    name = data.get('name', cls.__name__)
+    errors = [f'unexpected field "{key}"' for key in data if key not in validator]
+    kwargs = {}
+    for field_name, (coerce, required, allows_none) in validator.items():
+        if field_name not in data:
+            if required:
+                errors.append(f'missing required field "{field_name}"')
+            continue
+        value = data[field_name]
+        if value is None and allows_none:
+            kwargs[field_name] = None
+            continue
+        try:
+            kwargs[field_name] = coerce(value)
+        except (TypeError, ValueError, KeyError) as e:
+            errors.append(f'{field_name}: {e}')
+    errors += _length_errors(cls, kwargs)
+    if errors:
+        raise TariffValidationError(f'{cls.__name__} "{name}"', errors)
+    return kwargs